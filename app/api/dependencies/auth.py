@@ -1,33 +1,103 @@
 from typing import Optional
+import time
+import httpx
+import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from app.core.config import API_PREFIX
+from pydantic import ValidationError
+from starlette.requests import Request
+from app.core.config import API_PREFIX, SECRET_KEY, JWT_ALGORITHM, JWT_AUDIENCE, LOCAL_TOKEN_VERIFICATION
+from app.core.cache import TTLCache
 from app.models.users import UserInDB, UserPublic, ProfilePublic
 from app.db.repositories.users import UsersRepository
 # from pydantic import EmailStr
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"http://localhost:8000/api/users/login/token/")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"http://localhost:8000/api/users/login/token/", auto_error=False)
 
-def get_user_from_token(
+async def get_users_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state._users_client
+
+async def get_users_repository(
+    *,
+    client: httpx.AsyncClient = Depends(get_users_client),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+) -> UsersRepository:
+    return UsersRepository(client, token=token)
+
+async def get_users_cache(request: Request) -> TTLCache:
+    return request.app.state._users_cache
+
+def decode_token(token: str) -> dict:
+    try:
+        return jwt.decode(
+            token,
+            str(SECRET_KEY),
+            algorithms=[JWT_ALGORITHM],
+            audience=JWT_AUDIENCE or None,
+            options={"require": ["exp"], "verify_aud": bool(JWT_AUDIENCE)},
+        )
+    except jwt.PyJWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate token credentials.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+# claims a token needs to stand in for the users service, routes scope insurers and drivers by email
+USER_CLAIMS = ("email", "is_active", "is_superuser", "is_master")
+
+def get_user_from_claims(payload: dict) -> Optional[UserPublic]:
+    # tokens carrying the full account state can be trusted without asking the users service,
+    # None sends any other token to the users service
+    user_id = payload.get("user_id", payload.get("id"))
+    if user_id is None or any(payload.get(claim) is None for claim in USER_CLAIMS):
+        return None
+    try:
+        return UserPublic(
+            id=user_id,
+            email=payload["email"],
+            username=payload.get("username"),
+            email_verified=payload.get("email_verified", False),
+            is_active=payload["is_active"],
+            is_superuser=payload["is_superuser"],
+            is_master=payload["is_master"],
+        )
+    except ValidationError:
+        return None
+
+async def get_user_from_token(
     *,
     token: str = Depends(oauth2_scheme),
+    user_repo: UsersRepository = Depends(get_users_repository),
+    users_cache: TTLCache = Depends(get_users_cache),
 ) -> Optional[UserInDB]:
+    if LOCAL_TOKEN_VERIFICATION:
+        payload = decode_token(token)
+        user = users_cache.get(token)
+        if user:
+            return user
+        user = get_user_from_claims(payload)
+        if not user:
+            user = await user_repo.get_current_user(token=token)
+        if user:
+            users_cache.set(token, user, ttl=payload["exp"] - time.time())
+        return user
     try:
-        user_repo = UsersRepository()
-        user = user_repo.get_current_user(token=token)
+        user = await user_repo.get_current_user(token=token)
     except Exception as e:
         raise e
     return user
 
 
-def get_current_active_user(current_user: UserInDB = Depends(get_user_from_token)) -> Optional[UserPublic]:
+async def get_current_active_user(current_user: UserInDB = Depends(get_user_from_token)) -> Optional[UserPublic]:
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="No authenticated user.",
             headers={"WWW-Authenticate": "Bearer"},
         )
-        
+
     if not current_user.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -36,13 +106,12 @@ def get_current_active_user(current_user: UserInDB = Depends(get_user_from_token
         )
     return current_user
 
-def get_other_user_by_user_id(*,
-    token: str = Depends(oauth2_scheme),
+async def get_other_user_by_user_id(*,
+    user_repo: UsersRepository = Depends(get_users_repository),
     user_id: int
-  ):
+  ) -> Optional[ProfilePublic]:
     try:
-        user_repo = UsersRepository()
-        other_user = user_repo.get_other_user(token = token, user_id= user_id)
+        other_user = await user_repo.get_other_user(user_id= user_id)
     except Exception as e:
         raise e
     return other_user
@@ -2,12 +2,26 @@ from typing import Callable, Type
 from databases import Database
 from fastapi import Depends
 from starlette.requests import Request
-from app.db.repositories.base import BaseRepository
+from app.core.cache import InsuranceCompanyCache
+from app.db.repositories.base import BaseRepository, RepositoryRegistry
+from app.db.repositories.users import UsersRepository
+from app.api.dependencies.auth import get_users_repository
 
-def get_database(request: Request) -> Database:
+async def get_database(request: Request) -> Database:
     return request.app.state._db
+
+async def get_insurance_company_cache(request: Request) -> InsuranceCompanyCache:
+    return request.app.state._insurance_company_cache
+
+async def get_repository_registry(
+    db: Database = Depends(get_database),
+    users_repo: UsersRepository = Depends(get_users_repository),
+    insurance_company_cache: InsuranceCompanyCache = Depends(get_insurance_company_cache),
+) -> RepositoryRegistry:
+    # resolved once per request, so every repository of the request comes from the same registry
+    return RepositoryRegistry(db, users_repo=users_repo, insurance_company_cache=insurance_company_cache)
     
 def get_repository(Repo_type: Type[BaseRepository]) -> Callable:
-    def get_repo(db: Database = Depends(get_database)) -> Type[BaseRepository]:
-        return Repo_type(db)
+    async def get_repo(registry: RepositoryRegistry = Depends(get_repository_registry)) -> Type[BaseRepository]:
+        return registry.get(Repo_type)
     return get_repo
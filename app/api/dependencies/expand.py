@@ -0,0 +1,28 @@
+from typing import Any, Callable, Iterable, Optional
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.responses import Response
+from starlette.status import HTTP_400_BAD_REQUEST
+from app.models.expand import Expand
+
+
+def get_expand(allowed: Iterable[str]) -> Callable:
+    allowed = tuple(allowed)
+
+    async def get_expand_param(expand: Optional[str] = None) -> Expand:
+        try:
+            return Expand.parse(expand, allowed)
+        except ValueError as e:
+            raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return get_expand_param
+
+
+def expanded_response(content: Any, expand: Expand, response: Optional[Response] = None) -> Any:
+    # subtrees that were not requested are left unset on the models, and are dropped from the body.
+    # Headers set on the route's `response` (the next cursor) are copied, a returned response replaces it
+    if expand.is_full:
+        return content
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"} if response else None
+    return JSONResponse(content=jsonable_encoder(content, exclude_unset=True), headers=headers)
@@ -0,0 +1,89 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Type
+import csv
+import json
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from starlette.requests import Request
+from starlette.status import HTTP_413_REQUEST_ENTITY_TOO_LARGE, HTTP_415_UNSUPPORTED_MEDIA_TYPE
+from app.core.config import IMPORT_BATCH_SIZE, IMPORT_MAX_ROWS
+from app.api.dependencies.listing import NDJSON_MEDIA_TYPE
+
+CSV_MEDIA_TYPE = "text/csv"
+
+# a row number, the raw row and what was wrong with it
+InvalidRow = Tuple[int, Optional[Dict[str, Any]], List[str]]
+
+
+async def get_import_media_type(request: Request) -> str:
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type not in (CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE):
+        raise HTTPException(status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Send {CSV_MEDIA_TYPE} or {NDJSON_MEDIA_TYPE}")
+    return media_type
+
+
+async def iter_body_lines(request: Request) -> AsyncIterator[str]:
+    # the body is read as it arrives, only the current line is kept in memory
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8", errors="replace").rstrip("\r")
+
+
+async def iter_import_rows(request: Request, media_type: str) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Numbered rows of a CSV body with a header line, or of an NDJSON body, with the reason a row could not be parsed.
+
+    """
+    header = None
+    row = 0
+    async for line in iter_body_lines(request):
+        if not line.strip():
+            continue
+        if media_type == CSV_MEDIA_TYPE and header is None:
+            header = [name.strip() for name in next(csv.reader([line]))]
+            continue
+        row += 1
+        if row > IMPORT_MAX_ROWS:
+            raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"At most {IMPORT_MAX_ROWS} rows per import")
+        if media_type == CSV_MEDIA_TYPE:
+            values = next(csv.reader([line]))
+            if len(values) != len(header):
+                yield row, None, f"expected {len(header)} columns, got {len(values)}"
+            else:
+                yield row, dict(zip(header, values)), None
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield row, None, "invalid JSON"
+            continue
+        if isinstance(data, dict):
+            yield row, data, None
+        else:
+            yield row, None, "expected a JSON object"
+
+
+async def iter_import_batches(request: Request, media_type: str, model: Type[BaseModel],
+    invalid: List[InvalidRow]) -> AsyncIterator[List[Tuple[int, BaseModel]]]:
+    """
+    Validated rows in batches of IMPORT_BATCH_SIZE. Rows that fail to parse or validate are added to `invalid`.
+
+    """
+    batch = []
+    async for row, data, error in iter_import_rows(request, media_type):
+        if error is not None:
+            invalid.append((row, data, [error]))
+            continue
+        try:
+            batch.append((row, model(**data)))
+        except ValidationError as e:
+            invalid.append((row, data, [f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors()]))
+        if len(batch) == IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,63 @@
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+from datetime import datetime, timezone
+import json
+from fastapi import HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.status import HTTP_400_BAD_REQUEST
+from app.core.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_CHUNK_SIZE
+from app.models.accidents import AccidentFilter
+from app.models.pagination import PageParams, encode_cursor, decode_cursor
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+async def get_page_params(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+) -> PageParams:
+    try:
+        return PageParams(limit=limit, cursor=decode_cursor(cursor) if cursor else None)
+    except ValueError:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+async def get_accident_filter(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    closed_case: Optional[bool] = None,
+    city: Optional[str] = None,
+) -> AccidentFilter:
+    return AccidentFilter(date_from=to_naive_utc(date_from), date_to=to_naive_utc(date_to), closed_case=closed_case, city=city)
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # accident dates are TIMESTAMP columns, asyncpg only binds naive datetimes to them
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def get_cursor(page: PageParams, size: int) -> Optional[Tuple[int, ...]]:
+    if page.cursor and len(page.cursor) != size:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return page.cursor
+
+def set_next_cursor(response: Response, page: PageParams, items: Optional[List[Any]], key: Callable[[Any], Tuple[int, ...]]) -> None:
+    # a full page means there may be more rows after its last key
+    if items and len(items) == page.limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(items[-1]))
+
+async def get_ndjson_requested(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_response(items: AsyncIterator[Any], *, encode: Callable[[Any], Any] = dict, exclude_unset: bool = False) -> StreamingResponse:
+    # one JSON document per line, written in chunks as the rows come out of the database
+    async def lines():
+        chunk = []
+        async for item in items:
+            chunk.append(json.dumps(jsonable_encoder(encode(item), exclude_unset=exclude_unset)))
+            if len(chunk) == STREAM_CHUNK_SIZE:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
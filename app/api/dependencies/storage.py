@@ -0,0 +1,235 @@
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from multipart.multipart import MultipartParser, parse_options_header
+from multipart.exceptions import MultipartParseError
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.status import (
+    HTTP_206_PARTIAL_CONTENT,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+    HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+)
+from app.core.config import IMAGE_MAX_SIZE
+from app.core.storage import ImageStore, ImageUpload, SNIFF_SIZE
+from app.core.derivatives import DerivativeCache
+
+# stored content never changes, it is only private because it needs a token
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# room for the boundaries, part headers and small form fields around the images of a body
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+async def get_image_store(request: Request) -> ImageStore:
+    return request.app.state._image_store
+
+
+async def get_derivatives(request: Request) -> DerivativeCache:
+    return request.app.state._derivatives
+
+
+def check_content_length(request: Request, max_size: int) -> None:
+    # rejects a body announced as too large before any of it is read, chunked bodies are checked as they arrive
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Images are limited to {max_size} bytes")
+
+
+class MultipartPart:
+    def __init__(self, headers: Dict[bytes, bytes]) -> None:
+        disposition, options = parse_options_header(headers.get(b"content-disposition", b""))
+        self.name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        self.filename = filename.decode("latin-1") if filename is not None else None
+        self.content_type = headers.get(b"content-type", b"").decode("latin-1")
+
+
+class MultipartReader:
+    """
+    The parts of a multipart/form-data body, parsed as the body arrives so only the current chunk is held in memory.
+    A part is read with iter_part, or skipped by asking for the next one.
+
+    """
+
+    def __init__(self, request: Request) -> None:
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise HTTPException(status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Send multipart/form-data")
+        self.stream = request.stream()
+        self.events: Deque[Tuple[str, object]] = deque()
+        self.in_part = False
+        self.ended = False
+        self.headers: Dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_end": self.on_end,
+        })
+
+    def on_part_begin(self) -> None:
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        self.events.append(("part", MultipartPart(self.headers)))
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self.events.append(("data", data[start:end]))
+
+    def on_part_end(self) -> None:
+        self.events.append(("part_end", None))
+
+    def on_end(self) -> None:
+        self.events.append(("end", None))
+
+    async def next_event(self) -> Tuple[str, object]:
+        while not self.events:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Incomplete multipart body")
+            try:
+                if chunk:
+                    self.parser.write(chunk)
+                else:
+                    self.parser.finalize()
+            except MultipartParseError:
+                raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid multipart body")
+        return self.events.popleft()
+
+    async def next_part(self) -> Optional[MultipartPart]:
+        while not self.ended:
+            kind, value = await self.next_event()
+            if kind == "part":
+                self.in_part = True
+                return value
+            if kind == "part_end":
+                self.in_part = False
+            elif kind == "end":
+                self.ended = True
+        return None
+
+    async def iter_part(self) -> AsyncIterator[bytes]:
+        while self.in_part:
+            kind, value = await self.next_event()
+            if kind == "part_end":
+                self.in_part = False
+            elif value:
+                yield value
+
+    async def read_field(self, *, max_size: int = 1024) -> str:
+        value = b""
+        async for chunk in self.iter_part():
+            value += chunk
+            if len(value) > max_size:
+                raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Form fields are limited to {max_size} bytes")
+        return value.decode("utf-8", errors="replace")
+
+
+async def write_image_part(reader: MultipartReader, upload: ImageUpload, *, max_size: int = IMAGE_MAX_SIZE) -> str:
+    """
+    Streams the current part to the upload and returns its sniffed content type.
+    Oversize and non image content is rejected as soon as it shows.
+
+    """
+    sniffed = False
+    async for chunk in reader.iter_part():
+        await upload.write(chunk)
+        if upload.size > max_size:
+            raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Images are limited to {max_size} bytes")
+        if not sniffed and len(upload.head) >= SNIFF_SIZE:
+            sniffed = True
+            if upload.content_type is None:
+                raise HTTPException(status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Upload a JPEG, PNG, GIF, WebP or HEIF image")
+    if upload.content_type is None:
+        raise HTTPException(status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Upload a JPEG, PNG, GIF, WebP or HEIF image")
+    return upload.content_type
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # the weak comparison of If-None-Match
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    The (offset, length) of a single `bytes=` range, None when the header is ignored and everything is served.
+    Raises ValueError for a range that starts past the content.
+
+    """
+    unit, _, spec = range_header.partition("=")
+    first, dash, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or "," in spec or not dash:
+        return None
+    first, last = first.strip(), last.strip()
+    if first == "":
+        # the last `last` bytes
+        if not last.isdigit():
+            return None
+        if int(last) == 0:
+            raise ValueError(range_header)
+        offset, end = max(size - int(last), 0), size - 1
+    else:
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        offset = int(first)
+        if last and int(last) < offset:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    if offset >= size:
+        raise ValueError(range_header)
+    return offset, end - offset + 1
+
+
+def content_response(request: Request, *, etag: str, size: int, content_type: str,
+    iter_range: Callable[[int, int], AsyncIterator[bytes]]) -> Response:
+    """
+    Immutable content with its length, ETag and long lived cache headers.
+    A matching If-None-Match is answered with 304 and a single Range with 206, `iter_range(offset, length)` reads the bytes.
+
+    """
+    etag = f'"{etag}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_range(0, size), media_type=content_type, headers=headers)
+    offset, length = byte_range
+    headers["Content-Length"] = str(length)
+    headers["Content-Range"] = f"bytes {offset}-{offset + length - 1}/{size}"
+    return StreamingResponse(iter_range(offset, length), status_code=HTTP_206_PARTIAL_CONTENT, media_type=content_type, headers=headers)
@@ -1,7 +1,8 @@
-from typing import List
+from typing import List, Tuple
+import asyncio
 import datetime
 from pydantic import EmailStr
-from fastapi import APIRouter, Body, Depends, HTTPException, Form, File, UploadFile
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, HTTPException
 from starlette.status import (
     HTTP_200_OK,
     HTTP_201_CREATED,
@@ -12,20 +13,30 @@ from starlette.status import (
 )
 from app.models.users import UserPublic, UserInDB, ProfileSearch
 from app.models.accidents import AccidentPublic, AccidentCreate
-from app.models.accident_statement import Accident_statement_Create, Accident_statement_Public, Accident_statement_Update, Accident_Statement_Detection_Update
+from app.models.accident_statement import Accident_statement_Create, Accident_statement_InDB, Accident_statement_Public, Accident_statement_Update, Accident_Statement_Detection_Update
 from app.models.temporary_accident_driver_data import Temporary_Data_Create, Temporary_Data_InDB, Temporary_Data_Public, Temporary_Data_Update
 from app.models.accident_statement_sketch import Accident_Sketch_InDB, Accident_Sketch_Public, Accident_Sketch_Update, Accident_Sketch_Create
 from app.db.repositories.vehicles import VehiclesRepository
 from app.db.repositories.accident import AccidentRepository
-from app.models.accident_image import Accident_Image_Public, Accident_Image_Create
+from app.models.accident_image import Accident_Image_Public, Accident_Image_Create, Accident_Image_InDB, ImageSize
 from app.db.repositories.accident_statement import AccidentStatementRepository
 from app.db.repositories.accident_sketch import AccidentSketchRepository
-from app.db.repositories.accident_image import AccidentImageRepository
+from app.db.repositories.accident_image import AccidentImageRepository, LEGACY_CONTENT_TYPE
 from app.db.repositories.temporary_accident_driver_data import TemporaryRepository
 from app.api.dependencies.database import get_repository
 from app.api.dependencies.auth import get_current_active_user
-from fastapi.responses import FileResponse, StreamingResponse
-import io, os
+from app.api.dependencies.storage import get_image_store, get_derivatives, check_content_length, content_response, MultipartReader, write_image_part
+from app.core.config import IMAGE_MAX_SIZE, IMAGE_MAX_PER_STATEMENT, IMAGE_UPLOAD_CONCURRENCY, IMAGE_DERIVATIVES_EAGER
+from app.core.storage import ImageStore, ImageUpload, iter_file_chunks
+from app.core.derivatives import DerivativeCache, DERIVATIVE_CONTENT_TYPE
+from fastapi.responses import FileResponse
+from starlette.requests import Request
+from starlette.responses import Response
+from app.models.accidents import AccidentFilter
+from app.models.pagination import PageParams
+from app.api.dependencies.listing import get_page_params, get_accident_filter, get_cursor, set_next_cursor, get_ndjson_requested, ndjson_response
+from app.api.dependencies.expand import get_expand, expanded_response
+from app.models.expand import Expand, ACCIDENT_EXPANSIONS
 
 router = APIRouter()
 
@@ -45,24 +56,20 @@ async def create_new_accident(vehicle_id : int,
 
 @router.get("/{id}/", response_model=AccidentPublic, name="accident:get-accident-by-id")
 async def get_accident_by_id(id: int,
+    expand: Expand = Depends(get_expand(ACCIDENT_EXPANSIONS)),
     current_user: UserPublic = Depends(get_current_active_user),
     accident_repo: AccidentRepository = Depends(get_repository(AccidentRepository)),
     accidentstmt_repo: AccidentStatementRepository = Depends(get_repository(AccidentStatementRepository)))\
                                         -> AccidentPublic:
     if current_user.is_superuser:
-        return await accident_repo.get_accident_by_id(id = id)
+        return expanded_response(await accident_repo.get_accident_by_id(id = id, expand=expand), expand)
     else:
-        print("ok")
-        accident = await accident_repo.get_accident_from_user_with_statement_id(id=id, user_id = current_user.id)
-        accident1 = await accident_repo.get_accident_by_temporary_driver_by_email(id=id, email = current_user.email)
+        accident = await accident_repo.get_accident_from_user_with_statement_id(id=id, user_id = current_user.id, expand=expand)
         if not accident:
-            if not accident1: 
-                raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No accident found")
-            else:       
-                accident = accident1
-                return accident
-        else:
-            return accident
+            accident = await accident_repo.get_accident_by_temporary_driver_by_email(id=id, email = current_user.email, expand=expand)
+        if not accident:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No accident found")
+        return expanded_response(accident, expand)
 
 @router.post("/temporary/{accident_id}/",
  response_model=Temporary_Data_Public, 
@@ -107,31 +114,54 @@ async def add_other_drivers_by_accident_id(accident_id : int,
 
 @router.get("/", response_model=List[AccidentPublic], name="accident:get-accidents-by-user-id")
 async def get_accidents_by_id(
+    response: Response,
+    page: PageParams = Depends(get_page_params),
+    accident_filter: AccidentFilter = Depends(get_accident_filter),
+    expand: Expand = Depends(get_expand(ACCIDENT_EXPANSIONS)),
+    ndjson: bool = Depends(get_ndjson_requested),
     current_user: UserPublic = Depends(get_current_active_user),
     accident_repo: AccidentRepository = Depends(get_repository(AccidentRepository)),
     ) -> List[AccidentPublic]:
+    cursor = get_cursor(page, 1)
+    if ndjson and not current_user.is_master:
+        if current_user.is_superuser:
+            accidents = accident_repo.iterate_all_accidents_by_insurance_company(insurance_company_email=current_user.email,
+                accident_filter=accident_filter, cursor=cursor and cursor[0], expand=expand)
+        else:
+            accidents = accident_repo.iterate_accidents_by_user_id(user_id = current_user.id, email=current_user.email,
+                accident_filter=accident_filter, cursor=cursor and cursor[0], expand=expand)
+        return ndjson_response(accidents, encode=lambda accident: accident, exclude_unset=not expand.is_full)
     if current_user.is_master:
         accidents = []
     elif current_user.is_superuser:
-        return await accident_repo.get_all_accidents_by_insurance_company(insurance_company_email=current_user.email)
+        accidents = await accident_repo.get_all_accidents_by_insurance_company(insurance_company_email=current_user.email,
+            accident_filter=accident_filter, limit=page.limit, cursor=cursor and cursor[0], expand=expand)
     else:
-        accidents = await accident_repo.get_accidents_by_user_id(user_id = current_user.id, email=current_user.email)
-        if not accidents:
+        accidents = await accident_repo.get_accidents_by_user_id(user_id = current_user.id, email=current_user.email,
+            accident_filter=accident_filter, limit=page.limit, cursor=cursor and cursor[0], expand=expand)
+        if not accidents and not cursor:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No accident found")
-    return accidents
+    set_next_cursor(response, page, accidents, key=lambda accident: (accident.id,))
+    return expanded_response(accidents or [], expand, response)
 
 @router.post("/useraccidents/{user_id}", response_model=List[AccidentPublic], name="accident:master-get-accidents-by-user-id")
 async def get_master_accidents_by_id(
     user_id:int,
+    response: Response,
+    page: PageParams = Depends(get_page_params),
+    accident_filter: AccidentFilter = Depends(get_accident_filter),
     searched_user: ProfileSearch = Body(..., embed=True),
     current_user: UserPublic = Depends(get_current_active_user),
     accident_repo: AccidentRepository = Depends(get_repository(AccidentRepository)),
     ) -> List[AccidentPublic]:
     print(searched_user)
     if current_user.is_master:
-        accidents = await accident_repo.get_accidents_by_user_id_master(user_search = searched_user)
+        cursor = get_cursor(page, 1)
+        accidents = await accident_repo.get_accidents_by_user_id_master(user_search = searched_user,
+            accident_filter=accident_filter, limit=page.limit, cursor=cursor and cursor[0])
         if not accidents:
             accidents = []
+        set_next_cursor(response, page, accidents, key=lambda accident: (accident.id,))
         return accidents
     else:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="You have not access to this accident")
@@ -150,7 +180,7 @@ async def create_new_accident_statement(
     accident = await accident_repo.get_accident_by_id(id = accident_id)
     accident_permission = await temporary_repo.get_temporary_driver_data_by_driver_email(accident_id=accident_id, email=current_user.email)    
     print(accident_permission)
-    vehicle = await vehicles_repo.get_vehicle_by_user_id_digit(sign = accident_permission['vehicle_sign'], user_id = current_user.id)
+    vehicle = await vehicles_repo.get_vehicle_by_user_id_plate(sign = accident_permission['vehicle_sign'], user_id = current_user.id)
     if not vehicle:
         raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST, detail="You should add vehicle first."
@@ -274,41 +304,134 @@ async def remove_accident_driver(
     accident_upd = await accident_repo.get_accident_from_user_with_statement_id(id = accident.id, user_id = current_user.id, populate = True)
     return accident_upd
 
+async def get_accident_statement_for_new_images(accident_id: str, *, current_user: UserPublic,
+    accident_stmt_repo: AccidentStatementRepository, accident_image_repo: AccidentImageRepository, count: int = 1) -> Tuple[Accident_statement_InDB, int]:
+    # the statement and how many more images it takes, at least `count`
+    if not accident_id.strip().isdigit():
+        raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail="accident_id must be an integer")
+    accident_stmt = await accident_stmt_repo.get_accident_statement_by_accident_id_user_id(accident_id= int(accident_id),
+        user_id = current_user.id, populate = False)
+    if not accident_stmt:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="You can not add image")
+    if accident_stmt.done:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="You have declared this accident statement as completed")
+    free = IMAGE_MAX_PER_STATEMENT - len(await accident_image_repo.get_image_count(statement_id = accident_stmt.id))
+    if free < count:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"An accident statement can have at most {IMAGE_MAX_PER_STATEMENT} images")
+    return accident_stmt, free
+
 @router.post("/newImage", name="accident:add-accident-image")
 async def create_new_accident_image(
- accident_id:  int = Form(...),
- image: UploadFile = File(...),
+ request: Request,
+ background_tasks: BackgroundTasks,
  current_user: UserPublic = Depends(get_current_active_user),
  accident_image_repo: AccidentImageRepository = Depends(get_repository(AccidentImageRepository)),
  accident_stmt_repo: AccidentStatementRepository = Depends(get_repository(AccidentStatementRepository)),
+ image_store: ImageStore = Depends(get_image_store),
+ derivatives: DerivativeCache = Depends(get_derivatives),
     ):
-
-    accident_stmt = await accident_stmt_repo.get_accident_statement_by_accident_id_user_id(accident_id= accident_id, user_id = current_user.id)
-    if not accident_stmt:
-        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="You can not add image")
-    print("OK")
-    if accident_stmt.done:
-        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="You have declared this accident statement as completed")  
-
-    contentsImage = await image.read()
-    new_accident_image = Accident_Image_Create(statement_id=accident_stmt.id, image = contentsImage)
+    # a multipart body with accident_id and image fields. The image is streamed to the store as it arrives
+    # and only kept once the statement is checked, whichever field comes first
+    check_content_length(request, IMAGE_MAX_SIZE)
+    reader = MultipartReader(request)
+    accident_stmt = None
+    content_type = None
+    async with image_store.open_upload() as upload:
+        part = await reader.next_part()
+        while part is not None:
+            if part.name == "accident_id" and accident_stmt is None:
+                accident_stmt, _ = await get_accident_statement_for_new_images(await reader.read_field(), current_user=current_user,
+                    accident_stmt_repo=accident_stmt_repo, accident_image_repo=accident_image_repo)
+            elif part.name == "image" and content_type is None:
+                content_type = await write_image_part(reader, upload)
+            part = await reader.next_part()
+        if accident_stmt is None or content_type is None:
+            raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail="Send the accident_id and image fields")
+        digest, size = await upload.commit()
+
+    new_accident_image = Accident_Image_Create(statement_id=accident_stmt.id, digest=digest, size=size, content_type=content_type)
     accident_image = await accident_image_repo.add_new_accident_image(new_accident_image = new_accident_image)
+    if not accident_image:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"An accident statement can have at most {IMAGE_MAX_PER_STATEMENT} images")
+    if IMAGE_DERIVATIVES_EAGER:
+        # thumbnails are rendered after the response, so the first listing does not wait for them
+        background_tasks.add_task(derivatives.render_all, digest, await image_store.get_local_path(digest))
     return accident_image
 
+@router.post("/newImages", name="accident:add-accident-images")
+async def create_new_accident_images(
+ request: Request,
+ background_tasks: BackgroundTasks,
+ current_user: UserPublic = Depends(get_current_active_user),
+ accident_image_repo: AccidentImageRepository = Depends(get_repository(AccidentImageRepository)),
+ accident_stmt_repo: AccidentStatementRepository = Depends(get_repository(AccidentStatementRepository)),
+ image_store: ImageStore = Depends(get_image_store),
+ derivatives: DerivativeCache = Depends(get_derivatives),
+    ) -> List[Accident_Image_InDB]:
+    # a multipart body with an accident_id field and an images field per image. The statement is checked once.
+    # Images are read one after the other, each is committed to the store while the next one arrives,
+    # IMAGE_UPLOAD_CONCURRENCY at a time. Images sent before the accident_id wait for it to be committed
+    check_content_length(request, IMAGE_MAX_SIZE * IMAGE_MAX_PER_STATEMENT)
+    reader = MultipartReader(request)
+    semaphore = asyncio.Semaphore(IMAGE_UPLOAD_CONCURRENCY)
+    async def commit(upload: ImageUpload):
+        async with semaphore:
+            return await upload.commit()
+    accident_stmt = None
+    # images the statement still takes, known once the accident_id arrives. Nothing is written to the store
+    # over the quota, the check of add_new_accident_images only catches concurrent uploads
+    free = IMAGE_MAX_PER_STATEMENT
+    uploads, content_types, commits = [], [], []
+    try:
+        part = await reader.next_part()
+        while part is not None:
+            if part.name == "accident_id" and accident_stmt is None:
+                accident_stmt, free = await get_accident_statement_for_new_images(await reader.read_field(), current_user=current_user,
+                    accident_stmt_repo=accident_stmt_repo, accident_image_repo=accident_image_repo, count=max(len(uploads), 1))
+            elif part.name == "images":
+                if len(uploads) == free:
+                    raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"An accident statement can have at most {IMAGE_MAX_PER_STATEMENT} images")
+                uploads.append(image_store.open_upload())
+                content_types.append(await write_image_part(reader, uploads[-1]))
+            if accident_stmt is not None:
+                commits.extend(asyncio.ensure_future(commit(upload)) for upload in uploads[len(commits):])
+            part = await reader.next_part()
+        if accident_stmt is None or not uploads:
+            raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail="Send the accident_id and images fields")
+        stored = await asyncio.gather(*commits)
+    finally:
+        # commits still running are let finish, so their files are not discarded from under them
+        await asyncio.gather(*commits, return_exceptions=True)
+        for upload in uploads:
+            await upload.discard()
+
+    new_accident_images = [Accident_Image_Create(statement_id=accident_stmt.id, digest=digest, size=size, content_type=content_type)
+        for (digest, size), content_type in zip(stored, content_types)]
+    accident_images = await accident_image_repo.add_new_accident_images(statement_id=accident_stmt.id,
+        new_accident_images=new_accident_images)
+    if not accident_images:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=f"An accident statement can have at most {IMAGE_MAX_PER_STATEMENT} images")
+    if IMAGE_DERIVATIVES_EAGER:
+        for digest in dict.fromkeys(image.digest for image in accident_images):
+            background_tasks.add_task(derivatives.render_all, digest, await image_store.get_local_path(digest))
+    return accident_images
+
 @router.get("/image/{id}", name="accident:get-accident-image")
 async def get_image_from_accident_stmt(
     id:int,
+    request: Request,
+    size: ImageSize = None,
     current_user: UserPublic = Depends(get_current_active_user),
     temporary_repo: TemporaryRepository = Depends(get_repository(TemporaryRepository)),
     accident_image_repo: AccidentImageRepository = Depends(get_repository(AccidentImageRepository)),
     accident_stmt_repo: AccidentStatementRepository = Depends(get_repository(AccidentStatementRepository)),
+    image_store: ImageStore = Depends(get_image_store),
+    derivatives: DerivativeCache = Depends(get_derivatives),
     ) -> bytes:
     image_data = await accident_image_repo.get_statement(id = id)
-    print(image_data.statement_id)
-    if not image_data.statement_id:
+    if not image_data or not image_data.statement_id:
          raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="You have not access to this accident")
     accident_stmt = await accident_stmt_repo.get_accident_statement_by_id(id=image_data.statement_id)
-    print(accident_stmt)
     if not accident_stmt:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="You have not access to this accident")
     temporary = await temporary_repo.get_all_temporary_driver_data_for_accident_id(accident_id=accident_stmt.accident_id)
@@ -316,10 +439,25 @@ async def get_image_from_accident_stmt(
     for temporary_accident_driver in temporary:
         email_list.append(temporary_accident_driver["driver_email"])
     if current_user.is_master or current_user.is_superuser or current_user.id == accident_stmt.user_id or current_user.email in email_list:
-        image = await accident_image_repo.get_image(id = id)
+        image = await accident_image_repo.get_image_file(id = id)
     else:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="You have not access to this accident")
-    return StreamingResponse(io.BytesIO(image.image), media_type="image/jpeg")
+    if image and not image.in_store:
+        # uploaded before the image store. It is moved on its first read rather than served from the table,
+        # which would hash the whole value for the ETag on every request
+        image = await accident_image_repo.move_image_to_store(id=id, store=image_store, content_type=LEGACY_CONTENT_TYPE)
+    if not image or not await image_store.exists(image.digest):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Image not found")
+    derivative = None
+    if size is not None:
+        # images that can not be resized (HEIC) are served as uploaded
+        derivative = await derivatives.get(image.digest, size.value, await image_store.get_local_path(image.digest))
+    if derivative is not None:
+        path, length = derivative
+        return content_response(request, etag=f"{image.digest}-{size.value}", size=length, content_type=DERIVATIVE_CONTENT_TYPE,
+            iter_range=lambda offset, length: iter_file_chunks(path, offset=offset, length=length))
+    return content_response(request, etag=image.digest, size=image.size, content_type=image.content_type,
+        iter_range=lambda offset, length: image_store.iter_chunks(image.digest, offset=offset, length=length))
 
 @router.get("/imageList/{accident_id}", name="accident:get-accident-image-list")
 async def get_image_count_from_accident_stmt(
@@ -1,18 +1,31 @@
 from typing import List
+import heapq
 from app.models.insurance_company import InsuranceCompanyPublic, InsuranceCompanyCreate
+from app.models.insurance import InsuranceImport, InsuranceImportResult
 from fastapi import APIRouter, Body, Depends, HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+from app.models.pagination import PageParams
+from app.api.dependencies.listing import get_page_params, get_cursor, set_next_cursor
+from app.api.dependencies.imports import get_import_media_type, iter_import_batches
 from app.db.repositories.insurance_company import InsuranceCompanyRepository
+from app.db.repositories.insurance import InsuranceRepository
 from app.api.dependencies.database import get_repository
-from starlette.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND
+from starlette.status import HTTP_201_CREATED, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND
 from app.models.users import UserPublic
 from app.api.dependencies.auth import get_current_active_user
 router = APIRouter()
 
 @router.get("/", name="insurance-companies:get-all-insurance-companies")
 async def get_all_insurance_companies(
+        response: Response,
+        page: PageParams = Depends(get_page_params),
         insurance_company_repo: InsuranceCompanyRepository = Depends(get_repository(InsuranceCompanyRepository))
 ):
-    return await insurance_company_repo.get_all_insurance_companies()
+    cursor = get_cursor(page, 1)
+    insurance_companies = await insurance_company_repo.get_all_insurance_companies(limit=page.limit, cursor=cursor and cursor[0])
+    set_next_cursor(response, page, insurance_companies, key=lambda insurance_company: (insurance_company.id,))
+    return insurance_companies
 
 
 @router.post("/", response_model=InsuranceCompanyPublic, name="insurance-company:create-insurance-company", status_code=HTTP_201_CREATED)
@@ -45,8 +58,33 @@ async def get_insurance_company_by_name(name: str, insurance_company_repo: Insur
     if not insurance_company:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No insurance company found with that name")     
 
-    return insurance_company                               
-
+    return insurance_company
 
 
+@router.post("/insurances/import", response_model=List[InsuranceImportResult], name="insurance-company:import-insurances")
+async def import_insurances(
+    request: Request,
+    media_type: str = Depends(get_import_media_type),
+    current_user: UserPublic = Depends(get_current_active_user),
+    insurance_company_repo: InsuranceCompanyRepository = Depends(get_repository(InsuranceCompanyRepository)),
+    insurances_repo: InsuranceRepository = Depends(get_repository(InsuranceRepository)),
+) -> List[InsuranceImportResult]:
+    # a CSV (with a header line) or NDJSON body of (plate, number, start_date, expire_date, damage_coverance) rows,
+    # answered with one result per row in row order. The results only exist once the whole import is written,
+    # it is a single statement in one transaction
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="No access")
+    insurance_company = await insurance_company_repo.get_insurance_company_by_email(email=current_user.email)
+    if not insurance_company:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No insurance company found with that email")
 
+    invalid = []
+    batches = iter_import_batches(request, media_type, InsuranceImport, invalid)
+    results = await insurances_repo.import_insurances(batches=batches, insurance_company_id=insurance_company.id)
+    # both are ordered by row already
+    return list(heapq.merge(
+        (InsuranceImportResult(row=result["row"], accepted=result["error"] is None, vehicle_id=result["vehicle_id"],
+            insurance_id=result["insurance_id"], errors=result["error"] and [result["error"]]) for result in results),
+        (InsuranceImportResult(row=row, accepted=False, errors=errors) for row, data, errors in invalid),
+        key=lambda result: result.row,
+    ))
@@ -1,5 +1,7 @@
 from typing import List
-from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from starlette.requests import Request
+from starlette.responses import Response
 from starlette.status import (
     HTTP_200_OK,
     HTTP_201_CREATED,
@@ -8,29 +10,63 @@ from starlette.status import (
     HTTP_404_NOT_FOUND,
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
-from app.models.vehicles import VehiclesCreate, VehiclesPublic
+from app.models.vehicles import (
+    VehiclesCreate,
+    VehiclesPublic,
+    VehicleSearchResult,
+    VehicleImportReport,
+    VehicleImportRow,
+    VehicleImportStatus,
+)
 from app.models.insurance import InsurancePublic, InsuranceAdd, InsuranceUpdate
 from app.models.users import UserPublic, UserInDB
 from app.models.roles import RolePublic, RoleUpdate, RoleCreate
+from app.models.pagination import PageParams
 from app.db.repositories.vehicles import VehiclesRepository
 from app.db.repositories.insurance import InsuranceRepository
 from app.db.repositories.roles import RolesRepository
 from app.api.dependencies.database import get_repository
 from app.api.dependencies.auth import get_current_active_user
+from app.api.dependencies.listing import get_page_params, get_cursor, set_next_cursor, get_ndjson_requested, ndjson_response
+from app.api.dependencies.expand import get_expand, expanded_response
+from app.api.dependencies.imports import get_import_media_type, iter_import_batches
+from app.models.expand import Expand, VEHICLE_EXPANSIONS
 
 router = APIRouter()
 
 @router.get("/all", response_model= List[VehiclesPublic], name="vehicles:get-all-vehicles")
 async def get_all_vehicles(
+        response: Response,
+        page: PageParams = Depends(get_page_params),
+        ndjson: bool = Depends(get_ndjson_requested),
         current_user: UserPublic = Depends(get_current_active_user),
         vehicles_repo: VehiclesRepository = Depends(get_repository(VehiclesRepository))
 ) -> List[VehiclesPublic]:
+    if current_user.is_master and ndjson:
+        return ndjson_response(vehicles_repo.iterate_all_vehicles(cursor=get_cursor(page, 2)), encode=lambda vehicle: VehiclesPublic(**vehicle))
     if current_user.is_master: 
-        return await vehicles_repo.get_all_vehicles()
+        vehicles = await vehicles_repo.get_all_vehicles(limit=page.limit, cursor=get_cursor(page, 2))
+        set_next_cursor(response, page, vehicles, key=lambda vehicle: (vehicle["id"], vehicle["role_id"]))
+        return vehicles
     else:
         raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="No access")
 
 
+@router.get("/search", response_model=List[VehicleSearchResult], name="vehicles:search-vehicles")
+async def search_vehicles(
+    q: str = Query(..., min_length=3, max_length=50),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: UserPublic = Depends(get_current_active_user),
+    vehicles_repo: VehiclesRepository = Depends(get_repository(VehiclesRepository)),
+) -> List[VehicleSearchResult]:
+    # partial or misspelled plates and insurance numbers, best match first
+    if current_user.is_superuser:
+        return await vehicles_repo.search_vehicles_by_insurance_company(query=q, insurance_company_email=current_user.email, limit=limit)
+    if current_user.is_master:
+        return await vehicles_repo.search_vehicles(query=q, limit=limit)
+    return await vehicles_repo.search_vehicles_by_user_id(query=q, user_id=current_user.id, limit=limit)
+
+
 @router.post("/", response_model=VehiclesPublic, name="vehicles:create-vehicle", status_code=HTTP_201_CREATED)
 async def create_new_vehicle(
     current_user: UserPublic = Depends(get_current_active_user),
@@ -40,29 +76,62 @@ async def create_new_vehicle(
     created_vehicle = await vehicles_repo.create_vehicle(new_vehicle=new_vehicle, id = current_user.id)
     return created_vehicle
 
+@router.post("/import", response_model=VehicleImportReport, name="vehicles:import-vehicles")
+async def import_vehicles(
+    request: Request,
+    media_type: str = Depends(get_import_media_type),
+    current_user: UserPublic = Depends(get_current_active_user),
+    vehicles_repo: VehiclesRepository = Depends(get_repository(VehiclesRepository)),
+) -> VehicleImportReport:
+    # a CSV (with a header line) or NDJSON body of VehiclesCreate rows, registered for the user as owner
+    invalid = []
+    batches = iter_import_batches(request, media_type, VehiclesCreate, invalid)
+    results = await vehicles_repo.import_vehicles(batches=batches, user_id=current_user.id)
+    report = VehicleImportReport(rows=[
+        *(VehicleImportRow(row=result["row"], status=result["status"], id=result["id"], sign=result["sign"]) for result in results),
+        *(VehicleImportRow(row=row, status=VehicleImportStatus.invalid, sign=(data or {}).get("sign"), errors=errors) for row, data, errors in invalid),
+    ])
+    report.rows.sort(key=lambda row: row.row)
+    for row in report.rows:
+        setattr(report, row.status.value, getattr(report, row.status.value) + 1)
+    return report
+
+
 @router.get("/no/{id}/", name="vehicles:get-vehicle-by-id")
 async def get_vehicle_by_id(id: int,
+    expand: Expand = Depends(get_expand(VEHICLE_EXPANSIONS)),
     current_user: UserPublic = Depends(get_current_active_user),
     vehicles_repo: VehiclesRepository = Depends(get_repository(VehiclesRepository))):
 
-    vehicle = await vehicles_repo.get_vehicle_by_id(id=id, user_id = current_user.id)
-    users_list = []
+    vehicle = await vehicles_repo.get_vehicle_by_id(id=id, user_id = current_user.id, expand=expand)
     if not vehicle:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No vehicle found with that id")
-    return vehicle
+    return expanded_response(vehicle, expand)
 
 
 @router.get("/", response_model= List, name="vehicles:get-all-vehicles-by-user-id")
 async def get_all_vehicles_by_user_id(
+    response: Response,
+    page: PageParams = Depends(get_page_params),
+    ndjson: bool = Depends(get_ndjson_requested),
     current_user: UserPublic = Depends(get_current_active_user),
     vehicles_repo: VehiclesRepository = Depends(get_repository(VehiclesRepository)),
 ) -> List:
+    cursor = get_cursor(page, 2)
+    if ndjson and current_user.is_superuser:
+        return ndjson_response(vehicles_repo.iterate_all_vehicles_by_insurance_company(insurance_company_email=current_user.email, cursor=cursor))
+    if ndjson and current_user.is_master:
+        return ndjson_response(vehicles_repo.iterate_all_vehicles(cursor=cursor))
     if current_user.is_superuser:
-        return await vehicles_repo.get_all_vehicles_by_insurance_company(insurance_company_email=current_user.email)
+        vehicles = await vehicles_repo.get_all_vehicles_by_insurance_company(insurance_company_email=current_user.email, limit=page.limit, cursor=cursor)
+        set_next_cursor(response, page, vehicles, key=lambda vehicle: (vehicle["id"], vehicle["insurance_id"]))
     elif current_user.is_master:
-        return await vehicles_repo.get_all_vehicles()
+        vehicles = await vehicles_repo.get_all_vehicles(limit=page.limit, cursor=cursor)
+        set_next_cursor(response, page, vehicles, key=lambda vehicle: (vehicle["id"], vehicle["role_id"]))
     else:
-        return await vehicles_repo.get_all_vehicles_by_user_id(id = current_user.id)
+        vehicles = await vehicles_repo.get_all_vehicles_by_user_id(id = current_user.id, limit=page.limit, cursor=cursor)
+        set_next_cursor(response, page, vehicles, key=lambda vehicle: (vehicle["id"], vehicle["insurance_id"]))
+    return vehicles
     
 
 @router.put("/{vehicle_id}/insurance", response_model=InsurancePublic, name="insurance:update-insurance-by-vehicle-id")
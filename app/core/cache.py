@@ -0,0 +1,94 @@
+import bisect
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+
+class TTLCache:
+    """
+    Bounded LRU cache where every entry carries its own expiry
+
+    """
+
+    def __init__(self, *, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, *, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class InsuranceCompanyCache:
+    """
+    Every insurance company of the database, indexed by id, name and email.
+    The table is tiny and rarely written, so it is loaded whole and dropped on writes or once `ttl` has passed.
+
+    """
+
+    def __init__(self, *, ttl: float) -> None:
+        self.ttl = ttl
+        self._by_id: Dict[int, Any] = {}
+        self._by_name: Dict[str, Any] = {}
+        self._by_email: Dict[str, Any] = {}
+        self._ids: List[int] = []
+        self._expires_at: Optional[float] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._expires_at is not None and self._expires_at > time.monotonic()
+
+    def load(self, companies: Iterable[Any]) -> None:
+        companies = sorted(companies, key=lambda company: company.id)
+        self._by_id = {company.id: company for company in companies}
+        self._by_name = {company.name: company for company in companies}
+        self._by_email = {company.email: company for company in companies}
+        self._ids = [company.id for company in companies]
+        self._expires_at = time.monotonic() + self.ttl
+
+    def invalidate(self) -> None:
+        self._expires_at = None
+
+    def get_by_id(self, id: int) -> Optional[Any]:
+        return self._by_id.get(id)
+
+    def get_by_name(self, name: str) -> Optional[Any]:
+        return self._by_name.get(name)
+
+    def get_by_email(self, email: str) -> Optional[Any]:
+        return self._by_email.get(email)
+
+    def page(self, *, cursor: int = -1, limit: Optional[int] = None) -> List[Any]:
+        # ascending id, the same order as a keyset page of the table
+        start = bisect.bisect_right(self._ids, cursor)
+        stop = None if limit is None else start + limit
+        return [self._by_id[id] for id in self._ids[start:stop]]
+
+    def __len__(self) -> int:
+        return len(self._ids)
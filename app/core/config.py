@@ -22,3 +22,32 @@ DATABASE_URL = config(
   default=f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
 )
 
+USERS_SERVICE_URL = config("USERS_SERVICE_URL", cast=str, default="http://sohereweare_server_1:8000")
+USERS_SERVICE_TIMEOUT = config("USERS_SERVICE_TIMEOUT", cast=float, default=5.0)
+USERS_SERVICE_RETRIES = config("USERS_SERVICE_RETRIES", cast=int, default=2)
+USERS_SERVICE_MAX_CONNECTIONS = config("USERS_SERVICE_MAX_CONNECTIONS", cast=int, default=20)
+USERS_SERVICE_MAX_KEEPALIVE = config("USERS_SERVICE_MAX_KEEPALIVE", cast=int, default=10)
+
+JWT_ALGORITHM = config("JWT_ALGORITHM", cast=str, default="HS256")
+JWT_AUDIENCE = config("JWT_AUDIENCE", cast=str, default="")
+LOCAL_TOKEN_VERIFICATION = config("LOCAL_TOKEN_VERIFICATION", cast=bool, default=False)
+USER_CACHE_SIZE = config("USER_CACHE_SIZE", cast=int, default=1024)
+USER_CACHE_TTL = config("USER_CACHE_TTL", cast=float, default=300.0)
+INSURANCE_COMPANY_CACHE_TTL = config("INSURANCE_COMPANY_CACHE_TTL", cast=float, default=300.0)
+
+DEFAULT_PAGE_SIZE = config("DEFAULT_PAGE_SIZE", cast=int, default=50)
+MAX_PAGE_SIZE = config("MAX_PAGE_SIZE", cast=int, default=500)
+STREAM_CHUNK_SIZE = config("STREAM_CHUNK_SIZE", cast=int, default=500)
+IMPORT_BATCH_SIZE = config("IMPORT_BATCH_SIZE", cast=int, default=1000)
+IMPORT_MAX_ROWS = config("IMPORT_MAX_ROWS", cast=int, default=50000)
+
+IMAGE_STORAGE_BACKEND = config("IMAGE_STORAGE_BACKEND", cast=str, default="local")
+IMAGE_STORAGE_PATH = config("IMAGE_STORAGE_PATH", cast=str, default="data/images")
+IMAGE_CHUNK_SIZE = config("IMAGE_CHUNK_SIZE", cast=int, default=64 * 1024)
+IMAGE_MAX_SIZE = config("IMAGE_MAX_SIZE", cast=int, default=20 * 1024 * 1024)
+IMAGE_MAX_PER_STATEMENT = config("IMAGE_MAX_PER_STATEMENT", cast=int, default=20)
+IMAGE_UPLOAD_CONCURRENCY = config("IMAGE_UPLOAD_CONCURRENCY", cast=int, default=4)
+IMAGE_DERIVATIVES_PATH = config("IMAGE_DERIVATIVES_PATH", cast=str, default="data/derivatives")
+IMAGE_DERIVATIVES_MAX_BYTES = config("IMAGE_DERIVATIVES_MAX_BYTES", cast=int, default=1024 * 1024 * 1024)
+IMAGE_DERIVATIVES_WORKERS = config("IMAGE_DERIVATIVES_WORKERS", cast=int, default=2)
+IMAGE_DERIVATIVES_EAGER = config("IMAGE_DERIVATIVES_EAGER", cast=bool, default=True)
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+import aiofiles.os
+from fastapi import FastAPI
+from PIL import Image, ImageOps, UnidentifiedImageError
+from app.core.config import (
+    IMAGE_DERIVATIVES_PATH,
+    IMAGE_DERIVATIVES_MAX_BYTES,
+    IMAGE_DERIVATIVES_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+makedirs = aiofiles.os.wrap(os.makedirs)
+path_exists = aiofiles.os.wrap(os.path.exists)
+touch = aiofiles.os.wrap(os.utime)
+
+# size -> longest edge in pixels
+DERIVATIVE_EDGES = {
+    "thumb": 256,
+    "medium": 1024,
+}
+DERIVATIVE_CONTENT_TYPE = "image/jpeg"
+DERIVATIVE_QUALITY = 80
+# the decoders Pillow may run on an upload, the formats sniff_image_type accepts that it can read
+DERIVATIVE_SOURCE_FORMATS = ("JPEG", "PNG", "GIF", "WEBP")
+# images remembered as unreadable, the oldest are retried once there are more
+DERIVATIVE_MAX_FAILED = 10000
+# the errors of an image itself, anything else (a crashed worker, a missing file) is retried on the next request
+DECODE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError)
+
+
+def render_derivative(source_path: str, target_path: str, max_edge: int) -> int:
+    """
+    Writes a JPEG of the image scaled to fit `max_edge` and returns its size in bytes.
+    Runs in a worker process, so decoding does not hold up the event loop.
+
+    """
+    tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    with Image.open(source_path, formats=DERIVATIVE_SOURCE_FORMATS) as image:
+        # JPEGs are decoded at the nearest smaller DCT scale, a fraction of the work of a full decode
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(tmp_path, "JPEG", quality=DERIVATIVE_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+def scan_derivatives(root: str) -> "OrderedDict[str, int]":
+    # path -> bytes, least recently used first
+    files = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, path, stat.st_size))
+    return OrderedDict((path, size) for _, path, size in sorted(files))
+
+
+class DerivativeCache:
+    """
+    Resized copies of stored images, rendered in a process pool on first use and kept on disk
+    as root/ab/<digest>-<size>.jpg. The least recently used files are removed once they take more than max_bytes.
+    A hit bumps the file's mtime, so the order survives restarts.
+
+    """
+
+    def __init__(self, root: str, *, max_bytes: int, create_executor: Callable[[], Executor]) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        # called again when a worker dies and takes the pool down with it
+        self.create_executor = create_executor
+        self.executor = create_executor()
+        self.files: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        # renders in flight, so concurrent requests for the same derivative wait for one render
+        self.pending: Dict[str, asyncio.Future] = {}
+        # images the renderer can not read are served whole rather than retried on every request
+        self.failed: "OrderedDict[str, None]" = OrderedDict()
+
+    async def load(self) -> None:
+        self.files = await asyncio.get_event_loop().run_in_executor(None, scan_derivatives, self.root)
+        self.total_bytes = sum(self.files.values())
+
+    def get_path(self, digest: str, size: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}-{size}.jpg")
+
+    async def get(self, digest: str, size: str, source_path: str) -> Optional[Tuple[str, int]]:
+        """
+        The path and length of the derivative, rendered from `source_path` when it is not cached.
+        None when the image can not be rendered.
+
+        """
+        path = self.get_path(digest, size)
+        if path in self.failed:
+            return None
+        if path in self.files and await path_exists(path):
+            self.files.move_to_end(path)
+            await touch(path)
+            return path, self.files[path]
+        if path not in self.pending:
+            self.pending[path] = asyncio.ensure_future(self.render(path, source_path, DERIVATIVE_EDGES[size]))
+            self.pending[path].add_done_callback(lambda _: self.pending.pop(path, None))
+        return await asyncio.shield(self.pending[path])
+
+    async def render_all(self, digest: str, source_path: str) -> None:
+        for size in DERIVATIVE_EDGES:
+            await self.get(digest, size, source_path)
+
+    async def render(self, path: str, source_path: str, max_edge: int) -> Optional[Tuple[str, int]]:
+        executor = self.executor
+        try:
+            await makedirs(os.path.dirname(path), exist_ok=True)
+            length = await asyncio.get_event_loop().run_in_executor(executor, render_derivative, source_path, path, max_edge)
+        except Exception as e:
+            logger.warn("--- IMAGE DERIVATIVE ERROR ---")
+            logger.warn(e)
+            logger.warn("--- IMAGE DERIVATIVE ERROR ---")
+            if isinstance(e, DECODE_ERRORS):
+                self.failed[path] = None
+                if len(self.failed) > DERIVATIVE_MAX_FAILED:
+                    self.failed.popitem(last=False)
+            elif isinstance(e, BrokenProcessPool) and executor is self.executor:
+                # renders that were waiting on the same pool fail with it, the first one replaces it
+                executor.shutdown(wait=False)
+                self.executor = self.create_executor()
+            return None
+        self.total_bytes += length - self.files.pop(path, 0)
+        self.files[path] = length
+        await self.evict()
+        return path, length
+
+    async def evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self.files) > 1:
+            path, length = self.files.popitem(last=False)
+            self.total_bytes -= length
+            if await path_exists(path):
+                await aiofiles.os.remove(path)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+async def connect_to_derivatives(app: FastAPI) -> None:
+    app.state._derivatives = DerivativeCache(
+        IMAGE_DERIVATIVES_PATH,
+        max_bytes=IMAGE_DERIVATIVES_MAX_BYTES,
+        create_executor=partial(ProcessPoolExecutor, max_workers=IMAGE_DERIVATIVES_WORKERS),
+    )
+    try:
+        await app.state._derivatives.load()
+    except Exception as e:
+        logger.warn("--- IMAGE DERIVATIVES CACHE ERROR ---")
+        logger.warn(e)
+        logger.warn("--- IMAGE DERIVATIVES CACHE ERROR ---")
+
+
+async def close_derivatives(app: FastAPI) -> None:
+    app.state._derivatives.close()
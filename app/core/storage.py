@@ -0,0 +1,220 @@
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import uuid
+from typing import AsyncIterator, Dict, Optional, Tuple, Type
+import aiofiles
+import aiofiles.os
+from fastapi import FastAPI
+from app.core.config import IMAGE_STORAGE_BACKEND, IMAGE_STORAGE_PATH, IMAGE_CHUNK_SIZE
+
+makedirs = aiofiles.os.wrap(os.makedirs)
+path_exists = aiofiles.os.wrap(os.path.exists)
+fsync = aiofiles.os.wrap(os.fsync)
+
+# bytes needed by sniff_image_type
+SNIFF_SIZE = 12
+
+# ISO base media brands of HEIF images, the format of most phone cameras
+HEIF_BRANDS = {
+    b"heic": "image/heic",
+    b"heix": "image/heic",
+    b"mif1": "image/heif",
+    b"msf1": "image/heif",
+}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """
+    The content type of an image from its first SNIFF_SIZE bytes, None when it is not an image we accept.
+
+    """
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return HEIF_BRANDS.get(head[8:12])
+    return None
+
+
+class ImageUpload(ABC):
+    """
+    Content being written to an ImageStore. It is hashed and counted as it is written,
+    and only becomes readable once committed. Leaving the context without committing discards it.
+
+    """
+
+    def __init__(self) -> None:
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+
+    @property
+    def content_type(self) -> Optional[str]:
+        return sniff_image_type(self.head)
+
+    async def write(self, chunk: bytes) -> None:
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        if len(self.head) < SNIFF_SIZE:
+            self.head = (self.head + chunk)[:SNIFF_SIZE]
+
+    @abstractmethod
+    async def commit(self) -> Tuple[str, int]:
+        """
+        Stores the content and returns its digest and size. Storing the same content twice keeps one copy.
+
+        """
+
+    @abstractmethod
+    async def discard(self) -> None:
+        pass
+
+    async def __aenter__(self) -> "ImageUpload":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.discard()
+
+
+class ImageStore(ABC):
+    """
+    Where the bytes of uploaded images live. Images are addressed by the sha256 digest of their content,
+    Postgres only keeps the digest, size and content type.
+
+    """
+
+    @abstractmethod
+    def open_upload(self) -> ImageUpload:
+        pass
+
+    async def put(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        async with self.open_upload() as upload:
+            async for chunk in chunks:
+                await upload.write(chunk)
+            return await upload.commit()
+
+    @abstractmethod
+    def iter_chunks(self, digest: str, *, offset: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        `length` bytes of the stored content from `offset` (all of it by default) in chunks,
+        FileNotFoundError when there is none.
+
+        """
+
+    @abstractmethod
+    async def exists(self, digest: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def get_local_path(self, digest: str) -> str:
+        """
+        A file on this machine with the content, for work done outside of the event loop.
+
+        """
+
+
+class LocalImageUpload(ImageUpload):
+
+    def __init__(self, store: "LocalImageStore") -> None:
+        super().__init__()
+        self.store = store
+        self.tmp_path = os.path.join(store.root, "tmp", uuid.uuid4().hex)
+        self.file = None
+
+    async def write(self, chunk: bytes) -> None:
+        if self.file is None:
+            await makedirs(os.path.dirname(self.tmp_path), exist_ok=True)
+            self.file = await aiofiles.open(self.tmp_path, "wb")
+        await super().write(chunk)
+        await self.file.write(chunk)
+
+    async def commit(self) -> Tuple[str, int]:
+        if self.file is None:
+            # nothing was written, an empty file still gets its digest
+            await self.write(b"")
+        await self.file.flush()
+        await fsync(self.file.fileno())
+        await self.file.close()
+        self.file = None
+        digest = self.sha256.hexdigest()
+        path = self.store.get_path(digest)
+        if await path_exists(path):
+            await aiofiles.os.remove(self.tmp_path)
+        else:
+            await makedirs(os.path.dirname(path), exist_ok=True)
+            # concurrent uploads of the same content rename the same bytes over each other
+            await aiofiles.os.rename(self.tmp_path, path)
+        return digest, self.size
+
+    async def discard(self) -> None:
+        if self.file is not None:
+            await self.file.close()
+            self.file = None
+        if await path_exists(self.tmp_path):
+            await aiofiles.os.remove(self.tmp_path)
+
+
+class LocalImageStore(ImageStore):
+    """
+    A directory sharded by the first bytes of the digest, root/ab/cd/abcd...
+    Content is written to root/tmp and renamed into place, so readers never see a partial file.
+
+    """
+
+    def __init__(self, root: str, *, chunk_size: int = IMAGE_CHUNK_SIZE) -> None:
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def get_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def open_upload(self) -> LocalImageUpload:
+        return LocalImageUpload(self)
+
+    def iter_chunks(self, digest: str, *, offset: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        return iter_file_chunks(self.get_path(digest), offset=offset, length=length, chunk_size=self.chunk_size)
+
+    async def get_local_path(self, digest: str) -> str:
+        return self.get_path(digest)
+
+    async def exists(self, digest: str) -> bool:
+        return await path_exists(self.get_path(digest))
+
+
+# IMAGE_STORAGE_BACKEND -> store, other backends are added here
+IMAGE_STORES: Dict[str, Type[ImageStore]] = {
+    "local": LocalImageStore,
+}
+
+
+def create_image_store() -> ImageStore:
+    return IMAGE_STORES[IMAGE_STORAGE_BACKEND](IMAGE_STORAGE_PATH)
+
+
+async def iter_file_chunks(path: str, *, offset: int = 0, length: Optional[int] = None,
+    chunk_size: int = IMAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as f:
+        if offset:
+            await f.seek(offset)
+        while length is None or length > 0:
+            chunk = await f.read(chunk_size if length is None else min(chunk_size, length))
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+
+
+async def iter_bytes(content: bytes, chunk_size: int = IMAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+
+async def connect_to_image_store(app: FastAPI) -> None:
+    app.state._image_store = create_image_store()
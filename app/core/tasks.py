@@ -1,12 +1,21 @@
 from typing import Callable
 from fastapi import FastAPI
-from app.db.tasks import connect_to_db, close_db_connection
+from app.db.tasks import connect_to_db, load_insurance_company_cache, close_db_connection
+from app.core.users_client import connect_to_users_service, close_users_service_connection
+from app.core.storage import connect_to_image_store
+from app.core.derivatives import connect_to_derivatives, close_derivatives
 
 def create_start_app_handler(app: FastAPI) -> Callable:
     async def start_app() -> None:
         await connect_to_db(app)
+        await load_insurance_company_cache(app)
+        await connect_to_users_service(app)
+        await connect_to_image_store(app)
+        await connect_to_derivatives(app)
     return start_app
 def create_stop_app_handler(app: FastAPI) -> Callable:
     async def stop_app() -> None:
+        await close_derivatives(app)
+        await close_users_service_connection(app)
         await close_db_connection(app)
     return stop_app
\ No newline at end of file
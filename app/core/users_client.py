@@ -0,0 +1,42 @@
+import httpx
+from fastapi import FastAPI
+from app.core.config import (
+    USERS_SERVICE_URL,
+    USERS_SERVICE_TIMEOUT,
+    USERS_SERVICE_MAX_CONNECTIONS,
+    USERS_SERVICE_MAX_KEEPALIVE,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+)
+from app.core.cache import TTLCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def create_users_client() -> httpx.AsyncClient:
+    # one client per worker, so connections to the users service are kept alive and reused
+    return httpx.AsyncClient(
+        base_url=USERS_SERVICE_URL,
+        timeout=httpx.Timeout(USERS_SERVICE_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=USERS_SERVICE_MAX_CONNECTIONS,
+            max_keepalive_connections=USERS_SERVICE_MAX_KEEPALIVE,
+        ),
+        headers={"accept": "application/json"},
+    )
+
+
+async def connect_to_users_service(app: FastAPI) -> None:
+    app.state._users_client = create_users_client()
+    # token -> UserPublic, so repeated requests with the same bearer token skip the users service
+    app.state._users_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+async def close_users_service_connection(app: FastAPI) -> None:
+    try:
+        await app.state._users_client.aclose()
+    except Exception as e:
+        logger.warn("--- USERS SERVICE DISCONNECT ERROR ---")
+        logger.warn(e)
+        logger.warn("--- USERS SERVICE DISCONNECT ERROR ---")
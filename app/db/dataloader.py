@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from databases import Database
+
+BatchFetch = Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+
+
+class DataLoader:
+    """
+    Request scoped identity map keyed by (table, id).
+
+    Every entity is fetched at most once per request, and all lookups for the same table
+    issued in the same loop tick are coalesced into one call of the repository batch fetch,
+    which runs a single `WHERE id = ANY(:ids)` query.
+
+    """
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self.cache: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self.batches: Dict[str, Tuple[BatchFetch, Dict[Hashable, asyncio.Future]]] = {}
+        self.dispatch_scheduled = False
+
+    def load(self, table: str, key: Hashable, fetch: BatchFetch) -> Awaitable[Optional[Any]]:
+        cache_key = (table, key)
+        if cache_key not in self.cache:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self.cache[cache_key] = future
+            self.batches.setdefault(table, (fetch, {}))[1][key] = future
+            if not self.dispatch_scheduled:
+                self.dispatch_scheduled = True
+                loop.call_soon(self.dispatch)
+        return self.cache[cache_key]
+
+    async def load_many(self, table: str, keys: Iterable[Hashable], fetch: BatchFetch) -> Dict[Hashable, Any]:
+        keys = list(dict.fromkeys(keys))
+        values = await asyncio.gather(*[self.load(table, key, fetch) for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def prime(self, table: str, key: Hashable, value: Any) -> None:
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(value)
+        self.cache[(table, key)] = future
+
+    def clear_all(self) -> None:
+        self.cache.clear()
+
+    def clear(self, table: str, key: Optional[Hashable] = None) -> None:
+        if key is not None:
+            self.cache.pop((table, key), None)
+            return
+        for cache_key in [cache_key for cache_key in self.cache if cache_key[0] == table]:
+            del self.cache[cache_key]
+
+    def dispatch(self) -> None:
+        self.dispatch_scheduled = False
+        batches, self.batches = self.batches, {}
+        for table, (fetch, futures) in batches.items():
+            asyncio.ensure_future(self.fetch_batch(table, fetch, futures))
+
+    async def fetch_batch(self, table: str, fetch: BatchFetch, futures: Dict[Hashable, asyncio.Future]) -> None:
+        try:
+            values = await fetch(list(futures))
+        except Exception as e:
+            for key, future in futures.items():
+                # a failed batch is not cached, the next lookup tries again
+                self.cache.pop((table, key), None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in futures.items():
+            if not future.done():
+                future.set_result(values.get(key))
@@ -0,0 +1,109 @@
+"""current role per vehicle and user
+
+Revision ID: 16843c3c1350
+Revises: e47936945e88
+Create Date: 2026-10-18 07:24:51.118306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = '16843c3c1350'
+down_revision = 'e47936945e88'
+branch_labels = None
+depends_on = None
+
+
+def create_current_roles_table() -> None:
+    # the newest role of every (vehicle, user) pair, roles are append only so that is the highest id
+    op.create_table(
+        "current_roles",
+        sa.Column("vehicle_id", sa.Integer, sa.ForeignKey('vehicles.id', ondelete="CASCADE"), primary_key=True),
+        sa.Column("user_id", sa.Integer, primary_key=True, index=True),
+        sa.Column("role_id", sa.Integer, sa.ForeignKey('roles.id', ondelete="CASCADE"), nullable=False, index=True),
+    )
+    op.create_index("ix_roles_vehicle_id_user_id_id", "roles", ["vehicle_id", "user_id", sa.text("id DESC")])
+
+
+def create_current_roles_trigger() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION refresh_current_roles(refreshed_vehicle_id INTEGER, refreshed_user_id INTEGER)
+            RETURNS VOID AS
+        $$
+        BEGIN
+            INSERT INTO current_roles (vehicle_id, user_id, role_id)
+            SELECT vehicle_id, user_id, id
+            FROM roles
+            WHERE vehicle_id = refreshed_vehicle_id AND user_id = refreshed_user_id
+            ORDER BY id DESC
+            LIMIT 1
+            ON CONFLICT (vehicle_id, user_id) DO UPDATE
+            SET role_id = EXCLUDED.role_id;
+            IF NOT FOUND THEN
+                DELETE FROM current_roles WHERE vehicle_id = refreshed_vehicle_id AND user_id = refreshed_user_id;
+            END IF;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_current_roles()
+            RETURNS TRIGGER AS
+        $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                IF NEW.vehicle_id IS NOT NULL AND NEW.user_id IS NOT NULL THEN
+                    INSERT INTO current_roles (vehicle_id, user_id, role_id)
+                    VALUES (NEW.vehicle_id, NEW.user_id, NEW.id)
+                    ON CONFLICT (vehicle_id, user_id) DO UPDATE
+                    SET role_id = GREATEST(current_roles.role_id, EXCLUDED.role_id);
+                END IF;
+                RETURN NULL;
+            END IF;
+            PERFORM refresh_current_roles(OLD.vehicle_id, OLD.user_id);
+            IF TG_OP = 'UPDATE' THEN
+                PERFORM refresh_current_roles(NEW.vehicle_id, NEW.user_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER update_current_roles
+            AFTER INSERT OR DELETE OR UPDATE OF vehicle_id, user_id
+            ON roles
+            FOR EACH ROW
+        EXECUTE PROCEDURE update_current_roles();
+        """
+    )
+
+
+def backfill_current_roles() -> None:
+    op.execute(
+        """
+        INSERT INTO current_roles (vehicle_id, user_id, role_id)
+        SELECT DISTINCT ON (vehicle_id, user_id) vehicle_id, user_id, id
+        FROM roles
+        WHERE vehicle_id IS NOT NULL AND user_id IS NOT NULL
+        ORDER BY vehicle_id, user_id, id DESC;
+        """
+    )
+
+
+def upgrade() -> None:
+    create_current_roles_table()
+    create_current_roles_trigger()
+    backfill_current_roles()
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER update_current_roles ON roles")
+    op.execute("DROP FUNCTION update_current_roles")
+    op.execute("DROP FUNCTION refresh_current_roles")
+    op.drop_index("ix_roles_vehicle_id_user_id_id", table_name="roles")
+    op.drop_table("current_roles")
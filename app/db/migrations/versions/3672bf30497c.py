@@ -0,0 +1,40 @@
+"""trigram indexes for vehicle search
+
+Revision ID: 3672bf30497c
+Revises: 9852d5a9c586
+Create Date: 2026-10-18 09:47:18.204917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = '3672bf30497c'
+down_revision = '9852d5a9c586'
+branch_labels = None
+depends_on = None
+
+# the normalized plate key is searched rather than the raw sign, so dashes, spaces and greek letters do not matter
+INDEXES = [
+    ("ix_vehicles_plate_key_trgm", "vehicles", "plate_key"),
+    ("ix_insurance_number_trgm", "insurance", "number"),
+]
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.create_index(
+                name, table, [column],
+                postgresql_using="gin",
+                postgresql_ops={column: "gin_trgm_ops"},
+                postgresql_concurrently=True,
+            )
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, column in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    op.execute("DROP EXTENSION IF EXISTS pg_trgm")
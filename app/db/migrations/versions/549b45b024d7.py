@@ -0,0 +1,39 @@
+"""staging table for bulk vehicle imports
+
+Revision ID: 549b45b024d7
+Revises: 3672bf30497c
+Create Date: 2026-10-18 10:21:36.782013
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = '549b45b024d7'
+down_revision = '3672bf30497c'
+branch_labels = None
+depends_on = None
+
+
+def create_vehicle_import_table() -> None:
+    # rows are COPY'd here and removed in the same transaction, so the table is unlogged and unconstrained
+    op.execute("CREATE SEQUENCE vehicle_import_id_seq")
+    op.create_table(
+        "vehicle_import",
+        sa.Column("import_id", sa.BigInteger, nullable=False, index=True),
+        sa.Column("row", sa.Integer, nullable=False),
+        sa.Column("sign", sa.Text, nullable=False),
+        sa.Column("type", sa.Text, nullable=False),
+        sa.Column("model", sa.Text, nullable=False),
+        sa.Column("manufacture_year", sa.Integer, nullable=False),
+        prefixes=["UNLOGGED"],
+    )
+
+
+def upgrade() -> None:
+    create_vehicle_import_table()
+
+def downgrade() -> None:
+    op.drop_table("vehicle_import")
+    op.execute("DROP SEQUENCE vehicle_import_id_seq")
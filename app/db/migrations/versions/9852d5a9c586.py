@@ -0,0 +1,48 @@
+"""normalized plate key of vehicles
+
+Revision ID: 9852d5a9c586
+Revises: cded039bc5a9
+Create Date: 2026-10-18 09:12:04.511372
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = '9852d5a9c586'
+down_revision = 'cded039bc5a9'
+branch_labels = None
+depends_on = None
+
+# greek plates only use the letters that look like latin ones
+GREEK_LETTERS = "ΑΒΕΖΗΙΚΜΝΟΡΤΥΧαβεζηικμνορτυχ"
+LATIN_LETTERS = "ABEZHIKMNOPTYXabezhikmnoptyx"
+
+
+def create_normalize_plate_function() -> None:
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION normalize_plate(plate TEXT)
+            RETURNS TEXT AS
+        $$
+            SELECT regexp_replace(upper(translate(plate, '{GREEK_LETTERS}', '{LATIN_LETTERS}')), '[^A-Z0-9]', '', 'g');
+        $$ language 'sql' IMMUTABLE STRICT;
+        """
+    )
+
+
+def add_plate_key_column() -> None:
+    # a stored generated column, so every insert and update of the sign keeps the key in sync
+    op.execute("ALTER TABLE vehicles ADD COLUMN plate_key TEXT GENERATED ALWAYS AS (normalize_plate(sign)) STORED")
+    op.create_index("ix_vehicles_plate_key", "vehicles", ["plate_key"])
+
+
+def upgrade() -> None:
+    create_normalize_plate_function()
+    add_plate_key_column()
+
+def downgrade() -> None:
+    op.drop_index("ix_vehicles_plate_key", table_name="vehicles")
+    op.drop_column("vehicles", "plate_key")
+    op.execute("DROP FUNCTION normalize_plate")
@@ -0,0 +1,40 @@
+"""staging table for bulk insurance imports
+
+Revision ID: afe47e49fb3f
+Revises: 549b45b024d7
+Create Date: 2026-10-18 11:02:51.339140
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = 'afe47e49fb3f'
+down_revision = '549b45b024d7'
+branch_labels = None
+depends_on = None
+
+
+def create_insurance_import_table() -> None:
+    # same lifecycle as vehicle_import, rows only live for the transaction of their import
+    op.execute("CREATE SEQUENCE insurance_import_id_seq")
+    op.create_table(
+        "insurance_import",
+        sa.Column("import_id", sa.BigInteger, nullable=False, index=True),
+        sa.Column("row", sa.Integer, nullable=False),
+        sa.Column("plate", sa.Text, nullable=False),
+        sa.Column("number", sa.Text, nullable=False),
+        sa.Column("start_date", sa.Date, nullable=False),
+        sa.Column("expire_date", sa.Date, nullable=False),
+        sa.Column("damage_coverance", sa.Boolean, nullable=False),
+        prefixes=["UNLOGGED"],
+    )
+
+
+def upgrade() -> None:
+    create_insurance_import_table()
+
+def downgrade() -> None:
+    op.drop_table("insurance_import")
+    op.execute("DROP SEQUENCE insurance_import_id_seq")
@@ -0,0 +1,43 @@
+"""indexes for the lookup predicates
+
+Revision ID: cded039bc5a9
+Revises: 16843c3c1350
+Create Date: 2026-10-18 07:52:37.640218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = 'cded039bc5a9'
+down_revision = '16843c3c1350'
+branch_labels = None
+depends_on = None
+
+# roles (vehicle_id, user_id, id) and insurance (vehicle_id, expire_date) come with the
+# current_roles and current_insurance projections
+INDEXES = [
+    ("ix_accident_statement_accident_id_user_id", "accident_statement", ["accident_id", "user_id"]),
+    ("ix_accident_statement_user_id", "accident_statement", ["user_id"]),
+    ("ix_accident_statement_insurance_id", "accident_statement", ["insurance_id"]),
+    ("ix_insurance_insurance_company_id", "insurance", ["insurance_company_id"]),
+    ("ix_temporary_accident_driver_data_accident_id_driver_email", "temporary_accident_driver_data", ["accident_id", "driver_email"]),
+    ("ix_temporary_accident_driver_data_driver_email", "temporary_accident_driver_data", ["driver_email"]),
+    ("ix_temporary_accident_driver_data_insurance_email", "temporary_accident_driver_data", ["insurance_email"]),
+    ("ix_accident_statement_image_statement_id", "accident_statement_image", ["statement_id"]),
+    ("ix_accident_statement_sketch_statement_id", "accident_statement_sketch", ["statement_id"]),
+    ("ix_insurance_company_email", "insurance_company", ["email"]),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can not run inside the migration transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
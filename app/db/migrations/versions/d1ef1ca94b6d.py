@@ -0,0 +1,33 @@
+"""accident images kept in the image store
+
+Revision ID: d1ef1ca94b6d
+Revises: afe47e49fb3f
+Create Date: 2026-10-18 11:38:52.140657
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = 'd1ef1ca94b6d'
+down_revision = 'afe47e49fb3f'
+branch_labels = None
+depends_on = None
+
+
+def add_stored_image_columns() -> None:
+    # the bytes move to the image store, the row keeps what is needed to find and serve them.
+    # `image` stays for rows that app.db.move_images has not moved yet
+    op.add_column("accident_statement_image", sa.Column("digest", sa.CHAR(64), nullable=True))
+    op.add_column("accident_statement_image", sa.Column("size", sa.BigInteger, nullable=True))
+    op.add_column("accident_statement_image", sa.Column("content_type", sa.Text, nullable=True))
+
+
+def upgrade() -> None:
+    add_stored_image_columns()
+
+def downgrade() -> None:
+    op.drop_column("accident_statement_image", "content_type")
+    op.drop_column("accident_statement_image", "size")
+    op.drop_column("accident_statement_image", "digest")
@@ -0,0 +1,101 @@
+"""current insurance per vehicle
+
+Revision ID: e47936945e88
+Revises: e037ae442e72
+Create Date: 2026-10-18 07:10:12.402913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic
+revision = 'e47936945e88'
+down_revision = 'e037ae442e72'
+branch_labels = None
+depends_on = None
+
+
+def create_current_insurance_table() -> None:
+    # the insurance with the latest expire date of every vehicle, kept up to date by a trigger on insurance
+    op.create_table(
+        "current_insurance",
+        sa.Column("vehicle_id", sa.Integer, sa.ForeignKey('vehicles.id', ondelete="CASCADE"), primary_key=True),
+        sa.Column("insurance_id", sa.Integer, sa.ForeignKey('insurance.id', ondelete="CASCADE"), nullable=False, index=True),
+    )
+    op.create_index("ix_insurance_vehicle_id_expire_date", "insurance", ["vehicle_id", sa.text("expire_date DESC"), sa.text("id DESC")])
+
+
+def create_current_insurance_trigger() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION refresh_current_insurance(refreshed_vehicle_id INTEGER)
+            RETURNS VOID AS
+        $$
+        BEGIN
+            INSERT INTO current_insurance (vehicle_id, insurance_id)
+            SELECT vehicle_id, id
+            FROM insurance
+            WHERE vehicle_id = refreshed_vehicle_id AND expire_date IS NOT NULL
+            ORDER BY expire_date DESC, id DESC
+            LIMIT 1
+            ON CONFLICT (vehicle_id) DO UPDATE
+            SET insurance_id = EXCLUDED.insurance_id;
+            IF NOT FOUND THEN
+                DELETE FROM current_insurance WHERE vehicle_id = refreshed_vehicle_id;
+            END IF;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION update_current_insurance()
+            RETURNS TRIGGER AS
+        $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.vehicle_id IS DISTINCT FROM NEW.vehicle_id) THEN
+                PERFORM refresh_current_insurance(OLD.vehicle_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM refresh_current_insurance(NEW.vehicle_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER update_current_insurance
+            AFTER INSERT OR DELETE OR UPDATE OF vehicle_id, expire_date
+            ON insurance
+            FOR EACH ROW
+        EXECUTE PROCEDURE update_current_insurance();
+        """
+    )
+
+
+def backfill_current_insurance() -> None:
+    op.execute(
+        """
+        INSERT INTO current_insurance (vehicle_id, insurance_id)
+        SELECT DISTINCT ON (vehicle_id) vehicle_id, id
+        FROM insurance
+        WHERE vehicle_id IS NOT NULL AND expire_date IS NOT NULL
+        ORDER BY vehicle_id, expire_date DESC, id DESC;
+        """
+    )
+
+
+def upgrade() -> None:
+    create_current_insurance_table()
+    create_current_insurance_trigger()
+    backfill_current_insurance()
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER update_current_insurance ON insurance")
+    op.execute("DROP FUNCTION update_current_insurance")
+    op.execute("DROP FUNCTION refresh_current_insurance")
+    op.drop_index("ix_insurance_vehicle_id_expire_date", table_name="insurance")
+    op.drop_table("current_insurance")
@@ -0,0 +1,53 @@
+"""
+Moves accident images uploaded before the image store out of the accident_statement_image.image
+BYTEA column, a batch per transaction:
+
+    python -m app.db.move_images --batch-size 100
+
+Each batch is written to the store, then its rows get the digest, size and content type and lose the
+BYTEA value. Rows are locked with SKIP LOCKED, so it is safe to run next to the API or twice at once,
+and it can be stopped and started again at any point.
+"""
+import argparse
+import asyncio
+import logging
+from databases import Database
+from app.core.config import DATABASE_URL
+from app.core.storage import create_image_store
+from app.db.repositories.accident_image import AccidentImageRepository, LEGACY_CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+async def move_images(database_url: str, batch_size: int) -> int:
+    db = Database(database_url, min_size=1, max_size=1)
+    await db.connect()
+    try:
+        accident_image_repo = AccidentImageRepository(db)
+        store = create_image_store()
+        cursor_id = 0
+        moved = 0
+        while True:
+            ids = await accident_image_repo.move_images_to_store(
+                store=store, cursor_id=cursor_id, limit=batch_size, content_type=LEGACY_CONTENT_TYPE)
+            if not ids:
+                break
+            moved += len(ids)
+            cursor_id = ids[-1]
+            logger.info("moved %s images, up to id %s", moved, cursor_id)
+        return moved
+    finally:
+        await db.disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=str(DATABASE_URL))
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    moved = asyncio.run(move_images(args.database_url, args.batch_size))
+    print(f"moved {moved} images")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import datetime
+import importlib
+import json
+import pkgutil
+from typing import Any, Dict, List, Optional, Set
+from databases import Database
+from app.db.prepared import PARAM_PATTERN
+from app.models.pagination import FIRST_PAGE_KEY
+
+import app.db.repositories
+
+# tables that grow with usage, a sequential scan on any of them is a missing index
+LARGE_TABLES = {
+    "vehicles",
+    "insurance",
+    "roles",
+    "current_insurance",
+    "current_roles",
+    "accident",
+    "accident_statement",
+    "accident_statement_sketch",
+    "accident_statement_image",
+    "temporary_accident_driver_data",
+    "insurance_company",
+}
+
+SEED_QUERY = """
+    WITH companies AS (
+        INSERT INTO insurance_company (name, email)
+        SELECT 'PLAN COMPANY ' || n, 'plancompany' || n || '@plans.test'
+        FROM generate_series(1, :companies) AS n
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    ), vehicles AS (
+        INSERT INTO vehicles (sign, type, model, manufacture_year)
+        SELECT 'PLN-' || n, 'car', 'PLAN MODEL', 2000 + n % 20
+        FROM generate_series(1, :vehicles) AS n
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    )
+    SELECT (SELECT COUNT(*) FROM companies) AS companies, (SELECT COUNT(*) FROM vehicles) AS vehicles;
+"""
+
+SEED_RELATED_QUERIES = [
+    """
+    INSERT INTO insurance (number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+    SELECT 'PLAN-' || v.id || '-' || y, make_date(2010 + y, 1, 1), make_date(2011 + y, 1, 1), y % 2 = 0, v.id,
+        (SELECT id FROM insurance_company WHERE email = 'plancompany' || (v.id % :companies + 1) || '@plans.test')
+    FROM vehicles v, generate_series(1, 3) AS y
+    WHERE v.sign LIKE 'PLN-%';
+    """,
+    """
+    INSERT INTO roles (role, user_id, vehicle_id)
+    SELECT CASE WHEN r = 1 THEN 'owner' ELSE 'user' END, v.id % :users + 1, v.id
+    FROM vehicles v, generate_series(1, 2) AS r
+    WHERE v.sign LIKE 'PLN-%';
+    """,
+    """
+    INSERT INTO accident (date, city, address, injuries, road_problems, closed_case)
+    SELECT make_date(2020, 1, 1) + n, 'PLAN CITY ' || n % 10, 'PLAN ADDRESS ' || n, NULL, NULL, n % 3 = 0
+    FROM generate_series(1, :accidents) AS n;
+    """,
+    """
+    INSERT INTO accident_statement (user_id, accident_id, vehicle_id, insurance_id, role_id, done)
+    SELECT cr.user_id, a.id, cr.vehicle_id, ci.insurance_id, cr.role_id, FALSE
+    FROM (SELECT id, row_number() OVER (ORDER BY id) AS n FROM accident WHERE address LIKE 'PLAN ADDRESS %') AS a
+        INNER JOIN (
+            SELECT cr.*, row_number() OVER (ORDER BY cr.vehicle_id) AS n
+            FROM current_roles cr INNER JOIN vehicles v ON v.id = cr.vehicle_id
+            WHERE v.sign LIKE 'PLN-%') AS cr
+        ON cr.n = a.n
+        INNER JOIN current_insurance ci
+        ON ci.vehicle_id = cr.vehicle_id;
+    """,
+    """
+    INSERT INTO accident_statement_sketch (statement_id, sketch)
+    SELECT s.id, '{''offsetX'': 1, ''offsetY'': 2}'
+    FROM accident_statement s INNER JOIN accident a ON a.id = s.accident_id
+    WHERE a.address LIKE 'PLAN ADDRESS %';
+    """,
+    """
+    INSERT INTO accident_statement_image (statement_id, image)
+    SELECT s.id, '\\x00'::bytea
+    FROM accident_statement s INNER JOIN accident a ON a.id = s.accident_id
+    WHERE a.address LIKE 'PLAN ADDRESS %';
+    """,
+    """
+    INSERT INTO temporary_accident_driver_data (accident_id, driver_full_name, driver_email, vehicle_sign,
+        insurance_number, insurance_email)
+    SELECT id, 'PLAN DRIVER', 'plandriver' || id || '@plans.test', 'PLN-' || id, 'PLAN-' || id,
+        'plancompany' || (id % :companies + 1) || '@plans.test'
+    FROM accident
+    WHERE address LIKE 'PLAN ADDRESS %';
+    """,
+    "ANALYZE;",
+]
+
+SAMPLE_QUERY = """
+    SELECT s.id AS statement_id, s.accident_id, s.user_id, s.vehicle_id, s.insurance_id, s.role_id,
+        v.sign, i.number, ic.id AS insurance_company_id, ic.email AS insurance_company_email,
+        t.id AS temporary_id, t.driver_email, img.id AS image_id
+    FROM accident_statement s
+        INNER JOIN vehicles v ON v.id = s.vehicle_id
+        INNER JOIN insurance i ON i.id = s.insurance_id
+        INNER JOIN insurance_company ic ON ic.id = i.insurance_company_id
+        INNER JOIN temporary_accident_driver_data t ON t.accident_id = s.accident_id
+        INNER JOIN accident_statement_image img ON img.statement_id = s.id
+    ORDER BY s.id
+    LIMIT 1;
+"""
+
+
+def discover_queries() -> Dict[str, str]:
+    """
+    Every module level SQL constant of the repositories, keyed by `module.NAME`.
+
+    """
+    queries = {}
+    for module_info in pkgutil.iter_modules(app.db.repositories.__path__):
+        module = importlib.import_module(f"{app.db.repositories.__name__}.{module_info.name}")
+        for name, value in vars(module).items():
+            if "QUERY" in name and name.isupper() and isinstance(value, str):
+                queries[f"{module_info.name}.{name}"] = value
+    return queries
+
+
+def get_query_params(query: str) -> Set[str]:
+    return set(PARAM_PATTERN.findall(query))
+
+
+async def seed_plan_dataset(db: Database, *, vehicles: int = 2000, companies: int = 20, users: int = 500, accidents: int = 1000) -> None:
+    """
+    Adds the PLN-n vehicles, PLAN COMPANY n companies and their related rows, only touching rows it created.
+    Seeding an already seeded database only refreshes the planner statistics.
+
+    """
+    seeded = await db.fetch_one(query=SEED_QUERY, values={"companies": companies, "vehicles": vehicles})
+    related_queries = SEED_RELATED_QUERIES if seeded["vehicles"] else SEED_RELATED_QUERIES[-1:]
+    for query in related_queries:
+        values = {"companies": companies, "users": users, "accidents": accidents}
+        await db.execute(query=query, values={name: values[name] for name in get_query_params(query)})
+
+
+async def get_sample_values(db: Database) -> Dict[str, Any]:
+    """
+    Representative values for every parameter name used by the repository queries,
+    taken from one fully populated accident statement of the seeded dataset.
+
+    """
+    sample = await db.fetch_one(query=SAMPLE_QUERY)
+    today = datetime.datetime(2021, 6, 1)
+    return {
+        "id": sample["statement_id"],
+        "ids": [sample["statement_id"]],
+        "user_id": sample["user_id"],
+        "user_ids": [sample["user_id"]],
+        "vehicle_id": sample["vehicle_id"],
+        "accident_id": sample["accident_id"],
+        "accident_ids": [sample["accident_id"]],
+        "insurance_id": sample["insurance_id"],
+        "insurance_company_id": sample["insurance_company_id"],
+        "role_id": sample["role_id"],
+        "statement_id": sample["statement_id"],
+        "statement_ids": [sample["statement_id"]],
+        "sign": sample["sign"],
+        "query": sample["sign"][:5],
+        "number_pattern": f"%{sample['number'][:6]}%",
+        "vehicle_sign": sample["sign"],
+        "number": sample["number"],
+        "insurance_number": sample["number"],
+        "name": "PLAN COMPANY SAMPLE",
+        "email": sample["driver_email"],
+        "driver_email": sample["driver_email"],
+        "insurance_email": sample["insurance_company_email"],
+        "insurance_company_email": sample["insurance_company_email"],
+        "driver_full_name": "PLAN DRIVER",
+        "type": "car",
+        "model": "PLAN MODEL",
+        "manufacture_year": 2015,
+        "role": "owner",
+        "date": today,
+        "start_date": today,
+        "expire_date": today,
+        "date_from": None,
+        "date_to": None,
+        "city": "PLAN CITY 1",
+        "address": "PLAN ADDRESS",
+        "injuries": None,
+        "road_problems": None,
+        "closed_case": False,
+        "damage_coverance": False,
+        "answered": False,
+        "caused_by": None,
+        "comments": None,
+        "car_damage": "FRONT",
+        "sketch": None,
+        "image": b"\x00",
+        "digest": "0" * 64,
+        "digests": ["0" * 64],
+        "size": 1,
+        "sizes": [1],
+        "content_type": "image/jpeg",
+        "content_types": ["image/jpeg"],
+        "max_images": 20,
+        "offset": 0,
+        "length": 1,
+        "cursor": FIRST_PAGE_KEY,
+        "cursor_id": FIRST_PAGE_KEY,
+        "cursor_key": FIRST_PAGE_KEY,
+        "limit": 50,
+        "import_id": 0,
+    }
+
+
+async def explain(db: Database, query: str, values: Dict[str, Any], *,
+    analyze: bool = False, enable_seqscan: bool = True) -> Dict[str, Any]:
+    """
+    The JSON plan of a query. It runs in a transaction that is always rolled back,
+    so analyzing a write leaves the database untouched.
+
+    """
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    transaction = db.transaction()
+    await transaction.start()
+    try:
+        if not enable_seqscan:
+            await db.execute(query="SET LOCAL enable_seqscan = off")
+        plan = await db.fetch_val(
+            query=f"EXPLAIN ({options}) {query}",
+            values={name: values[name] for name in get_query_params(query)},
+        )
+    finally:
+        await transaction.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def iter_plan_nodes(node: Dict[str, Any]):
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+
+def get_seq_scans(plan: Dict[str, Any], tables: Optional[Set[str]] = None) -> List[str]:
+    return [
+        node["Relation Name"]
+        for node in iter_plan_nodes(plan["Plan"])
+        if node["Node Type"] == "Seq Scan" and (tables is None or node["Relation Name"] in tables)
+    ]
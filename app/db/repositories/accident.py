@@ -1,8 +1,12 @@
-from typing import List
+from typing import AsyncIterator, List, Optional
 from fastapi import HTTPException
 from starlette.status import HTTP_400_BAD_REQUEST
-from app.models.accidents import AccidentPublic, AccidentInDB, AccidentCreate
+from app.models.accidents import AccidentPublic, AccidentInDB, AccidentCreate, AccidentFilter
+from app.core.config import STREAM_CHUNK_SIZE
+from app.models.pagination import FIRST_PAGE_KEY
+from app.models.expand import Expand
 from app.models.temporary_accident_driver_data import Temporary_Data_InDB
+from app.db.prepared import fetch_one_prepared
 from app.db.repositories.base import BaseRepository
 from app.models.accident_statement import Accident_statement_Create
 from app.models.users import ProfileSearch
@@ -94,6 +98,57 @@ GET_ACCIDENTS_BY_USER_STMT_ID_QUERY = """
     WHERE acst.user_id= :user_id;
 """
 
+GET_ACCIDENTS_PAGE_BY_USER_ID_QUERY = """
+    SELECT a.id, a.date, a.city, a.address, a.injuries, a.road_problems, a.closed_case, a.created_at, a.updated_at
+    FROM accident AS a
+    WHERE a.id IN (
+            SELECT acst.accident_id FROM accident_statement AS acst WHERE acst.user_id = :user_id
+            UNION
+            SELECT tadd.accident_id FROM temporary_accident_driver_data AS tadd WHERE tadd.driver_email = :driver_email)
+        AND a.id < :cursor
+        AND (CAST(:date_from AS TIMESTAMP) IS NULL OR a.date >= :date_from)
+        AND (CAST(:date_to AS TIMESTAMP) IS NULL OR a.date <= :date_to)
+        AND (CAST(:closed_case AS BOOLEAN) IS NULL OR a.closed_case = :closed_case)
+        AND (CAST(:city AS TEXT) IS NULL OR a.city = UPPER(:city))
+    ORDER BY a.id DESC
+    LIMIT :limit;
+"""
+
+GET_ACCIDENTS_PAGE_BY_INSURANCE_COMPANY_QUERY = """
+    SELECT a.id, a.date, a.city, a.address, a.injuries, a.road_problems, a.closed_case, a.created_at, a.updated_at
+    FROM accident AS a
+    WHERE a.id IN (
+            SELECT acs.accident_id
+            FROM accident_statement AS acs
+                INNER JOIN insurance AS i
+                ON acs.insurance_id = i.id
+                INNER JOIN insurance_company AS ic
+                ON i.insurance_company_id = ic.id
+            WHERE ic.email = :insurance_company_email
+            UNION
+            SELECT tadd.accident_id FROM temporary_accident_driver_data AS tadd WHERE tadd.insurance_email = :insurance_company_email)
+        AND a.id < :cursor
+        AND (CAST(:date_from AS TIMESTAMP) IS NULL OR a.date >= :date_from)
+        AND (CAST(:date_to AS TIMESTAMP) IS NULL OR a.date <= :date_to)
+        AND (CAST(:closed_case AS BOOLEAN) IS NULL OR a.closed_case = :closed_case)
+        AND (CAST(:city AS TEXT) IS NULL OR a.city = UPPER(:city))
+    ORDER BY a.id DESC
+    LIMIT :limit;
+"""
+
+GET_ACCIDENTS_PAGE_QUERY = """
+    SELECT a.id, a.date, a.city, a.address, a.injuries, a.road_problems, a.closed_case, a.created_at, a.updated_at
+    FROM accident AS a
+    WHERE TRUE
+        AND a.id < :cursor
+        AND (CAST(:date_from AS TIMESTAMP) IS NULL OR a.date >= :date_from)
+        AND (CAST(:date_to AS TIMESTAMP) IS NULL OR a.date <= :date_to)
+        AND (CAST(:closed_case AS BOOLEAN) IS NULL OR a.closed_case = :closed_case)
+        AND (CAST(:city AS TEXT) IS NULL OR a.city = UPPER(:city))
+    ORDER BY a.id DESC
+    LIMIT :limit;
+"""
+
 UPDATE_CLOSED_CASE_QUERY ="""
     UPDATE accident
     SET closed_case = 'true'
@@ -103,10 +158,13 @@ UPDATE_CLOSED_CASE_QUERY ="""
 
 class AccidentRepository(BaseRepository):
 
-    def __init__(self, db: Database) -> None:
-        super().__init__(db)
-        self.accident_statement_repo = AccidentStatementRepository(db)    
-        self.temporary_accident_driver_data_repo = TemporaryRepository(db) 
+    @property
+    def accident_statement_repo(self) -> AccidentStatementRepository:
+        return self.registry.get(AccidentStatementRepository)
+
+    @property
+    def temporary_accident_driver_data_repo(self) -> TemporaryRepository:
+        return self.registry.get(TemporaryRepository)
 
 
     async def create_accident_for_vehicle(self, *, new_accident: AccidentCreate , vehicle_id: int, id:int) -> AccidentInDB:
@@ -118,31 +176,45 @@ class AccidentRepository(BaseRepository):
         return await self.populate_accident(accident=AccidentInDB(**new_accident))
 
 
-    async def populate_accident(self, *, accident: AccidentInDB) -> AccidentInDB:
-        return AccidentPublic(
-            **accident.dict(),
-            accident_statement=await self.accident_statement_repo.get_all_accident_statements_for_accident_id(accident_id=accident.id),
-            temporary_accident_drivers=await self.temporary_accident_driver_data_repo.get_all_temporary_driver_data_for_accident_id(accident_id=accident.id),
-        )
-
-    async def get_accident_by_id(self, *, id: int, populate: bool = True) -> AccidentInDB:
-        accident_record = await self.db.fetch_one(query=GET_ACCIDENT_BY_ID_QUERY, values={"id": id})
+    async def populate_accident(self, *, accident: AccidentInDB, expand: Expand = None) -> AccidentInDB:
+        accidents = await self.populate_accidents(accidents=[accident], expand=expand)
+        return accidents[0]
+
+    async def populate_accidents(self, *, accidents: List[AccidentInDB], expand: Expand = None) -> List[AccidentPublic]:
+        # loads the expanded AccidentPublic tree of every accident with a fixed number of queries,
+        # subtrees that were not requested are neither queried nor set
+        expand = expand or Expand()
+        accident_ids = list(dict.fromkeys(accident.id for accident in accidents))
+        related = {accident_id: {} for accident_id in accident_ids}
+        if "statements" in expand:
+            accident_statements = await self.accident_statement_repo.get_all_accident_statements_for_accident_ids(
+                accident_ids=accident_ids, expand=expand.child("statements"))
+            for accident_id, accident_statement in accident_statements.items():
+                related[accident_id]["accident_statement"] = accident_statement
+        if "temporary_drivers" in expand:
+            temporary_accident_drivers = await self.temporary_accident_driver_data_repo.get_all_temporary_driver_data_for_accident_ids(accident_ids=accident_ids)
+            for accident_id, temporary_accident_driver in temporary_accident_drivers.items():
+                related[accident_id]["temporary_accident_drivers"] = temporary_accident_driver
+        return [AccidentPublic(**accident.dict(), **related[accident.id]) for accident in accidents]
+
+    async def get_accident_by_id(self, *, id: int, populate: bool = True, expand: Expand = None) -> AccidentInDB:
+        accident_record = await fetch_one_prepared(self.db, query=GET_ACCIDENT_BY_ID_QUERY, values={"id": id})
         if not accident_record:
             return None
         else:
             accident = AccidentInDB(**accident_record)
             if populate:
-                return await self.populate_accident(accident = accident)
+                return await self.populate_accident(accident = accident, expand=expand)
         return accident
 
-    async def get_accident_from_user_with_statement_id(self, *, id: int, user_id:int, populate: bool = True) -> AccidentPublic:
+    async def get_accident_from_user_with_statement_id(self, *, id: int, user_id:int, populate: bool = True, expand: Expand = None) -> AccidentPublic:
         accident_record = await self.db.fetch_one(query=GET_ACCIDENT_BY_USER_ID_WITH_STATEMENT_QUERY, values={"id": id, "user_id":user_id})
         if not accident_record:
             return None
         else:
             accident = AccidentInDB(**accident_record)
             if populate:
-                return await self.populate_accident(accident = accident)
+                return await self.populate_accident(accident = accident, expand=expand)
         return accident
 
     async def get_accident_by_temporary_driver_id(self, *, id: int, populate: bool = True) -> AccidentPublic:
@@ -156,61 +228,80 @@ class AccidentRepository(BaseRepository):
         return accident
 
     
-    async def get_accident_by_temporary_driver_by_email(self, *, id: int, email:EmailStr, populate: bool = True) -> AccidentPublic:
+    async def get_accident_by_temporary_driver_by_email(self, *, id: int, email:EmailStr, populate: bool = True, expand: Expand = None) -> AccidentPublic:
         accident_record = await self.db.fetch_one(query=GET_ACCIDENT_BY_TEMPORARY_DRIVER_EMAIL_ACCIDENT_ID_QUERY, values={"id": id, "email":email})
         if not accident_record:
             return None
         else:
             accident = AccidentInDB(**accident_record)
             if populate:
-                return await self.populate_accident(accident = accident)
+                return await self.populate_accident(accident = accident, expand=expand)
         return accident
 
-    async def get_accidents_by_user_id(self, *, user_id:int, email:EmailStr, populate: bool = True)->List[AccidentPublic]:
-        accident_records = await self.db.fetch_all(query=GET_ACCIDENTS_BY_USER_STMT_ID_QUERY, values={"user_id":user_id})
-        accidents_declares = await self.db.fetch_all(query=GET_ACCIDENTS_BY_TEMPORARY_DRIVER_EMAIL_QUERY, values={"driver_email": email})
-        accidents_list = []
-        accident_id_list = []
-        if not accident_records and not accidents_declares:
+    @staticmethod
+    def get_page_values(*, accident_filter: Optional[AccidentFilter], limit: Optional[int], cursor: Optional[int]) -> dict:
+        values = (accident_filter or AccidentFilter()).dict()
+        values["limit"] = limit
+        values["cursor"] = cursor or FIRST_PAGE_KEY
+        return values
+
+    async def get_accidents_by_user_id(self, *, user_id:int, email:EmailStr, populate: bool = True,
+        accident_filter: AccidentFilter = None, limit: int = None, cursor: int = None, expand: Expand = None)->List[AccidentPublic]:
+        values = self.get_page_values(accident_filter=accident_filter, limit=limit, cursor=cursor)
+        accident_records = await self.db.fetch_all(query=GET_ACCIDENTS_PAGE_BY_USER_ID_QUERY, values={**values, "user_id": user_id, "driver_email": email})
+        if not accident_records:
             return None
-        else:
-            for accident_record in accident_records:
-                accident_id_list.append(accident_record["id"])
-                accident = AccidentInDB(**accident_record)
-                if populate:
-                    accident_populated = await self.populate_accident(accident = accident)
-                    accidents_list.append(accident_populated)
-            for accident_declare in accidents_declares:
-                if accident_declare['id'] in accident_id_list:
-                    pass
-                else:
-                    accident = AccidentInDB(**accident_declare)
-                    if populate:
-                        accident_populated = await self.populate_accident(accident = accident)
-                        accidents_list.append(accident_populated)
+        accidents_list = [AccidentInDB(**accident_record) for accident_record in accident_records]
+        if populate:
+            return await self.populate_accidents(accidents = accidents_list, expand=expand)
         return accidents_list
 
     
-    async def get_all_accidents(self,*, populate: bool = True) ->List[AccidentPublic]:
-        accident_records = await self.db.fetch_all(query=GET_ALL_ACCIDENTS_QUERY)
-        accidents_list = []
-        for accident_record in accident_records:
-            accident = AccidentInDB(**accident_record)
-            if populate:
-                accident_populated = await self.populate_accident(accident = accident)
-                accidents_list.append(accident_populated)
-        return accidents_list 
+    async def get_all_accidents(self,*, populate: bool = True,
+        accident_filter: AccidentFilter = None, limit: int = None, cursor: int = None, expand: Expand = None) ->List[AccidentPublic]:
+        values = self.get_page_values(accident_filter=accident_filter, limit=limit, cursor=cursor)
+        accident_records = await self.db.fetch_all(query=GET_ACCIDENTS_PAGE_QUERY, values=values)
+        accidents_list = [AccidentInDB(**accident_record) for accident_record in accident_records]
+        if populate:
+            return await self.populate_accidents(accidents = accidents_list, expand=expand)
+        return accidents_list
 
 
-    async def get_all_accidents_by_insurance_company(self,*, insurance_company_email:EmailStr, populate: bool = True) ->List[AccidentPublic]:
-        accident_records = await self.db.fetch_all(query=GET_ALL_ACCIDENTS_BY_INSURANCE_COMPANY, values={"insurance_company_email":insurance_company_email})
-        accidents_list = []
-        for accident_record in accident_records:
-            accident = AccidentInDB(**accident_record)
-            if populate:
-                accident_populated = await self.populate_accident(accident = accident)
-                accidents_list.append(accident_populated)
-        return accidents_list 
+    async def get_all_accidents_by_insurance_company(self,*, insurance_company_email:EmailStr, populate: bool = True,
+        accident_filter: AccidentFilter = None, limit: int = None, cursor: int = None, expand: Expand = None) ->List[AccidentPublic]:
+        values = self.get_page_values(accident_filter=accident_filter, limit=limit, cursor=cursor)
+        accident_records = await self.db.fetch_all(query=GET_ACCIDENTS_PAGE_BY_INSURANCE_COMPANY_QUERY, values={**values, "insurance_company_email":insurance_company_email})
+        accidents_list = [AccidentInDB(**accident_record) for accident_record in accident_records]
+        if populate:
+            return await self.populate_accidents(accidents = accidents_list, expand=expand)
+        return accidents_list
+
+    async def iterate_accidents(self, *, query: str, values: dict, expand: Expand = None) -> AsyncIterator[AccidentPublic]:
+        # every chunk is populated with the set based queries, which can not run on the connection
+        # while a server side cursor holds it, so the chunks are read as keyset pages instead
+        values = {**values, "limit": STREAM_CHUNK_SIZE}
+        while True:
+            accident_records = await self.db.fetch_all(query=query, values=values)
+            if not accident_records:
+                return
+            accidents = await self.populate_accidents(accidents=[AccidentInDB(**accident_record) for accident_record in accident_records], expand=expand)
+            # keep memory flat, nothing from a previous chunk is looked up again
+            self.loader.clear_all()
+            for accident in accidents:
+                yield accident
+            if len(accident_records) < STREAM_CHUNK_SIZE:
+                return
+            values["cursor"] = accident_records[-1]["id"]
+
+    def iterate_accidents_by_user_id(self, *, user_id: int, email: EmailStr,
+        accident_filter: AccidentFilter = None, cursor: int = None, expand: Expand = None) -> AsyncIterator[AccidentPublic]:
+        values = self.get_page_values(accident_filter=accident_filter, limit=None, cursor=cursor)
+        return self.iterate_accidents(query=GET_ACCIDENTS_PAGE_BY_USER_ID_QUERY, values={**values, "user_id": user_id, "driver_email": email}, expand=expand)
+
+    def iterate_all_accidents_by_insurance_company(self, *, insurance_company_email: EmailStr,
+        accident_filter: AccidentFilter = None, cursor: int = None, expand: Expand = None) -> AsyncIterator[AccidentPublic]:
+        values = self.get_page_values(accident_filter=accident_filter, limit=None, cursor=cursor)
+        return self.iterate_accidents(query=GET_ACCIDENTS_PAGE_BY_INSURANCE_COMPANY_QUERY, values={**values, "insurance_company_email": insurance_company_email}, expand=expand)
 
     async def update_closed_case(self, *, id: int, populate: bool = True)->AccidentPublic:
         accident = await self.get_accident_by_id(id= id)
@@ -223,29 +314,10 @@ class AccidentRepository(BaseRepository):
                 accident_populated = await self.populate_accident(accident = accident_closed)
             return accident_populated 
 
-    async def get_accidents_by_user_id_master(self, *, user_search:ProfileSearch, populate: bool = True)->List[AccidentPublic]:
-        accident_records = await self.db.fetch_all(query=GET_ACCIDENTS_BY_USER_STMT_ID_QUERY, values={"user_id": user_search.user_id})
-        accidents_declares = await self.db.fetch_all(query=GET_ACCIDENTS_BY_TEMPORARY_DRIVER_EMAIL_QUERY, values={"driver_email": user_search.email})
-        accidents_list = []
-        accident_id_list = []
-        if not accident_records and not accidents_declares:
-            return None
-        else:
-            for accident_record in accident_records:
-                accident_id_list.append(accident_record["id"])
-                accident = AccidentInDB(**accident_record)
-                if populate:
-                    accident_populated = await self.populate_accident(accident = accident)
-                    accidents_list.append(accident_populated)
-            for accident_declare in accidents_declares:
-                if accident_declare['id'] in accident_id_list:
-                    pass
-                else:
-                    accident = AccidentInDB(**accident_declare)
-                    if populate:
-                        accident_populated = await self.populate_accident(accident = accident)
-                        accidents_list.append(accident_populated)
-        return accidents_list
+    async def get_accidents_by_user_id_master(self, *, user_search:ProfileSearch, populate: bool = True,
+        accident_filter: AccidentFilter = None, limit: int = None, cursor: int = None, expand: Expand = None)->List[AccidentPublic]:
+        return await self.get_accidents_by_user_id(user_id=user_search.user_id, email=user_search.email, populate=populate,
+            accident_filter=accident_filter, limit=limit, cursor=cursor, expand=expand)
 
 
 
@@ -1,34 +1,92 @@
 from fastapi import HTTPException, Depends
 from starlette.status import HTTP_400_BAD_REQUEST
+from app.db.prepared import fetch_all_prepared
 from app.db.repositories.base import BaseRepository
-from app.models.accident_image import Accident_Image_Create, Accident_Image_InDB, AccidentImage
+from app.core.config import IMAGE_MAX_PER_STATEMENT
+from app.core.storage import ImageStore, iter_bytes
+from app.models.accident_image import Accident_Image_Create, Accident_Image_InDB, AccidentImage, AccidentImageFile
 from app.api.dependencies.auth import get_other_user_by_user_id
 from databases import Database
 import json
-from typing import List
+from typing import Dict, List
 
 GET_ACCIDENT_IMAGES_BY_STATEMENT_ID_QUERY = """
-    SELECT id, statement_id, created_at, updated_at
+    SELECT id, statement_id, digest, size, content_type, created_at, updated_at
     FROM accident_statement_image
     WHERE statement_id = :statement_id;
 """
 
+GET_ACCIDENT_IMAGES_BY_STATEMENT_IDS_QUERY = """
+    SELECT id, statement_id, digest, size, content_type, created_at, updated_at
+    FROM accident_statement_image
+    WHERE statement_id = ANY(:statement_ids)
+    ORDER BY id;
+"""
+
 GET_ACCIDENT_IMAGE_BY_ID_QUERY = """
-    SELECT image
+    SELECT image, digest, size, content_type
     FROM accident_statement_image
     WHERE id = :id;
 """
 
+GET_ACCIDENT_IMAGE_FILE_BY_ID_QUERY = """
+    SELECT id, digest, size, content_type, digest IS NOT NULL AS in_store
+    FROM accident_statement_image
+    WHERE id = :id AND (digest IS NOT NULL OR image IS NOT NULL);
+"""
+
 GET_STATEMENT_ID_BY_ID_QUERY = """
-    SELECT id, statement_id, created_at, updated_at
+    SELECT id, statement_id, digest, size, content_type, created_at, updated_at
     FROM accident_statement_image
     WHERE id = :id;
 """
 
+LOCK_ACCIDENT_STATEMENT_QUERY = """
+    SELECT id
+    FROM accident_statement
+    WHERE id = :statement_id
+    FOR UPDATE;
+"""
+
 ADD_ACCIDENT_IMAGE_QUERY = """
-    INSERT INTO accident_statement_image(statement_id, image)
-    VALUES (:statement_id, :image)
-    RETURNING id, statement_id, created_at, updated_at;
+    INSERT INTO accident_statement_image(statement_id, digest, size, content_type)
+    SELECT :statement_id, :digest, :size, :content_type
+    WHERE (SELECT COUNT(*) FROM accident_statement_image WHERE statement_id = :statement_id) < :max_images
+    RETURNING id, statement_id, digest, size, content_type, created_at, updated_at;
+"""
+
+ADD_ACCIDENT_IMAGES_QUERY = """
+    INSERT INTO accident_statement_image(statement_id, digest, size, content_type)
+    SELECT :statement_id, new.digest, new.size, new.content_type
+    FROM unnest(CAST(:digests AS TEXT[]), CAST(:sizes AS BIGINT[]), CAST(:content_types AS TEXT[]))
+        WITH ORDINALITY AS new(digest, size, content_type, position)
+    WHERE (SELECT COUNT(*) FROM accident_statement_image WHERE statement_id = :statement_id)
+        + cardinality(CAST(:digests AS TEXT[])) <= :max_images
+    ORDER BY new.position
+    RETURNING id, statement_id, digest, size, content_type, created_at, updated_at;
+"""
+
+GET_ACCIDENT_IMAGES_TO_MOVE_QUERY = """
+    SELECT id, image
+    FROM accident_statement_image
+    WHERE id > :cursor_id AND digest IS NULL AND image IS NOT NULL
+    ORDER BY id
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED;
+"""
+
+GET_ACCIDENT_IMAGE_TO_MOVE_BY_ID_QUERY = """
+    SELECT id, image
+    FROM accident_statement_image
+    WHERE id = :id AND digest IS NULL AND image IS NOT NULL
+    FOR UPDATE;
+"""
+
+MOVE_ACCIDENT_IMAGES_QUERY = """
+    UPDATE accident_statement_image AS img
+    SET digest = moved.digest, size = moved.size, content_type = :content_type, image = NULL
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:digests AS TEXT[]), CAST(:sizes AS BIGINT[])) AS moved(id, digest, size)
+    WHERE img.id = moved.id;
 """
 
 GET_ACCIDENT_IMAGE_COUNT_QUERY = """
@@ -38,17 +96,82 @@ GET_ACCIDENT_IMAGE_COUNT_QUERY = """
 """
 
 
+# the API served every BYTEA image as a JPEG
+LEGACY_CONTENT_TYPE = "image/jpeg"
+
+
 class AccidentImageRepository(BaseRepository):
 
-    async def add_new_accident_image(self, *, new_accident_image: Accident_Image_Create)->Accident_Image_InDB:
-        query_values = new_accident_image.dict()
-        new_image = await self.db.fetch_one(query=ADD_ACCIDENT_IMAGE_QUERY, values=query_values)
+    async def add_new_accident_image(self, *, new_accident_image: Accident_Image_Create,
+        max_images: int = IMAGE_MAX_PER_STATEMENT)->Accident_Image_InDB:
+        # None once the statement has max_images. The statement row is locked first, so the count of
+        # a concurrent upload to the same statement is seen by the insert
+        query_values = {**new_accident_image.dict(), "max_images": max_images}
+        async with self.db.transaction():
+            await self.db.execute(query=LOCK_ACCIDENT_STATEMENT_QUERY, values={"statement_id": new_accident_image.statement_id})
+            new_image = await self.db.fetch_one(query=ADD_ACCIDENT_IMAGE_QUERY, values=query_values)
+        if not new_image:
+            return None
         return Accident_Image_InDB(**new_image)
 
+    async def add_new_accident_images(self, *, statement_id: int, new_accident_images: List[Accident_Image_Create],
+        max_images: int = IMAGE_MAX_PER_STATEMENT) -> List[Accident_Image_InDB]:
+        # all of the images in one insert, or none of them when they would take the statement over max_images
+        async with self.db.transaction():
+            await self.db.execute(query=LOCK_ACCIDENT_STATEMENT_QUERY, values={"statement_id": statement_id})
+            new_images = await self.db.fetch_all(query=ADD_ACCIDENT_IMAGES_QUERY, values={
+                "statement_id": statement_id,
+                "digests": [image.digest for image in new_accident_images],
+                "sizes": [image.size for image in new_accident_images],
+                "content_types": [image.content_type for image in new_accident_images],
+                "max_images": max_images,
+            })
+        return sorted((Accident_Image_InDB(**image) for image in new_images), key=lambda image: image.id)
+
+    async def move_images_to_store(self, *, store: ImageStore, cursor_id: int, limit: int,
+        content_type: str) -> List[int]:
+        """
+        Moves the BYTEA content of the next `limit` images after `cursor_id` to the store, in one transaction.
+        Returns the ids moved, none once no image is left in the table.
+
+        """
+        async with self.db.transaction():
+            images = await self.db.fetch_all(query=GET_ACCIDENT_IMAGES_TO_MOVE_QUERY, values={"cursor_id": cursor_id, "limit": limit})
+            if not images:
+                return []
+            moved = [await store.put(iter_bytes(image["image"])) for image in images]
+            await self.db.execute(query=MOVE_ACCIDENT_IMAGES_QUERY, values={
+                "ids": [image["id"] for image in images],
+                "digests": [digest for digest, size in moved],
+                "sizes": [size for digest, size in moved],
+                "content_type": content_type,
+            })
+        return [image["id"] for image in images]
+
+    async def move_image_to_store(self, *, id: int, store: ImageStore, content_type: str) -> AccidentImageFile:
+        """
+        Moves the BYTEA content of one image to the store, unless it has been moved already,
+        and returns where it is now. A concurrent move of the same row waits for the lock and finds nothing to do.
+
+        """
+        async with self.db.transaction():
+            image = await self.db.fetch_one(query=GET_ACCIDENT_IMAGE_TO_MOVE_BY_ID_QUERY, values={"id": id})
+            if image:
+                digest, size = await store.put(iter_bytes(image["image"]))
+                await self.db.execute(query=MOVE_ACCIDENT_IMAGES_QUERY, values={
+                    "ids": [id], "digests": [digest], "sizes": [size], "content_type": content_type})
+        return await self.get_image_file(id=id)
+
     async def get_image(self, *, id: int)->AccidentImage:
         image = await self.db.fetch_one(query=GET_ACCIDENT_IMAGE_BY_ID_QUERY, values={'id': id})
         return AccidentImage(**image)
 
+    async def get_image_file(self, *, id: int) -> AccidentImageFile:
+        image_file = await self.db.fetch_one(query=GET_ACCIDENT_IMAGE_FILE_BY_ID_QUERY, values={'id': id})
+        if not image_file:
+            return None
+        return AccidentImageFile(**image_file)
+
     async def get_statement(self, *, id: int)->Accident_Image_InDB:
         image_data = await self.db.fetch_one(query=GET_STATEMENT_ID_BY_ID_QUERY, values={'id': id})
         if not image_data:
@@ -62,7 +185,16 @@ class AccidentImageRepository(BaseRepository):
             image_data = Accident_Image_InDB(**image_data)
             image_data_list.append(image_data)
         return image_data_list
-    
+
+    async def get_image_data_by_statement_ids(self, *, statement_ids: List[int]) -> Dict[int, List[Accident_Image_InDB]]:
+        image_data_by_statement = {statement_id: [] for statement_id in statement_ids}
+        if not statement_ids:
+            return image_data_by_statement
+        image_data_result = await fetch_all_prepared(self.db, query=GET_ACCIDENT_IMAGES_BY_STATEMENT_IDS_QUERY, values={'statement_ids': statement_ids})
+        for image_data in image_data_result:
+            image_data_by_statement[image_data["statement_id"]].append(Accident_Image_InDB(**image_data))
+        return image_data_by_statement
+
     async def get_image_count(self, *, statement_id: int)->List[int]:
         ids= await self.db.fetch_all(query=GET_ACCIDENT_IMAGE_COUNT_QUERY, values={'statement_id': statement_id})
         id_list=[]
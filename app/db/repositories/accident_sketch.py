@@ -1,6 +1,7 @@
-from typing import List
+from typing import Dict, List
 from fastapi import HTTPException, Depends
 from starlette.status import HTTP_400_BAD_REQUEST
+from app.db.prepared import fetch_all_prepared
 from app.db.repositories.base import BaseRepository
 from app.models.accident_statement_sketch import Accident_Sketch_Create, Accident_Sketch_InDB, Only_Sketch, Accident_Sketch_Update
 from app.api.dependencies.auth import get_other_user_by_user_id
@@ -19,6 +20,13 @@ GET_SKETCH_BY_STATEMENT_ID_QUERY = """
     WHERE statement_id = :statement_id ;
 """
 
+GET_SKETCHES_BY_STATEMENT_IDS_QUERY = """
+    SELECT DISTINCT ON (statement_id) statement_id, sketch
+    FROM accident_statement_sketch
+    WHERE statement_id = ANY(:statement_ids)
+    ORDER BY statement_id, id;
+"""
+
 GET_ACCIDENT_SKETCH_BY_STATEMENT_ID_QUERY = """
     SELECT id, statement_id, sketch, created_at, updated_at
     FROM accident_statement_sketch
@@ -77,6 +85,12 @@ class AccidentSketchRepository(BaseRepository):
             return None
         return Only_Sketch.get_list(sketch['sketch'])
 
+    async def get_accident_sketches_by_statement_ids(self, *, statement_ids: List[int]) -> Dict[int, Only_Sketch]:
+        if not statement_ids:
+            return {}
+        sketches = await fetch_all_prepared(self.db, query=GET_SKETCHES_BY_STATEMENT_IDS_QUERY, values={"statement_ids": statement_ids})
+        return {sketch["statement_id"]: Only_Sketch.get_list(sketch["sketch"]) for sketch in sketches}
+
     async def update_accident_sketch_by_statement_id(self, *, statement_id: int, updated_sketch: Accident_Sketch_Update) -> Accident_Sketch_InDB:
         sketch = await self.db.fetch_one(query=GET_ACCIDENT_SKETCH_BY_STATEMENT_ID_QUERY, values={"statement_id": statement_id})
         sketch = Accident_Sketch_InDB(**sketch)
@@ -1,7 +1,8 @@
-from typing import List
+from typing import Dict, List
 import datetime
 from fastapi import HTTPException, Depends
 from starlette.status import HTTP_400_BAD_REQUEST
+from app.db.prepared import fetch_all_prepared, fetch_one_prepared
 from app.db.repositories.base import BaseRepository
 from app.db.repositories.accident_image import AccidentImageRepository
 from app.db.repositories.insurance import InsuranceRepository
@@ -11,7 +12,7 @@ from app.db.repositories.temporary_accident_driver_data import TemporaryReposito
 from app.db.repositories.accident_sketch import AccidentSketchRepository
 from app.models.accident_statement import Accident_statement_Create, Accident_statement_InDB, Accident_statement_Public, Accident_statement_Update, AccidentImage, Accident_Statement_Detection_Update
 from app.models.accident_statement_sketch import Accident_Sketch_Update, Accident_Sketch_InDB
-from app.api.dependencies.auth import get_other_user_by_user_id
+from app.models.expand import Expand
 from databases import Database
 from pydantic import EmailStr
 
@@ -33,6 +34,12 @@ GET_ACCIDENT_STATEMENT_BY_ID_QUERY = """
     WHERE id = :id;
 """
 
+GET_ACCIDENT_STATEMENTS_BY_IDS_QUERY = """
+    SELECT id, user_id, accident_id, vehicle_id, insurance_id, role_id, caused_by, comments, car_damage, done, created_at, updated_at
+    FROM accident_statement
+    WHERE id = ANY(:ids);
+"""
+
 GET_ACCIDENT_STATEMENT_BY_ACCIDENT_ID_USER_ID_QUERY = """
     SELECT id, user_id, accident_id, vehicle_id, insurance_id, role_id, caused_by, comments, car_damage, done, created_at, updated_at
     FROM accident_statement
@@ -45,6 +52,13 @@ GET_ACCIDENT_STATEMENTS_BY_ACCIDENT_ID_QUERY = """
     WHERE accident_id = :accident_id;
 """
 
+GET_ACCIDENT_STATEMENTS_BY_ACCIDENT_IDS_QUERY = """
+    SELECT id, user_id, accident_id, vehicle_id, insurance_id, role_id, caused_by, comments, car_damage, done, created_at, updated_at
+    FROM accident_statement
+    WHERE accident_id = ANY(:accident_ids)
+    ORDER BY id;
+"""
+
 CREATE_ACCIDENT_STATEMENT_FOR_ACCIDENT_QUERY = """
     INSERT INTO accident_statement(user_id, accident_id, vehicle_id, insurance_id, role_id, caused_by, comments)
     VALUES (:user_id, :accident_id, :vehicle_id, :insurance_id, :role_id, :caused_by, :comments)
@@ -74,14 +88,29 @@ UPDATE_ACCIDENT_STATEMENT_AS_COMPLETE_QUERY = """
 """
 
 class AccidentStatementRepository(BaseRepository):
-    def __init__(self, db: Database) -> None:
-        super().__init__(db)
-        self.vehicles_repo = VehiclesRepository(db)
-        self.insurance_repo = InsuranceRepository(db)
-        self.role_repo = RolesRepository(db)
-        self.temporary_repo = TemporaryRepository(db)
-        self.sketch_repo = AccidentSketchRepository(db)
-        self.image_repo = AccidentImageRepository(db)
+    @property
+    def vehicles_repo(self) -> VehiclesRepository:
+        return self.registry.get(VehiclesRepository)
+
+    @property
+    def insurance_repo(self) -> InsuranceRepository:
+        return self.registry.get(InsuranceRepository)
+
+    @property
+    def role_repo(self) -> RolesRepository:
+        return self.registry.get(RolesRepository)
+
+    @property
+    def temporary_repo(self) -> TemporaryRepository:
+        return self.registry.get(TemporaryRepository)
+
+    @property
+    def sketch_repo(self) -> AccidentSketchRepository:
+        return self.registry.get(AccidentSketchRepository)
+
+    @property
+    def image_repo(self) -> AccidentImageRepository:
+        return self.registry.get(AccidentImageRepository)
 
     async def create_accident_statement(self, *, vehicle_id: int, user_id:int, accident_id:int) -> Accident_statement_InDB:
         vehicle=await self.vehicles_repo.get_vehicle_by_id(id=vehicle_id, user_id= user_id)
@@ -90,37 +119,74 @@ class AccidentStatementRepository(BaseRepository):
         return created_accident_statement
 
     async def get_accident_statement_by_accident_id_user_id(self, *,accident_id: int, user_id:int, populate: bool = True):
-        accident_statement = await self.db.fetch_one(query=GET_ACCIDENT_STATEMENT_BY_ACCIDENT_ID_USER_ID_QUERY, values={"accident_id": accident_id, "user_id":user_id})
+        accident_statement = await fetch_one_prepared(self.db, query=GET_ACCIDENT_STATEMENT_BY_ACCIDENT_ID_USER_ID_QUERY, values={"accident_id": accident_id, "user_id":user_id})
         if not accident_statement:
             return None
         else:
             accident_statement = Accident_statement_InDB(**accident_statement)
+            self.loader.prime("accident_statement", accident_statement.id, accident_statement)
             if populate:
                 return await self.populate_accident_statement(accident_statement = accident_statement)
         return accident_statement
 
     async def populate_accident_statement(self, *,
-     accident_statement: Accident_statement_InDB
+     accident_statement: Accident_statement_InDB,
+     expand: Expand = None
      ) -> Accident_statement_InDB:
-        return Accident_statement_Public(
-            **accident_statement.dict(),
-            vehicle=await self.vehicles_repo.get_vehicle_by_id(id=accident_statement.vehicle_id, user_id= accident_statement.user_id, populate=False),
-            user=get_other_user_by_user_id(user_id = accident_statement.user_id),
-            insurance= await self.insurance_repo.get_insurance_by_id(id=accident_statement.insurance_id),
-            role = await self.role_repo.get_role_by_role_id(id= accident_statement.role_id),
-            sketch = await self.sketch_repo.get_accident_sketch_by_statement_id(statement_id=accident_statement.id),
-            images= await self.image_repo.get_image_data(statement_id=accident_statement.id)
-        )
-    
+        accident_statements = await self.populate_accident_statements(accident_statements=[accident_statement], expand=expand)
+        return accident_statements[0]
+
+    async def populate_accident_statements(self, *,
+     accident_statements: List[Accident_statement_InDB],
+     expand: Expand = None
+     ) -> List[Accident_statement_Public]:
+        # one set based query per expanded related table, whatever the number of statements
+        expand = expand or Expand()
+        statement_ids = [accident_statement.id for accident_statement in accident_statements]
+        related = {}
+        if "vehicle" in expand:
+            vehicles = await self.vehicles_repo.get_vehicles_by_id_user_id_pairs(
+                pairs=[(accident_statement.vehicle_id, accident_statement.user_id) for accident_statement in accident_statements])
+            related["vehicle"] = lambda accident_statement: vehicles.get((accident_statement.vehicle_id, accident_statement.user_id))
+        if "user" in expand:
+            users = await self.users_repo.get_other_users(user_ids=[accident_statement.user_id for accident_statement in accident_statements])
+            related["user"] = lambda accident_statement: users.get(accident_statement.user_id)
+        if "insurance" in expand:
+            insurances = await self.insurance_repo.get_insurances_by_ids(ids=[accident_statement.insurance_id for accident_statement in accident_statements])
+            related["insurance"] = lambda accident_statement: insurances.get(accident_statement.insurance_id)
+        if "role" in expand:
+            roles = await self.role_repo.get_roles_by_ids(ids=[accident_statement.role_id for accident_statement in accident_statements])
+            related["role"] = lambda accident_statement: roles.get(accident_statement.role_id)
+        if "sketch" in expand:
+            sketches = await self.sketch_repo.get_accident_sketches_by_statement_ids(statement_ids=statement_ids)
+            related["sketch"] = lambda accident_statement: sketches.get(accident_statement.id)
+        if "images" in expand:
+            images = await self.image_repo.get_image_data_by_statement_ids(statement_ids=statement_ids)
+            related["images"] = lambda accident_statement: images.get(accident_statement.id)
+        return [
+            Accident_statement_Public(
+                **accident_statement.dict(),
+                **{field: get_related(accident_statement) for field, get_related in related.items()},
+            )
+            for accident_statement in accident_statements
+        ]
+
     async def get_all_accident_statements_for_accident_id(self, *, accident_id: int, populate: bool = True)-> List[Accident_statement_InDB]:
-        accident_statements = await self.db.fetch_all(query=GET_ACCIDENT_STATEMENTS_BY_ACCIDENT_ID_QUERY, values={"accident_id": accident_id})
-        accident_statements_list = []
+        accident_statements = await self.get_all_accident_statements_for_accident_ids(accident_ids=[accident_id], populate=populate)
+        return accident_statements[accident_id]
+
+    async def get_all_accident_statements_for_accident_ids(self, *, accident_ids: List[int], populate: bool = True,
+        expand: Expand = None) -> Dict[int, List[Accident_statement_InDB]]:
+        statements_by_accident = {accident_id: [] for accident_id in accident_ids}
+        if not accident_ids:
+            return statements_by_accident
+        accident_statement_records = await fetch_all_prepared(self.db, query=GET_ACCIDENT_STATEMENTS_BY_ACCIDENT_IDS_QUERY, values={"accident_ids": accident_ids})
+        accident_statements = [Accident_statement_InDB(**accident_statement) for accident_statement in accident_statement_records]
+        if populate:
+            accident_statements = await self.populate_accident_statements(accident_statements=accident_statements, expand=expand)
         for accident_statement in accident_statements:
-            accident_statement = Accident_statement_InDB(**accident_statement)
-            if populate:
-                stmt = await self.populate_accident_statement(accident_statement = accident_statement)
-                accident_statements_list.append(stmt)
-        return accident_statements_list
+            statements_by_accident[accident_statement.accident_id].append(accident_statement)
+        return statements_by_accident
 
     async def create_new_accident_statement(self, *, new_accident_statement: Accident_statement_Create)->Accident_statement_InDB:
         query_values = new_accident_statement.dict(exclude_unset=True)
@@ -140,17 +206,19 @@ class AccidentStatementRepository(BaseRepository):
                 query=UPDATE_ACCIDENT_STATEMENT_FOR_ACCIDENT_QUERY, 
                 values= stmt_update_params.dict(exclude={"id","created_at", "updated_at", "vehicle_id", "insurance_id", "role_id", "car_damage", "done"}),
                 )
+            self.loader.clear("accident_statement", accident_statement.id)
             print(updated_stmt)
             return updated_stmt
         except Exception as e:
             print(e)
             raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid update params.")
 
+    async def fetch_accident_statements_by_ids(self, ids: List[int]) -> Dict[int, Accident_statement_InDB]:
+        accident_statements = await fetch_all_prepared(self.db, query=GET_ACCIDENT_STATEMENTS_BY_IDS_QUERY, values={"ids": ids})
+        return {accident_statement["id"]: Accident_statement_InDB(**accident_statement) for accident_statement in accident_statements}
+
     async def get_accident_statement_by_id(self, *, id: int, populate: bool = False)-> Accident_statement_InDB:
-        accident_statement = await self.db.fetch_one(query=GET_ACCIDENT_STATEMENT_BY_ID_QUERY, values={"id": id})
-        if not accident_statement:
-            return None
-        return Accident_statement_InDB(**accident_statement)
+        return await self.loader.load("accident_statement", id, self.fetch_accident_statements_by_ids)
 
 
     async def update_accident_statement_detection(self, *, accident_id: int, user_id:int, accident_statement_update: Accident_Statement_Detection_Update):
@@ -166,6 +234,7 @@ class AccidentStatementRepository(BaseRepository):
                 query=UPDATE_ACCIDENT_STATEMENT_DETECTION_FOR_ACCIDENT_QUERY, 
                 values= stmt_update_params.dict(exclude={"id","created_at", "updated_at", "vehicle_id", "insurance_id", "role_id", "caused_by", "comments" , "done"}),
                 )
+            self.loader.clear("accident_statement", accident_statement.id)
             print(updated_stmt)
             return updated_stmt
         except Exception as e:
@@ -181,6 +250,7 @@ class AccidentStatementRepository(BaseRepository):
         else:
             completed_accident_statement= await self.db.fetch_one(query=UPDATE_ACCIDENT_STATEMENT_AS_COMPLETE_QUERY,
                                                     values={"accident_id": accident_id, "user_id": user_id })
+            self.loader.clear("accident_statement", accident_statement.id)
             return await self.populate_accident_statement(accident_statement = Accident_statement_InDB(**completed_accident_statement))
             
 
@@ -1,7 +1,43 @@
+from typing import Dict, Optional, Type, TypeVar
 from databases import Database
+from app.core.cache import InsuranceCompanyCache
+from app.db.dataloader import DataLoader
+from app.db.repositories.users import UsersRepository
+
+Repository = TypeVar("Repository", bound="BaseRepository")
+
+
+class RepositoryRegistry:
+    """
+    Request scoped repository graph.
+    Repositories are built lazily on first use and shared, so each class exists at most once per request.
+
+    """
+    def __init__(self, db: Database, users_repo: Optional[UsersRepository] = None,
+        insurance_company_cache: Optional[InsuranceCompanyCache] = None) -> None:
+        self.db = db
+        self.users_repo = users_repo
+        # process wide, unlike everything else here
+        self.insurance_company_cache = insurance_company_cache
+        self.loader = DataLoader(db)
+        self.repositories: Dict[type, "BaseRepository"] = {}
+
+    def get(self, Repo_type: Type[Repository]) -> Repository:
+        if Repo_type not in self.repositories:
+            Repo_type(self.db, registry=self)
+        return self.repositories[Repo_type]
 
 
 class BaseRepository:
-    def __init__(self, db: Database) -> None:
+    def __init__(self, db: Database, users_repo: Optional[UsersRepository] = None, registry: Optional[RepositoryRegistry] = None) -> None:
         self.db = db
+        self.registry = registry or RepositoryRegistry(db, users_repo=users_repo)
+        self.registry.repositories.setdefault(type(self), self)
+
+    @property
+    def users_repo(self) -> Optional[UsersRepository]:
+        return self.registry.users_repo
 
+    @property
+    def loader(self) -> DataLoader:
+        return self.registry.loader
@@ -1,11 +1,12 @@
-from typing import List
+from typing import AsyncIterator, Dict, List, Mapping, Tuple
 import datetime
 from fastapi import HTTPException
 from starlette.status import HTTP_400_BAD_REQUEST
 from app.models.vehicles import VehiclesPublic, VehiclesInDB
+from app.db.prepared import copy_records, fetch_all_prepared, fetch_one_prepared
 from app.db.repositories.base import BaseRepository
 from app.db.repositories.insurance_company import InsuranceCompanyRepository
-from app.models.insurance import InsuranceAdd, InsuranceUpdate, InsuranceInDB, InsurancePublic
+from app.models.insurance import InsuranceAdd, InsuranceImport, InsuranceUpdate, InsuranceInDB, InsurancePublic
 from databases import Database
 
 
@@ -35,6 +36,12 @@ GET_INSURANCE_BY_ID_QUERY = """
     WHERE id = :id;
 """
 
+GET_INSURANCES_BY_IDS_QUERY = """
+    SELECT id, number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id, created_at, updated_at
+    FROM insurance
+    WHERE id = ANY(:ids);
+"""
+
 GET_LAST_CREATED_INSURANCE_BY_VEHICLE_ID_QUERY = """
     SELECT id, number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id, created_at, updated_at
     FROM insurance
@@ -99,10 +106,74 @@ SELECT v1.id, v1.sign, v1.type, v1.model, v1.manufacture_year, v1.created_at, v1
 """
 
 
+NEXT_INSURANCE_IMPORT_ID_QUERY = """
+    SELECT nextval('insurance_import_id_seq') AS import_id;
+"""
+
+# the rules of create_insurance_for_vehicle and update_last_created_insurance, applied to every staged row at once:
+# a placeholder insurance is filled in, otherwise the policy is added once the vehicle's last one has expired.
+# a plate that appears more than once is taken from its last row
+IMPORT_INSURANCES_QUERY = """
+    WITH staged AS (
+        SELECT ii.row, UPPER(ii.number) AS number, ii.start_date, ii.expire_date, ii.damage_coverance, v.id AS vehicle_id,
+            row_number() OVER (PARTITION BY v.id ORDER BY ii.row DESC) AS newest
+        FROM insurance_import ii
+            LEFT JOIN LATERAL (
+                SELECT id FROM vehicles WHERE plate_key = normalize_plate(ii.plate) ORDER BY id DESC LIMIT 1
+            ) v ON TRUE
+        WHERE ii.import_id = :import_id
+    ), checked AS (
+        SELECT s.*, last.id AS last_insurance_id, last.number = 'ADD INSURANCE' AS placeholder,
+            CASE
+                WHEN s.vehicle_id IS NULL THEN 'No vehicle found with that plate'
+                WHEN s.newest > 1 THEN 'A later row has the same plate'
+                WHEN s.start_date > s.expire_date THEN 'Insurance start date is after expire date'
+                WHEN s.expire_date < CURRENT_DATE THEN 'This insurance is expired'
+                WHEN last.number <> 'ADD INSURANCE' AND last.expire_date > CURRENT_DATE THEN 'Wait current insurance expire'
+            END AS error
+        FROM staged s
+            LEFT JOIN LATERAL (
+                SELECT id, number, expire_date FROM insurance WHERE vehicle_id = s.vehicle_id ORDER BY id DESC LIMIT 1
+            ) last ON TRUE
+    ), updated AS (
+        UPDATE insurance i
+        SET number = c.number,
+            start_date = c.start_date,
+            expire_date = c.expire_date,
+            damage_coverance = c.damage_coverance,
+            insurance_company_id = :insurance_company_id
+        FROM checked c
+        WHERE c.error IS NULL AND c.placeholder AND i.id = c.last_insurance_id
+        RETURNING i.id, i.vehicle_id
+    ), inserted AS (
+        INSERT INTO insurance (number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+        SELECT number, start_date, expire_date, damage_coverance, vehicle_id, :insurance_company_id
+        FROM checked
+        WHERE error IS NULL AND placeholder IS NOT TRUE
+        ORDER BY vehicle_id
+        RETURNING id, vehicle_id
+    )
+    SELECT c.row, c.vehicle_id, COALESCE(u.id, n.id) AS insurance_id, c.error
+    FROM checked c
+        LEFT JOIN updated u
+        ON c.error IS NULL AND u.vehicle_id = c.vehicle_id
+        LEFT JOIN inserted n
+        ON c.error IS NULL AND n.vehicle_id = c.vehicle_id
+    ORDER BY c.row;
+"""
+
+DELETE_INSURANCE_IMPORT_QUERY = """
+    DELETE FROM insurance_import
+    WHERE import_id = :import_id;
+"""
+
+INSURANCE_IMPORT_COLUMNS = ["import_id", "row", "plate", "number", "start_date", "expire_date", "damage_coverance"]
+
+
 class InsuranceRepository(BaseRepository):
-    def __init__(self, db: Database) -> None:
-        super().__init__(db)
-        self.insurance_co_repo = InsuranceCompanyRepository(db) 
+    @property
+    def insurance_co_repo(self) -> InsuranceCompanyRepository:
+        return self.registry.get(InsuranceCompanyRepository)
 
     async def create_insurance_for_vehicle(self, *, new_insurance: InsuranceAdd , vehicle_id: int) -> InsuranceInDB:
         insurance = await self.get_last_created_insurance_by_vehicle_id(vehicle_id=vehicle_id)
@@ -119,29 +190,42 @@ class InsuranceRepository(BaseRepository):
                         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Insurance start date is after expire date")
         # raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="You can only update selected vehicle.")
         created_insurance = await self.db.fetch_one(query=CREATE_INSURANCE_FOR_VEHICLE_QUERY, values=query_values)
+        self.loader.clear("insurance")
         return created_insurance
 
     async def create_first_insurance_for_vehicle(self, *, vehicle_id: int) -> InsuranceInDB:
         created_insurance = await self.db.fetch_one(query=CREATE_FIRST_INSURANCE_FOR_VEHICLE_QUERY, values={"vehicle_id": vehicle_id})
         return created_insurance
 
+    async def fetch_insurances_by_ids(self, ids: List[int]) -> Dict[int, InsuranceInDB]:
+        insurance_records = await fetch_all_prepared(self.db, query=GET_INSURANCES_BY_IDS_QUERY, values={"ids": ids})
+        return {insurance_record["id"]: InsuranceInDB(**insurance_record) for insurance_record in insurance_records}
+
     async def get_insurance_by_id(self, *, id:int, populate: bool = True) -> InsuranceInDB:
-        insurance_record = await self.db.fetch_one(query=GET_INSURANCE_BY_ID_QUERY, values={"id": id})
-        if not insurance_record:
+        insurance = await self.loader.load("insurance", id, self.fetch_insurances_by_ids)
+        if not insurance:
             return None
         else:    
-            insurance =  InsuranceInDB(**insurance_record)
             if populate:
                 return await self.populate_insurance(insurance = insurance)
         return insurance
 
+    async def get_insurances_by_ids(self, *, ids: List[int]) -> Dict[int, InsurancePublic]:
+        insurances = (await self.loader.load_many("insurance", ids, self.fetch_insurances_by_ids)).values()
+        insurance_companies = await self.insurance_co_repo.get_insurance_companies_by_ids(
+            ids=[insurance.insurance_company_id for insurance in insurances])
+        return {
+            insurance.id: InsurancePublic(**insurance.dict(), insurance_company=insurance_companies.get(insurance.insurance_company_id))
+            for insurance in insurances
+        }
 
     async def get_last_created_insurance_by_vehicle_id(self, *, vehicle_id: int, populate: bool = True) -> InsuranceInDB:
-        insurance_record = await self.db.fetch_one(query=GET_LAST_CREATED_INSURANCE_BY_VEHICLE_ID_QUERY, values={"vehicle_id": vehicle_id})
+        insurance_record = await fetch_one_prepared(self.db, query=GET_LAST_CREATED_INSURANCE_BY_VEHICLE_ID_QUERY, values={"vehicle_id": vehicle_id})
         if not insurance_record:
             return None
         else:
             insurance = InsuranceInDB(**insurance_record)
+            self.loader.prime("insurance", insurance.id, insurance)
             if populate:
                 return await self.populate_insurance(insurance = insurance)
         return insurance
@@ -184,6 +268,25 @@ class InsuranceRepository(BaseRepository):
     #         print(e)
     #         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Invalid update params.")
 
+    async def import_insurances(self, *, batches: AsyncIterator[List[Tuple[int, InsuranceImport]]], insurance_company_id: int) -> List[Mapping]:
+        """
+        Writes the policies of an insurance company in one transaction. Every row comes back with
+        the vehicle and insurance it was written to, or the reason it was rejected.
+
+        """
+        async with self.db.transaction():
+            import_id = await self.db.fetch_val(query=NEXT_INSURANCE_IMPORT_ID_QUERY)
+            async for batch in batches:
+                await copy_records(self.db, table="insurance_import", columns=INSURANCE_IMPORT_COLUMNS, records=[
+                    (import_id, row, policy.plate, policy.number, policy.start_date, policy.expire_date, policy.damage_coverance)
+                    for row, policy in batch
+                ])
+            results = await self.db.fetch_all(query=IMPORT_INSURANCES_QUERY,
+                values={"import_id": import_id, "insurance_company_id": insurance_company_id})
+            await self.db.execute(query=DELETE_INSURANCE_IMPORT_QUERY, values={"import_id": import_id})
+        self.loader.clear("insurance")
+        return results
+
     async def update_last_created_insurance(self, *, vehicle_id:int , insurance_update: InsuranceUpdate) -> InsuranceInDB:
         insurance = await self.get_last_created_insurance_by_vehicle_id(vehicle_id=vehicle_id, populate = False)
         
@@ -204,6 +307,7 @@ class InsuranceRepository(BaseRepository):
                 query=UPDATE_INSURANCE_BY_VEHICLE_ID_QUERY, 
                 values= insurance_update_params.dict(exclude={"id","created_at", "updated_at"}),
                 )
+            self.loader.clear("insurance")
             return InsuranceInDB(**updated_insurance)
         except Exception as e:
             print(e)
@@ -1,5 +1,7 @@
-from typing import List
+from typing import Any, Callable, Dict, List, Optional
 from pydantic import EmailStr
+from app.core.cache import InsuranceCompanyCache
+from app.db.prepared import fetch_all_prepared
 from app.db.repositories.base import BaseRepository
 from app.models.insurance_company import InsuranceCompanyInDB, InsuranceCompanyCreate
 
@@ -21,33 +23,97 @@ GET_INSURANCE_COMPANY_BY_NAME_QUERY = """
     WHERE name = :name;
 """
 
+GET_INSURANCE_COMPANY_BY_EMAIL_QUERY = """
+    SELECT id, name, email, created_at, updated_at
+    FROM insurance_company
+    WHERE email = :email;
+"""
+
+GET_INSURANCE_COMPANIES_BY_IDS_QUERY = """
+    SELECT id, name, email, created_at, updated_at
+    FROM insurance_company
+    WHERE id = ANY(:ids);
+"""
 
 GET_ALL_INSURANCE_COMPANIES_QUERY = """
     SELECT id, name, email, created_at, updated_at
-    FROM insurance_company;  
+    FROM insurance_company
+    WHERE id > :cursor
+    ORDER BY id
+    LIMIT :limit;
 """
 
 
 class InsuranceCompanyRepository(BaseRepository):
 
+    async def load_insurance_company_cache(self, cache: InsuranceCompanyCache) -> None:
+        insurance_companies = await self.db.fetch_all(query=GET_ALL_INSURANCE_COMPANIES_QUERY, values={"limit": None, "cursor": -1})
+        cache.load(InsuranceCompanyInDB(**l) for l in insurance_companies)
+
+    async def get_insurance_company_cache(self) -> Optional[InsuranceCompanyCache]:
+        # None for repositories built outside of a request, which always read the table
+        cache = self.registry.insurance_company_cache
+        if cache is not None and not cache.is_loaded:
+            await self.load_insurance_company_cache(cache)
+        return cache
+
+    async def get_cached_insurance_company(self, lookup: Callable[[InsuranceCompanyCache], Any],
+        query: str, values: Dict[str, Any]) -> InsuranceCompanyInDB:
+        cache = await self.get_insurance_company_cache()
+        if cache is not None:
+            insurance_company = lookup(cache)
+            if insurance_company is not None:
+                return insurance_company
+        insurance_company = await self.db.fetch_one(query=query, values=values)
+        if not insurance_company:
+            return None
+        if cache is not None:
+            # created by another worker since the cache was loaded
+            cache.invalidate()
+        return InsuranceCompanyInDB(**insurance_company)
+
     async def create_insurance_company(self, *, new_insurance_company: InsuranceCompanyCreate) -> InsuranceCompanyInDB:
         query_values = new_insurance_company.dict()
         insurance_company = await self.db.fetch_one(CREATE_INSURANCE_COMPANY_QUERY, query_values)
+        if self.registry.insurance_company_cache is not None:
+            self.registry.insurance_company_cache.invalidate()
 
         return InsuranceCompanyInDB(**insurance_company)
 
+    async def fetch_insurance_companies_by_ids(self, ids: List[int]) -> Dict[int, InsuranceCompanyInDB]:
+        cache = await self.get_insurance_company_cache()
+        if cache is None:
+            insurance_companies = await fetch_all_prepared(self.db, query=GET_INSURANCE_COMPANIES_BY_IDS_QUERY, values={"ids": ids})
+            return {l["id"]: InsuranceCompanyInDB(**l) for l in insurance_companies}
+        found = {id: cache.get_by_id(id) for id in ids}
+        missing = [id for id, insurance_company in found.items() if insurance_company is None]
+        if missing:
+            insurance_companies = await fetch_all_prepared(self.db, query=GET_INSURANCE_COMPANIES_BY_IDS_QUERY, values={"ids": missing})
+            if insurance_companies:
+                cache.invalidate()
+            found.update({l["id"]: InsuranceCompanyInDB(**l) for l in insurance_companies})
+        return {id: insurance_company for id, insurance_company in found.items() if insurance_company is not None}
+
     async def get_insurance_company_by_id(self, *, id: int) -> InsuranceCompanyInDB:
-        insurance_company = await self.db.fetch_one(query=GET_INSURANCE_COMPANY_BY_ID_QUERY, values={"id": id})
-        if not insurance_company:
-            return None
-        return InsuranceCompanyInDB(**insurance_company)
+        return await self.loader.load("insurance_company", id, self.fetch_insurance_companies_by_ids)
+
+    async def get_insurance_companies_by_ids(self, *, ids: List[int]) -> Dict[int, InsuranceCompanyInDB]:
+        return await self.loader.load_many("insurance_company", ids, self.fetch_insurance_companies_by_ids)
 
     async def get_insurance_company_by_name(self, *, name: str) -> InsuranceCompanyInDB:
-        insurance_company = await self.db.fetch_one(query=GET_INSURANCE_COMPANY_BY_NAME_QUERY, values={"name": name})
-        if not insurance_company:
-            return None
-        return InsuranceCompanyInDB(**insurance_company)
+        return await self.get_cached_insurance_company(lambda cache: cache.get_by_name(name),
+            GET_INSURANCE_COMPANY_BY_NAME_QUERY, {"name": name})
+
+    async def get_insurance_company_by_email(self, *, email: EmailStr) -> InsuranceCompanyInDB:
+        return await self.get_cached_insurance_company(lambda cache: cache.get_by_email(email),
+            GET_INSURANCE_COMPANY_BY_EMAIL_QUERY, {"email": email})
 
-    async def get_all_insurance_companies(self) -> List[InsuranceCompanyInDB]:
-        insurance_companies_records = await self.db.fetch_all(query=GET_ALL_INSURANCE_COMPANIES_QUERY)
+    async def get_all_insurance_companies(self, *, limit: int = None, cursor: int = None) -> List[InsuranceCompanyInDB]:
+        # pages are ordered by ascending id, company 0 is the placeholder for vehicles without insurance
+        cursor = -1 if cursor is None else cursor
+        cache = await self.get_insurance_company_cache()
+        if cache is not None:
+            return cache.page(cursor=cursor, limit=limit)
+        insurance_companies_records = await self.db.fetch_all(query=GET_ALL_INSURANCE_COMPANIES_QUERY,
+            values={"limit": limit, "cursor": cursor})
         return [InsuranceCompanyInDB(**l) for l in insurance_companies_records]
@@ -1,8 +1,9 @@
+from app.db.prepared import fetch_all_prepared, fetch_one_prepared
 from app.db.repositories.base import BaseRepository
 from app.models.roles import RoleCreate, RoleInDB, RoleUpdate
 from starlette.status import HTTP_400_BAD_REQUEST
 from fastapi import HTTPException
-from typing import List
+from typing import Dict, List
 
 CREATE_FIRST_ROLE_OF_USER_FOR_VEHICLE_QUERY = """
     INSERT INTO roles (role, user_id, vehicle_id)
@@ -28,6 +29,12 @@ GET_USER_ROLE_BY_ROLE_ID_QUERY = """
     WHERE id = :id;
 """
 
+GET_USER_ROLES_BY_IDS_QUERY = """
+    SELECT id, role, user_id, vehicle_id, created_at, updated_at
+    FROM roles
+    WHERE id = ANY(:ids);
+"""
+
 GET_USER_ROLE_BY_VEHICLE_ID_QUERY = """
     SELECT id, role, user_id, vehicle_id, created_at, updated_at
     FROM roles
@@ -41,12 +48,13 @@ GET_USER_ROLE_BY_VEHICLE_ID_QUERY = """
 #     WHERE vehicle_id = :vehicle_id and user_id = :user_id;
 # """
 
+# current_roles holds the newest role of every (vehicle, user) pair, it is kept up to date by a trigger on roles
 GET_LAST_USER_ROLE_BY_VEHICLE_USER_ID_QUERY = """
-    SELECT id, role, user_id, vehicle_id, created_at, updated_at
-    FROM roles
-    WHERE vehicle_id = :vehicle_id and user_id = :user_id
-    ORDER BY id DESC
-    LIMIT 1;
+    SELECT r.id, r.role, r.user_id, r.vehicle_id, r.created_at, r.updated_at
+    FROM current_roles cr
+        INNER JOIN roles r
+        ON r.id = cr.role_id
+    WHERE cr.vehicle_id = :vehicle_id and cr.user_id = :user_id;
 """
 
 
@@ -71,21 +79,26 @@ class RolesRepository(BaseRepository):
             role_list.append(role)
         return role_list
 
+    async def fetch_roles_by_ids(self, ids: List[int]) -> Dict[int, RoleInDB]:
+        role_records = await fetch_all_prepared(self.db, query=GET_USER_ROLES_BY_IDS_QUERY, values={"ids": ids})
+        return {role_record["id"]: RoleInDB(**role_record) for role_record in role_records}
+
     async def get_role_by_role_id(self, *, id: int, ) -> RoleInDB:
-        role_record = await self.db.fetch_one(
-            query=GET_USER_ROLE_BY_ROLE_ID_QUERY,
-            values={"id": id})
-        if not role_record:
-            return None
-        return RoleInDB(**role_record)
+        return await self.loader.load("roles", id, self.fetch_roles_by_ids)
+
+    async def get_roles_by_ids(self, *, ids: List[int]) -> Dict[int, RoleInDB]:
+        return await self.loader.load_many("roles", ids, self.fetch_roles_by_ids)
 
     async def get_user_role_by_vehicle_user_id(self, *, vehicle_id: int, user_id:int) -> RoleInDB:
-        role_record = await self.db.fetch_one(
+        role_record = await fetch_one_prepared(
+            self.db,
             query=GET_LAST_USER_ROLE_BY_VEHICLE_USER_ID_QUERY,
             values={"vehicle_id": vehicle_id, "user_id": user_id})
         if not role_record:
             return None
-        return RoleInDB(**role_record)
+        role = RoleInDB(**role_record)
+        self.loader.prime("roles", role.id, role)
+        return role
 
     async def update_role(self, *, vehicle_id: int, user_id:int, role_update: RoleUpdate) -> RoleInDB:
         role = await self.get_user_role_by_vehicle_user_id(vehicle_id=vehicle_id, user_id=user_id)
@@ -97,6 +110,7 @@ class RolesRepository(BaseRepository):
                 query=UPDATE_ROLE_BY_ID_QUERY, 
                 values= role_update_params.dict(exclude={"id", "created_at", "updated_at"}),
                 )
+            self.loader.clear("roles")
             return RoleInDB(**updated_role)
         except Exception as e:
             print(e)
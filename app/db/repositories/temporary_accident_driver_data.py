@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 from fastapi import HTTPException, Depends
 from starlette.status import HTTP_400_BAD_REQUEST
 from app.db.repositories.base import BaseRepository
@@ -23,6 +23,13 @@ GET_TEMPORARY_DRIVERS_DATA_BY_ACCIDENT_ID_QUERY = """
     WHERE accident_id = :accident_id;
 """
 
+GET_TEMPORARY_DRIVERS_DATA_BY_ACCIDENT_IDS_QUERY = """
+    SELECT id, accident_id, driver_full_name, driver_email, vehicle_sign, insurance_number, insurance_email, answered, created_at, updated_at
+    FROM temporary_accident_driver_data
+    WHERE accident_id = ANY(:accident_ids)
+    ORDER BY id;
+"""
+
 GET_TEMPORARY_DRIVER_DATA_BY_EMAIL_ACCIDENT_ID_QUERY = """
     SELECT id, accident_id, driver_full_name, driver_email, vehicle_sign, insurance_number, insurance_email, answered, created_at, updated_at
     FROM temporary_accident_driver_data
@@ -80,6 +87,15 @@ class TemporaryRepository(BaseRepository):
         temporary_accident_drivers_data = await self.db.fetch_all(query=GET_TEMPORARY_DRIVERS_DATA_BY_ACCIDENT_ID_QUERY, values={"accident_id": accident_id})
         return temporary_accident_drivers_data
 
+    async def get_all_temporary_driver_data_for_accident_ids(self, *, accident_ids: List[int]) -> Dict[int, List[Temporary_Data_InDB]]:
+        temporary_by_accident = {accident_id: [] for accident_id in accident_ids}
+        if not accident_ids:
+            return temporary_by_accident
+        temporary_accident_drivers_data = await self.db.fetch_all(query=GET_TEMPORARY_DRIVERS_DATA_BY_ACCIDENT_IDS_QUERY, values={"accident_ids": accident_ids})
+        for temporary_accident_driver_data in temporary_accident_drivers_data:
+            temporary_by_accident[temporary_accident_driver_data["accident_id"]].append(temporary_accident_driver_data)
+        return temporary_by_accident
+
     async def get_temporary_driver_data_by_driver_email(self, *, accident_id: int, email : EmailStr)-> Temporary_Data_InDB:
         temporary_accident_driver_data = await self.db.fetch_one(query=GET_TEMPORARY_DRIVER_DATA_BY_EMAIL_ACCIDENT_ID_QUERY, values={"accident_id": accident_id, "email": email})
         if not temporary_accident_driver_data:
@@ -1,12 +1,23 @@
-import requests
-from typing import Optional
+import asyncio
+import httpx
+from typing import Dict, Iterable, Optional
+from app.core.config import USERS_SERVICE_RETRIES, USERS_SERVICE_MAX_CONNECTIONS
 from app.models.users import UserPublic, UserInDB, ProfilePublic
 from fastapi import Depends, HTTPException, status
 from pydantic import EmailStr
 
 class UsersRepository:
-    def __init__(self):
-        self.url = 'http://sohereweare_server_1:8000'
+    """
+    All calls to the users service, made through the shared async client created at startup.
+    One instance lives for one request, so profiles are fetched at most once per request.
+
+    """
+    def __init__(self, client: httpx.AsyncClient, token: Optional[str] = None):
+        self.client = client
+        self.token = token
+        self.retries = USERS_SERVICE_RETRIES
+        self.profiles: Dict[int, asyncio.Future] = {}
+        self.semaphore = asyncio.Semaphore(USERS_SERVICE_MAX_CONNECTIONS)
 
     @staticmethod
     def get_headers(token):
@@ -16,12 +27,44 @@ class UsersRepository:
         }
         return headers
 
-    def get_current_user(self, token: str) -> Optional[UserPublic]:
-        url = self.url + r'/api/users/me/'
-        current_user = UserPublic(**requests.request('GET', url=url, headers=self.get_headers(token)).json())
-        return current_user
+    async def get(self, *, url: str, token: str) -> Optional[dict]:
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.get(url, headers=self.get_headers(token))
+                break
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Users service is not available.",
+                    )
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        if response.status_code != status.HTTP_200_OK:
+            return None
+        return response.json()
+
+    async def get_current_user(self, token: str) -> Optional[UserPublic]:
+        url = r'/api/users/me/'
+        current_user = await self.get(url=url, token=token)
+        if not current_user:
+            return None
+        return UserPublic(**current_user)
+
+    async def fetch_other_user(self, *, token: Optional[str], user_id: int) -> Optional[ProfilePublic]:
+        url = f'/api/profiles/{user_id}/'
+        async with self.semaphore:
+            other_user = await self.get(url=url, token=token or self.token)
+        if not other_user:
+            return None
+        return ProfilePublic(**other_user)
+
+    async def get_other_user(self,*, token: Optional[str] = None, user_id: int) -> Optional[ProfilePublic]:
+        if user_id not in self.profiles:
+            self.profiles[user_id] = asyncio.ensure_future(self.fetch_other_user(token=token, user_id=user_id))
+        return await self.profiles[user_id]
 
-    def get_other_user(self,*, token: str, user_id: int):
-        url = self.url + f'/api/profiles/{user_id}/'
-        other_user = ProfilePublic(**requests.request('GET', url=url, headers=self.get_headers(token)).json())
-        return other_user
+    async def get_other_users(self, *, token: Optional[str] = None, user_ids: Iterable[int]) -> Dict[int, Optional[ProfilePublic]]:
+        # the users service has no bulk endpoint, so the distinct ids are fetched concurrently
+        user_ids = list(dict.fromkeys(user_ids))
+        profiles = await asyncio.gather(*[self.get_other_user(token=token, user_id=user_id) for user_id in user_ids])
+        return dict(zip(user_ids, profiles))
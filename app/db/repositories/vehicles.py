@@ -1,27 +1,120 @@
-from typing import List
+from typing import AsyncIterator, Dict, List, Mapping, Optional, Tuple
+from app.db.prepared import copy_records, fetch_all_prepared
 from app.db.repositories.base import BaseRepository
 from fastapi import HTTPException, Depends
 from starlette.status import HTTP_400_BAD_REQUEST
-from app.models.vehicles import VehiclesCreate, VehiclesInDB, VehiclesPublic
+from app.models.vehicles import VehiclesCreate, VehiclesInDB, VehiclesPublic, VehicleSearchResult
 from app.models.insurance import InsuranceAdd, InsurancePublic, InsuranceInDB, InsuranceUpdate
 from app.db.repositories.insurance import InsuranceRepository
 from app.db.repositories.roles import RolesRepository
-from app.models.roles import RoleCreate
+from app.models.roles import RoleCreate, RoleInDB
+from app.models.insurance_company import InsuranceCompanyInDB
 from app.models.users import UserPublic
+from app.models.pagination import FIRST_PAGE_KEY
+from app.models.expand import Expand
 from databases import Database
 from pydantic import EmailStr
 
+# one statement registers the vehicle for the user: the upsert, the placeholder insurance of a vehicle that has
+# none yet and the user's role, returning the vehicle with its newest insurance, company and role.
+# every part of a data modifying CTE sees the snapshot from before the statement, so the placeholder is only
+# added when the vehicle had no insurance and the newest insurance is either the placeholder or the stored one
 CREATE_VEHICLE_QUERY = """
-    INSERT INTO vehicles (sign, type, model, manufacture_year)
-    VALUES (UPPER(:sign), :type, UPPER(:model), :manufacture_year)
-    ON CONFLICT(sign) DO UPDATE
-    SET type=EXCLUDED.type,
-        model=EXCLUDED.model,
-        manufacture_year=EXCLUDED.manufacture_year  
-    RETURNING id, sign, type, model, manufacture_year, created_at, updated_at;
+    WITH vehicle AS (
+        INSERT INTO vehicles (sign, type, model, manufacture_year)
+        VALUES (UPPER(:sign), :type, UPPER(:model), :manufacture_year)
+        ON CONFLICT(sign) DO UPDATE
+        SET type=EXCLUDED.type,
+            model=EXCLUDED.model,
+            manufacture_year=EXCLUDED.manufacture_year
+        RETURNING id, sign, type, model, manufacture_year, created_at, updated_at
+    ), first_insurance AS (
+        INSERT INTO insurance (number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+        SELECT 'ADD INSURANCE', '2001-01-01', '2001-01-01', 'False', vehicle.id, 0
+        FROM vehicle
+        WHERE NOT EXISTS (SELECT 1 FROM insurance i WHERE i.vehicle_id = vehicle.id)
+        RETURNING id, number, start_date, expire_date, damage_coverance, insurance_company_id, created_at, updated_at
+    ), role AS (
+        INSERT INTO roles (role, user_id, vehicle_id)
+        SELECT 'user', :user_id, vehicle.id
+        FROM vehicle
+        RETURNING id, role, user_id, created_at, updated_at
+    ), last_insurance AS (
+        SELECT * FROM first_insurance
+        UNION ALL
+        (SELECT i.id, i.number, i.start_date, i.expire_date, i.damage_coverance, i.insurance_company_id, i.created_at, i.updated_at
+        FROM insurance i
+            INNER JOIN vehicle
+            ON i.vehicle_id = vehicle.id
+        ORDER BY i.id DESC
+        LIMIT 1)
+    )
+    SELECT vehicle.id, vehicle.sign, vehicle.type, vehicle.model, vehicle.manufacture_year, vehicle.created_at, vehicle.updated_at,
+        li.id AS insurance_id, li.number AS insurance_number, li.start_date AS insurance_start_date,
+        li.expire_date AS insurance_expire_date, li.damage_coverance AS insurance_damage_coverance,
+        li.insurance_company_id, li.created_at AS insurance_created_at, li.updated_at AS insurance_updated_at,
+        ic.name AS insurance_company_name, ic.email AS insurance_company_email,
+        role.id AS role_id, role.role, role.user_id, role.created_at AS role_created_at, role.updated_at AS role_updated_at
+    FROM vehicle
+        CROSS JOIN role
+        LEFT JOIN last_insurance li
+        ON TRUE
+        LEFT JOIN insurance_company ic
+        ON ic.id = li.insurance_company_id;
+"""
+
+NEXT_VEHICLE_IMPORT_ID_QUERY = """
+    SELECT nextval('vehicle_import_id_seq') AS import_id;
+"""
 
+# the rows of an import are COPY'd into vehicle_import first, then registered in one statement.
+# a sign that appears more than once is taken from its last row, the earlier rows are reported as duplicates.
+# vehicles are upserted in sign order so concurrent imports lock them in the same order
+IMPORT_VEHICLES_QUERY = """
+    WITH staged AS (
+        SELECT DISTINCT ON (UPPER(sign)) row, UPPER(sign) AS sign, type, UPPER(model) AS model, manufacture_year
+        FROM vehicle_import
+        WHERE import_id = :import_id
+        ORDER BY UPPER(sign), row DESC
+    ), vehicle AS (
+        INSERT INTO vehicles (sign, type, model, manufacture_year)
+        SELECT sign, type, model, manufacture_year
+        FROM staged
+        ORDER BY sign
+        ON CONFLICT(sign) DO UPDATE
+        SET type=EXCLUDED.type,
+            model=EXCLUDED.model,
+            manufacture_year=EXCLUDED.manufacture_year
+        RETURNING id, sign, (xmax = 0) AS created
+    ), first_insurance AS (
+        INSERT INTO insurance (number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+        SELECT 'ADD INSURANCE', '2001-01-01', '2001-01-01', 'False', vehicle.id, 0
+        FROM vehicle
+        WHERE NOT EXISTS (SELECT 1 FROM insurance i WHERE i.vehicle_id = vehicle.id)
+    ), role AS (
+        INSERT INTO roles (role, user_id, vehicle_id)
+        SELECT 'owner', :user_id, vehicle.id
+        FROM vehicle
+        WHERE NOT EXISTS (SELECT 1 FROM current_roles cr WHERE cr.vehicle_id = vehicle.id AND cr.user_id = :user_id)
+    )
+    SELECT vi.row, vehicle.id, vehicle.sign,
+        CASE WHEN vi.row <> staged.row THEN 'duplicate' WHEN vehicle.created THEN 'created' ELSE 'updated' END AS status
+    FROM vehicle_import vi
+        INNER JOIN staged
+        ON staged.sign = UPPER(vi.sign)
+        INNER JOIN vehicle
+        ON vehicle.sign = staged.sign
+    WHERE vi.import_id = :import_id
+    ORDER BY vi.row;
 """
 
+DELETE_VEHICLE_IMPORT_QUERY = """
+    DELETE FROM vehicle_import
+    WHERE import_id = :import_id;
+"""
+
+VEHICLE_IMPORT_COLUMNS = ["import_id", "row", "sign", "type", "model", "manufacture_year"]
+
 GET_VEHICLE_BY_ID_QUERY = """
     SELECT v.id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at
     FROM vehicles v
@@ -31,6 +124,14 @@ GET_VEHICLE_BY_ID_QUERY = """
 
 """
 
+GET_VEHICLES_BY_IDS_USER_IDS_QUERY = """
+    SELECT DISTINCT v.id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at, r.user_id
+    FROM vehicles v
+        INNER JOIN roles r
+        ON v.id = r.vehicle_id
+    WHERE v.id = ANY(:ids) AND r.user_id = ANY(:user_ids);
+"""
+
 # GET_VEHICLE_BY_SIGN_QUERY is used to check if the vehicle is already added, check create vehicle
 GET_VEHICLE_BY_SIGN_QUERY = """
     SELECT v.id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at,
@@ -42,85 +143,119 @@ GET_VEHICLE_BY_SIGN_QUERY = """
     WHERE v.id = (SELECT id FROM vehicles WHERE sign = :sign);
 """
 
+# the plate typed by another driver, matched on the normalized key so spacing, dashes and greek letters do not matter
+GET_VEHICLE_BY_USER_ID_PLATE_QUERY = """
+    SELECT v.id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at
+    FROM vehicles v
+        INNER JOIN current_roles cr
+        ON cr.vehicle_id = v.id
+    WHERE v.plate_key = normalize_plate(:sign) AND cr.user_id = :user_id
+    ORDER BY v.id DESC
+    LIMIT 1;
+"""
+
 GET_VEHICLES_BY_USER_ID_QUERY_WITH_NEWEST = """
-SELECT v1.id, v1.sign, v1.type, v1.model, v1.manufacture_year, v1.created_at, v1.updated_at,
-        v1.insurance_id, v1.number, v1.start_date, v1.expire_date, v1.damage_coverance, v1.insurance_company_id,
-        v1.insurance_create_at, v1.insurance_updated_at, r.role, r.user_id
-    FROM 
-        (SELECT id, role, r2.user_id, r1.vehicle_id
-            FROM 
-            (SELECT id, role, vehicle_id, user_id, created_at, updated_at
-                FROM roles ORDER BY id) AS r1
-                inner join (SELECT MAX(id) AS last_id ,vehicle_id, user_id FROM roles group by vehicle_id, user_id) AS r2
-            ON r1.id = r2.last_id AND r1.vehicle_id = r2.vehicle_id) 
-        AS r
-    inner JOIN 
-        (SELECT v.id AS id, v.sign AS sign, v.type AS type, v.model AS model,
-		 v.manufacture_year AS manufacture_year,v.created_at AS created_at, v.updated_at AS updated_at,
-        i.id AS insurance_id, i.number AS number, i.start_date AS start_date, i.expire_date AS expire_date, i.damage_coverance AS damage_coverance,
-		i.insurance_company_id AS insurance_company_id, i.created_at AS insurance_create_at,
-		i.updated_at AS insurance_updated_at
-        FROM vehicles v
-        INNER JOIN
-            (SELECT id, number, i1.start_date AS start_date, i2.expire_date AS expire_date, i1.vehicle_id,  damage_coverance, insurance_company_id, created_at, updated_at
-            FROM 
-            (SELECT id, number, start_date, expire_date, vehicle_id, damage_coverance, insurance_company_id, created_at, updated_at
-            FROM insurance ORDER BY id) AS i1
-           inner join (SELECT vehicle_id,MAX(expire_date) AS expire_date FROM insurance group by vehicle_id) AS i2
-			ON i1.expire_date = i2.expire_date AND i1.vehicle_id = i2.vehicle_id)
-       		AS i
-        ON v.id = i.vehicle_id) 
-		AS v1     
-    ON v1.id = r.vehicle_id 
-    WHERE r.user_id =  :id
-    ORDER BY v1.id DESC;
+SELECT v.id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at,
+        i.id AS insurance_id, i.number, i.start_date, i.expire_date, i.damage_coverance, i.insurance_company_id,
+        i.created_at AS insurance_create_at, i.updated_at AS insurance_updated_at, r.role, r.user_id
+    FROM current_roles cr
+    INNER JOIN roles r
+        ON r.id = cr.role_id
+    INNER JOIN vehicles v
+        ON v.id = cr.vehicle_id
+    INNER JOIN current_insurance ci
+        ON ci.vehicle_id = v.id
+    INNER JOIN insurance i
+        ON i.id = ci.insurance_id
+    WHERE cr.user_id =  :id AND (v.id, i.id) < (:cursor_id, :cursor_key)
+    ORDER BY v.id DESC, i.id DESC
+    LIMIT :limit;
 """
 
 GET_ALL_VEHICLES_QUERY = """
-SELECT v1.id, v1.sign, v1.type, v1.model, v1.manufacture_year, v1.created_at, v1.updated_at,
-        v1.insurance_id, v1.number, v1.start_date, v1.expire_date, v1.damage_coverance, v1.insurance_company_id,
-        v1.insurance_create_at, v1.insurance_updated_at, r.role, r.user_id
+SELECT v.id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at,
+        i.id AS insurance_id, i.number, i.start_date, i.expire_date, i.damage_coverance, i.insurance_company_id,
+        i.created_at AS insurance_create_at, i.updated_at AS insurance_updated_at, r.role, r.user_id, r.id AS role_id
     FROM roles r
-    inner JOIN 
-        (SELECT v.id AS id, v.sign AS sign, v.type AS type, v.model AS model,
-		 v.manufacture_year AS manufacture_year,v.created_at AS created_at, v.updated_at AS updated_at,
-        i.id AS insurance_id, i.number AS number, i.start_date AS start_date, i.expire_date AS expire_date, i.damage_coverance AS damage_coverance,
-		i.insurance_company_id AS insurance_company_id, i.created_at AS insurance_create_at,
-		i.updated_at AS insurance_updated_at
-        FROM vehicles v
-        INNER JOIN
-            (SELECT id, number, i1.start_date AS start_date, i2.expire_date AS expire_date, i1.vehicle_id,  damage_coverance, insurance_company_id, created_at, updated_at
-            FROM 
-            (SELECT id, number, start_date, expire_date, vehicle_id, damage_coverance, insurance_company_id, created_at, updated_at
-            FROM insurance ORDER BY id) AS i1
-           inner join (SELECT vehicle_id,MAX(expire_date) AS expire_date FROM insurance group by vehicle_id) AS i2
-			ON i1.expire_date = i2.expire_date AND i1.vehicle_id = i2.vehicle_id)
-       		AS i
-        ON v.id = i.vehicle_id) 
-		AS v1     
-    ON v1.id = r.vehicle_id 
-    ORDER BY v1.id DESC;
+    INNER JOIN vehicles v
+        ON v.id = r.vehicle_id
+    INNER JOIN current_insurance ci
+        ON ci.vehicle_id = v.id
+    INNER JOIN insurance i
+        ON i.id = ci.insurance_id
+    WHERE (v.id, r.id) < (:cursor_id, :cursor_key)
+    ORDER BY v.id DESC, r.id DESC
+    LIMIT :limit;
 
 """
 
 GET_VEHICLES_BY_INSURANCE_COMPANY_QUERY = """
+SELECT v.id AS id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at,
+        i.id AS insurance_id, i.number, i.start_date, i.expire_date, i.insurance_company_id, i.damage_coverance
+    FROM vehicles AS v 
+    INNER JOIN current_insurance ci
+        ON ci.vehicle_id = v.id
+    INNER JOIN insurance i
+        ON i.id = ci.insurance_id
+    INNER JOIN insurance_company ic
+        ON ic.id = i.insurance_company_id
+    WHERE ic.email = :insurance_company_email AND (v.id, i.id) < (:cursor_id, :cursor_key)
+    ORDER BY v.id DESC, i.id DESC
+    LIMIT :limit;
+
+"""
+
 
-SELECT v.id AS id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at, i1.insurance_id, i1.number, i1.start_date, i1.expire_date, i1.insurance_company_id, i1.damage_coverance
-FROM vehicles AS v 
-INNER JOIN 
-(SELECT i.vehicle_id,i.id AS insurance_id, i.number, i.start_date, i.expire_date, i.insurance_company_id, i.damage_coverance FROM
-(SELECT id, number, start_date, i2.expire_date, i1.vehicle_id, i1.damage_coverance, i1.insurance_company_id, i1.created_at, i1.updated_at
-FROM insurance AS i1
-inner join (SELECT vehicle_id,MAX(expire_date) AS expire_date FROM insurance group by vehicle_id) AS i2
-ON i1.expire_date = i2.expire_date AND i1.vehicle_id = i2.vehicle_id)
-AS i 
-inner join insurance_company as ic
-on i.insurance_company_id=ic.id
-where ic.email = :insurance_company_email) as i1
-on v.id = i1.vehicle_id
 
+# candidates come from the trigram indexes on the plate key and on every insurance number of the vehicle,
+# an exact substring ranks above a similar one
+SEARCH_VEHICLES_MATCHES = """
+    WITH matches AS (
+        SELECT v.id AS vehicle_id,
+            (strpos(v.plate_key, normalize_plate(:query)) > 0)::int + word_similarity(normalize_plate(:query), v.plate_key) AS rank
+        FROM vehicles v
+        WHERE v.plate_key LIKE '%' || normalize_plate(:query) || '%' OR normalize_plate(:query) <% v.plate_key
+        UNION ALL
+        SELECT i.vehicle_id,
+            (strpos(i.number, UPPER(:query)) > 0)::int + word_similarity(UPPER(:query), i.number)
+        FROM insurance i
+        WHERE i.number LIKE :number_pattern OR UPPER(:query) <% i.number
+    ), ranked AS (
+        SELECT vehicle_id, MAX(rank) AS rank
+        FROM matches
+        GROUP BY vehicle_id
+    )
+    SELECT v.id, v.sign, v.type, v.model, v.manufacture_year, v.created_at, v.updated_at,
+        i.id AS insurance_id, i.number, i.start_date, i.expire_date, i.insurance_company_id, ranked.rank
+    FROM ranked
+    INNER JOIN vehicles v
+        ON v.id = ranked.vehicle_id
+    INNER JOIN current_insurance ci
+        ON ci.vehicle_id = v.id
+    INNER JOIN insurance i
+        ON i.id = ci.insurance_id
 """
 
+SEARCH_VEHICLES_QUERY = SEARCH_VEHICLES_MATCHES + """
+    ORDER BY ranked.rank DESC, v.id DESC
+    LIMIT :limit;
+"""
+
+SEARCH_VEHICLES_BY_INSURANCE_COMPANY_QUERY = SEARCH_VEHICLES_MATCHES + """
+    INNER JOIN insurance_company ic
+        ON ic.id = i.insurance_company_id
+    WHERE ic.email = :insurance_company_email
+    ORDER BY ranked.rank DESC, v.id DESC
+    LIMIT :limit;
+"""
+
+SEARCH_VEHICLES_BY_USER_ID_QUERY = SEARCH_VEHICLES_MATCHES + """
+    INNER JOIN current_roles cr
+        ON cr.vehicle_id = v.id
+    WHERE cr.user_id = :user_id
+    ORDER BY ranked.rank DESC, v.id DESC
+    LIMIT :limit;
+"""
 
 
 class VehiclesRepository(BaseRepository):
@@ -129,53 +264,140 @@ class VehiclesRepository(BaseRepository):
 
     """
 
-    def __init__(self, db: Database) -> None:
-        super().__init__(db)
-        self.insurances_repo = InsuranceRepository(db) 
-        self.roles_repo = RolesRepository(db)
+    @property
+    def insurances_repo(self) -> InsuranceRepository:
+        return self.registry.get(InsuranceRepository)
 
-    async def get_vehicle_by_id(self, *, id: int, user_id:int, populate: bool = True):
-        vehicle_record = await self.db.fetch_one(query=GET_VEHICLE_BY_ID_QUERY, values={"id": id, "user_id":user_id})
-        if not vehicle_record:
+    @property
+    def roles_repo(self) -> RolesRepository:
+        return self.registry.get(RolesRepository)
+
+    async def fetch_vehicles_by_id_user_id_pairs(self, pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], VehiclesInDB]:
+        # same access rule as GET_VEHICLE_BY_ID_QUERY, resolved for many (vehicle_id, user_id) pairs at once
+        vehicle_records = await fetch_all_prepared(
+            self.db,
+            query=GET_VEHICLES_BY_IDS_USER_IDS_QUERY,
+            values={"ids": list({pair[0] for pair in pairs}), "user_ids": list({pair[1] for pair in pairs})})
+        return {(vehicle_record["id"], vehicle_record["user_id"]): VehiclesInDB(**vehicle_record) for vehicle_record in vehicle_records}
+
+    async def get_vehicle_by_id(self, *, id: int, user_id:int, populate: bool = True, expand: Expand = None):
+        vehicle = await self.loader.load("vehicles", (id, user_id), self.fetch_vehicles_by_id_user_id_pairs)
+        if not vehicle:
             return None
         else:
-            vehicle = VehiclesInDB(**vehicle_record)
             if populate:
-                return await self.populate_vehicle(vehicle = vehicle, user_id = user_id)
+                return await self.populate_vehicle(vehicle = vehicle, user_id = user_id, expand=expand)
         return vehicle
 
+    async def get_vehicles_by_id_user_id_pairs(self, *, pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], VehiclesInDB]:
+        return await self.loader.load_many("vehicles", pairs, self.fetch_vehicles_by_id_user_id_pairs)
+
+    @staticmethod
+    def get_page_values(*, limit: Optional[int], cursor: Optional[Tuple[int, int]]) -> dict:
+        cursor_id, cursor_key = cursor or (FIRST_PAGE_KEY, FIRST_PAGE_KEY)
+        return {"limit": limit, "cursor_id": cursor_id, "cursor_key": cursor_key}
 
-    async def get_all_vehicles_by_user_id(self,*, id: int) -> List:
-        vehicles_records = await self.db.fetch_all(query=GET_VEHICLES_BY_USER_ID_QUERY_WITH_NEWEST, values = {'id': id})
+    async def get_all_vehicles_by_user_id(self,*, id: int, limit: int = None, cursor: Tuple[int, int] = None) -> List:
+        # pages are ordered by (id, insurance_id) descending
+        values = self.get_page_values(limit=limit, cursor=cursor)
+        vehicles_records = await self.db.fetch_all(query=GET_VEHICLES_BY_USER_ID_QUERY_WITH_NEWEST, values = {**values, 'id': id})
         return vehicles_records
 
-    async def get_all_vehicles_by_insurance_company(self,*, insurance_company_email:EmailStr) -> List:
-        vehicles_records = await self.db.fetch_all(query=GET_VEHICLES_BY_INSURANCE_COMPANY_QUERY, values = {'insurance_company_email': insurance_company_email})
+    async def get_all_vehicles_by_insurance_company(self,*, insurance_company_email:EmailStr, limit: int = None, cursor: Tuple[int, int] = None) -> List:
+        # pages are ordered by (id, insurance_id) descending
+        values = self.get_page_values(limit=limit, cursor=cursor)
+        vehicles_records = await self.db.fetch_all(query=GET_VEHICLES_BY_INSURANCE_COMPANY_QUERY, values = {**values, 'insurance_company_email': insurance_company_email})
         return vehicles_records
 
-    async def get_all_vehicles(self, *, populate: bool = True) -> List:
-        vehicle_records = await self.db.fetch_all(query=GET_ALL_VEHICLES_QUERY)
+    async def get_all_vehicles(self, *, populate: bool = True, limit: int = None, cursor: Tuple[int, int] = None) -> List:
+        # pages are ordered by (id, role_id) descending
+        values = self.get_page_values(limit=limit, cursor=cursor)
+        vehicle_records = await self.db.fetch_all(query=GET_ALL_VEHICLES_QUERY, values=values)
         return vehicle_records
+
+    async def iterate_all_vehicles_by_insurance_company(self, *, insurance_company_email: EmailStr, cursor: Tuple[int, int] = None) -> AsyncIterator[Mapping]:
+        # read through a server side cursor, so the rows are never all held in memory
+        values = self.get_page_values(limit=None, cursor=cursor)
+        async for vehicle_record in self.db.iterate(query=GET_VEHICLES_BY_INSURANCE_COMPANY_QUERY, values={**values, 'insurance_company_email': insurance_company_email}):
+            yield vehicle_record
+
+    async def iterate_all_vehicles(self, *, cursor: Tuple[int, int] = None) -> AsyncIterator[Mapping]:
+        values = self.get_page_values(limit=None, cursor=cursor)
+        async for vehicle_record in self.db.iterate(query=GET_ALL_VEHICLES_QUERY, values=values):
+            yield vehicle_record
     
-    async def create_vehicle(self, *, new_vehicle: VehiclesCreate, id) -> VehiclesInDB:
-        query_values = new_vehicle.dict()
-        new_vehicle = await self.db.fetch_one(query=CREATE_VEHICLE_QUERY, values=query_values)
-        already_added = await self.get_vehicle_by_sign(sign = new_vehicle["sign"])
-        if already_added:
-            await self.roles_repo.create_role_of_user_for_vehicle(vehicle_id=new_vehicle["id"], user_id = id)
-            return await self.populate_vehicle(vehicle=VehiclesInDB(**new_vehicle), user_id=id)
-        else:
-            await self.insurances_repo.create_first_insurance_for_vehicle(vehicle_id=new_vehicle["id"])
-            await self.roles_repo.create_role_of_user_for_vehicle(vehicle_id=new_vehicle["id"], user_id = id)
-            return await self.populate_vehicle(vehicle=VehiclesInDB(**new_vehicle), user_id=id)
+    @staticmethod
+    def get_search_values(*, query: str, limit: int) -> dict:
+        # LIKE wildcards typed by the caller are matched literally
+        escaped = query.upper().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return {"query": query, "number_pattern": f"%{escaped}%", "limit": limit}
+
+    async def search_vehicles(self, *, query: str, limit: int) -> List[VehicleSearchResult]:
+        vehicle_records = await self.db.fetch_all(query=SEARCH_VEHICLES_QUERY, values=self.get_search_values(query=query, limit=limit))
+        return [VehicleSearchResult(**vehicle_record) for vehicle_record in vehicle_records]
+
+    async def search_vehicles_by_insurance_company(self, *, query: str, insurance_company_email: EmailStr, limit: int) -> List[VehicleSearchResult]:
+        vehicle_records = await self.db.fetch_all(query=SEARCH_VEHICLES_BY_INSURANCE_COMPANY_QUERY,
+            values={**self.get_search_values(query=query, limit=limit), "insurance_company_email": insurance_company_email})
+        return [VehicleSearchResult(**vehicle_record) for vehicle_record in vehicle_records]
 
-   
-    async def populate_vehicle(self, *, vehicle: VehiclesInDB, user_id: int) -> VehiclesInDB:
+    async def search_vehicles_by_user_id(self, *, query: str, user_id: int, limit: int) -> List[VehicleSearchResult]:
+        vehicle_records = await self.db.fetch_all(query=SEARCH_VEHICLES_BY_USER_ID_QUERY,
+            values={**self.get_search_values(query=query, limit=limit), "user_id": user_id})
+        return [VehicleSearchResult(**vehicle_record) for vehicle_record in vehicle_records]
+
+    async def create_vehicle(self, *, new_vehicle: VehiclesCreate, id) -> VehiclesPublic:
+        query_values = new_vehicle.dict()
+        record = await self.db.fetch_one(query=CREATE_VEHICLE_QUERY, values={**query_values, "user_id": id})
+        self.loader.clear("vehicles")
+        role = RoleInDB(id=record["role_id"], role=record["role"], user_id=record["user_id"], vehicle_id=record["id"],
+            created_at=record["role_created_at"], updated_at=record["role_updated_at"])
+        self.loader.prime("roles", role.id, role)
+        insurance = None
+        if record["insurance_id"] is not None:
+            insurance_company = None
+            if record["insurance_company_name"] is not None:
+                insurance_company = InsuranceCompanyInDB(id=record["insurance_company_id"],
+                    name=record["insurance_company_name"], email=record["insurance_company_email"])
+                self.loader.prime("insurance_company", insurance_company.id, insurance_company)
+            insurance = InsuranceInDB(id=record["insurance_id"], number=record["insurance_number"],
+                start_date=record["insurance_start_date"], expire_date=record["insurance_expire_date"],
+                damage_coverance=record["insurance_damage_coverance"], vehicle_id=record["id"],
+                insurance_company_id=record["insurance_company_id"],
+                created_at=record["insurance_created_at"], updated_at=record["insurance_updated_at"])
+            self.loader.prime("insurance", insurance.id, insurance)
+            insurance = InsurancePublic(**insurance.dict(), insurance_company=insurance_company)
         return VehiclesPublic(
-            **vehicle.dict(),
-            insurance=await self.insurances_repo.get_last_created_insurance_by_vehicle_id(vehicle_id=vehicle.id),
-            roles=await self.roles_repo.get_user_role_by_vehicle_user_id(vehicle_id=vehicle.id, user_id=user_id),
-        )
+            id=record["id"], sign=record["sign"], type=record["type"], model=record["model"],
+            manufacture_year=record["manufacture_year"], created_at=record["created_at"], updated_at=record["updated_at"],
+            insurance=insurance, roles=role)
+
+    async def import_vehicles(self, *, batches: AsyncIterator[List[Tuple[int, VehiclesCreate]]], user_id: int) -> List[Mapping]:
+        """
+        Registers every vehicle of an import for the user as owner, with a placeholder insurance when it has none.
+        The import is one transaction: the batches are loaded with COPY as they arrive and registered together.
+
+        """
+        async with self.db.transaction():
+            import_id = await self.db.fetch_val(query=NEXT_VEHICLE_IMPORT_ID_QUERY)
+            async for batch in batches:
+                await copy_records(self.db, table="vehicle_import", columns=VEHICLE_IMPORT_COLUMNS, records=[
+                    (import_id, row, vehicle.sign, vehicle.type.value, vehicle.model, vehicle.manufacture_year)
+                    for row, vehicle in batch
+                ])
+            results = await self.db.fetch_all(query=IMPORT_VEHICLES_QUERY, values={"import_id": import_id, "user_id": user_id})
+            await self.db.execute(query=DELETE_VEHICLE_IMPORT_QUERY, values={"import_id": import_id})
+        self.loader.clear("vehicles")
+        return results
+
+    async def populate_vehicle(self, *, vehicle: VehiclesInDB, user_id: int, expand: Expand = None) -> VehiclesInDB:
+        expand = expand or Expand()
+        related = {}
+        if "insurance" in expand:
+            related["insurance"] = await self.insurances_repo.get_last_created_insurance_by_vehicle_id(vehicle_id=vehicle.id)
+        if "roles" in expand:
+            related["roles"] = await self.roles_repo.get_user_role_by_vehicle_user_id(vehicle_id=vehicle.id, user_id=user_id)
+        return VehiclesPublic(**vehicle.dict(), **related)
 
     async def get_vehicle_by_sign(self, *, sign: str, populate: bool = False) -> VehiclesInDB:
         vehicle_record = await self.db.fetch_one(query=GET_VEHICLE_BY_SIGN_QUERY, values={"sign": sign})
@@ -186,20 +408,11 @@ class VehiclesRepository(BaseRepository):
             vehicle = VehiclesInDB(**vehicle_record)
         return vehicle
 
-    async def get_vehicle_by_user_id_digit(self, *, sign: str, user_id:int, populate: bool = True):
-        sign_digit =int(''.join(filter(str.isdigit, sign)))
-        print(sign_digit)
-        vehicle = ''
-        vehicle_records = await self.get_all_vehicles_by_user_id(id = user_id)
-        print(len(vehicle_records))
-        for vehicle_record in vehicle_records:
-            print(1)
-            check = int ( ''.join(filter(str.isdigit, vehicle_record['sign'])))
-            if check == sign_digit:
-                vehicle = VehiclesInDB(**vehicle_record)
-                if populate:
-                    return await self.populate_vehicle(vehicle = vehicle, user_id = user_id)
-        if vehicle == '':
+    async def get_vehicle_by_user_id_plate(self, *, sign: str, user_id: int, populate: bool = True) -> VehiclesInDB:
+        vehicle_record = await self.db.fetch_one(query=GET_VEHICLE_BY_USER_ID_PLATE_QUERY, values={"sign": sign, "user_id": user_id})
+        if not vehicle_record:
             return None
-        else:
-            return vehicle
+        vehicle = VehiclesInDB(**vehicle_record)
+        if populate:
+            return await self.populate_vehicle(vehicle=vehicle, user_id=user_id)
+        return vehicle
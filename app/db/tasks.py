@@ -1,7 +1,9 @@
 import os  
 from fastapi import FastAPI
 from databases import Database
-from app.core.config import DATABASE_URL
+from app.core.config import DATABASE_URL, INSURANCE_COMPANY_CACHE_TTL
+from app.core.cache import InsuranceCompanyCache
+from app.db.repositories.insurance_company import InsuranceCompanyRepository
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,6 +18,16 @@ async def connect_to_db(app: FastAPI) -> None:
         logger.warn("--- DB CONNECTION ERROR ---")
         logger.warn(e)
         logger.warn("--- DB CONNECTION ERROR ---")
+
+async def load_insurance_company_cache(app: FastAPI) -> None:
+    app.state._insurance_company_cache = InsuranceCompanyCache(ttl=INSURANCE_COMPANY_CACHE_TTL)
+    try:
+        await InsuranceCompanyRepository(app.state._db).load_insurance_company_cache(app.state._insurance_company_cache)
+    except Exception as e:
+        # left empty, the first request that needs it loads it
+        logger.warn("--- INSURANCE COMPANY CACHE ERROR ---")
+        logger.warn(e)
+        logger.warn("--- INSURANCE COMPANY CACHE ERROR ---")
         
 async def close_db_connection(app: FastAPI) -> None:
     try:
@@ -4,16 +4,35 @@ import json
 from pydantic import BaseModel, validator
 from app.models.core import DateTimeModelMixin,IDModelMixin
 
+class ImageSize(str, Enum):
+    # resized copies served instead of the uploaded image, see app.core.derivatives
+    thumb = "thumb"
+    medium = "medium"
+
 class AccidentImage(BaseModel):
-    image: Optional[bytes] 
+    # images uploaded before the image store only have `image`, the others only the digest of the stored bytes
+    image: Optional[bytes]
+    digest: Optional[str]
+    size: Optional[int]
+    content_type: Optional[str]
+
+class AccidentImageFile(BaseModel):
+    # what is needed to serve an image from the image store, rows still in the table have to be moved first
+    id: int
+    digest: Optional[str]
+    size: Optional[int]
+    content_type: Optional[str]
+    in_store: bool
 
-class Accident_Image_Create(AccidentImage):
+class Accident_Image_Create(BaseModel):
     statement_id:int
-    image: Optional[bytes] 
+    digest: str
+    size: int
+    content_type: str
 
 class Accident_Image_InDB(IDModelMixin, DateTimeModelMixin, AccidentImage):
     statement_id:int
-    image: Optional[bytes] 
-    
+    image: Optional[bytes]
+
 class Accident_Image_Public(Accident_Image_InDB):
     pass
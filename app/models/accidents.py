@@ -35,3 +35,8 @@ class AccidentPublic(AccidentModel, IDModelMixin, DateTimeModelMixin):
     temporary_accident_drivers: Optional[List[Temporary_Data_Public]]
 
 
+class AccidentFilter(BaseModel):
+    date_from: Optional[datetime]
+    date_to: Optional[datetime]
+    closed_case: Optional[bool]
+    city: Optional[str]
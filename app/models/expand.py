@@ -0,0 +1,54 @@
+from typing import FrozenSet, Iterable, Optional
+
+
+ACCIDENT_EXPANSIONS = (
+    "statements",
+    "statements.vehicle",
+    "statements.user",
+    "statements.role",
+    "statements.insurance",
+    "statements.sketch",
+    "statements.images",
+    "temporary_drivers",
+)
+
+VEHICLE_EXPANSIONS = (
+    "insurance",
+    "roles",
+)
+
+
+class Expand:
+    """
+    Related subtrees requested with the `expand` query parameter, as dotted paths.
+    Without paths every relation is expanded, which is how the responses were built before.
+
+    """
+    def __init__(self, paths: Optional[Iterable[str]] = None) -> None:
+        self.paths: Optional[FrozenSet[str]] = None if paths is None else frozenset(paths)
+
+    @classmethod
+    def parse(cls, value: Optional[str], allowed: Iterable[str]) -> "Expand":
+        if value is None:
+            return cls()
+        paths = {path.strip() for path in value.split(",") if path.strip()}
+        unknown = paths.difference(allowed)
+        if unknown:
+            raise ValueError(f"Unknown expand paths: {', '.join(sorted(unknown))}")
+        return cls(paths)
+
+    @property
+    def is_full(self) -> bool:
+        return self.paths is None
+
+    def __contains__(self, relation: str) -> bool:
+        if self.paths is None:
+            return True
+        # a nested path implies its parents, statements.vehicle needs the statements
+        return any(path == relation or path.startswith(relation + ".") for path in self.paths)
+
+    def child(self, relation: str) -> "Expand":
+        if self.paths is None:
+            return self
+        prefix = relation + "."
+        return Expand(path[len(prefix):] for path in self.paths if path.startswith(prefix))
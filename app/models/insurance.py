@@ -1,5 +1,5 @@
-from typing import Optional
-from pydantic import BaseModel, Field
+from typing import List, Optional
+from pydantic import BaseModel, Field, constr
 from datetime import datetime, date, timedelta
 from app.models.core import DateTimeModelMixin, IDModelMixin
 from app.models.insurance_company import InsuranceCompanyPublic
@@ -33,3 +33,19 @@ class InsuranceInDB(IDModelMixin, DateTimeModelMixin, InsuranceModel):
 class InsurancePublic(InsuranceInDB):
     insurance_company: Optional[InsuranceCompanyPublic]
     pass
+
+
+class InsuranceImport(BaseModel):
+    plate: constr(min_length=3)
+    number: constr(min_length=1)
+    start_date: date
+    expire_date: date
+    damage_coverance: bool = False
+
+
+class InsuranceImportResult(BaseModel):
+    row: int
+    accepted: bool
+    vehicle_id: Optional[int]
+    insurance_id: Optional[int]
+    errors: Optional[List[str]]
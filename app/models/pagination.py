@@ -0,0 +1,23 @@
+import base64
+import binascii
+from typing import Optional, Tuple
+from pydantic import BaseModel
+
+# keyset sentinel for the first page of lists ordered by descending ids
+FIRST_PAGE_KEY = 2147483647
+
+
+class PageParams(BaseModel):
+    limit: int
+    cursor: Optional[Tuple[int, ...]]
+
+
+def encode_cursor(*keys: int) -> str:
+    return base64.urlsafe_b64encode(",".join(str(key) for key in keys).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[int, ...]:
+    try:
+        return tuple(int(key) for key in base64.urlsafe_b64decode(cursor.encode()).decode().split(","))
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
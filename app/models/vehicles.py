@@ -41,3 +41,34 @@ class VehiclesPublic(VehiclesModel, IDModelMixin, DateTimeModelMixin):
     insurance: Optional[InsurancePublic]
     roles: Optional[RolePublic]
 
+
+class VehicleSearchResult(VehiclesInDB):
+    insurance_id: int
+    number: Optional[str]
+    start_date: Optional[datetime.date]
+    expire_date: Optional[datetime.date]
+    insurance_company_id: int
+    rank: float
+
+
+class VehicleImportStatus(str, Enum):
+    created = "created"
+    updated = "updated"
+    duplicate = "duplicate"
+    invalid = "invalid"
+
+
+class VehicleImportRow(BaseModel):
+    row: int
+    status: VehicleImportStatus
+    id: Optional[int]
+    sign: Optional[str]
+    errors: Optional[List[str]]
+
+
+class VehicleImportReport(BaseModel):
+    created: int = 0
+    updated: int = 0
+    duplicate: int = 0
+    invalid: int = 0
+    rows: List[VehicleImportRow] = []
@@ -0,0 +1,103 @@
+"""
+Per query latency and CPU of the hot repository queries, through `databases` and through
+the prepared statement fast path of app.db.prepared, on the same connection:
+
+    python benchmarks/query_plans.py --seed --update      # once, on a freshly migrated database
+    python benchmarks/bench_prepared_queries.py --iterations 2000
+
+The database is DATABASE_URL from app.core.config, or --database-url.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from databases import Database  # noqa: E402
+from app.db.plans import discover_queries, get_query_params, get_sample_values  # noqa: E402
+from app.db.prepared import fetch_all_prepared, fetch_one_prepared  # noqa: E402
+
+HOT_QUERIES = [
+    ("vehicles.GET_VEHICLES_BY_IDS_USER_IDS_QUERY", "all"),
+    ("insurance.GET_INSURANCES_BY_IDS_QUERY", "all"),
+    ("insurance.GET_LAST_CREATED_INSURANCE_BY_VEHICLE_ID_QUERY", "one"),
+    ("insurance_company.GET_INSURANCE_COMPANIES_BY_IDS_QUERY", "all"),
+    ("roles.GET_USER_ROLES_BY_IDS_QUERY", "all"),
+    ("roles.GET_LAST_USER_ROLE_BY_VEHICLE_USER_ID_QUERY", "one"),
+    ("accident.GET_ACCIDENT_BY_ID_QUERY", "one"),
+    ("accident_statement.GET_ACCIDENT_STATEMENT_BY_ACCIDENT_ID_USER_ID_QUERY", "one"),
+    ("accident_statement.GET_ACCIDENT_STATEMENTS_BY_ACCIDENT_IDS_QUERY", "all"),
+    ("accident_statement.GET_ACCIDENT_STATEMENTS_BY_IDS_QUERY", "all"),
+    ("accident_sketch.GET_SKETCHES_BY_STATEMENT_IDS_QUERY", "all"),
+    ("accident_image.GET_ACCIDENT_IMAGES_BY_STATEMENT_IDS_QUERY", "all"),
+]
+
+
+async def run(call, iterations: int) -> dict:
+    for _ in range(min(iterations, 50)):
+        await call()
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpu_start
+    latencies.sort()
+    return {
+        "p50_us": statistics.median(latencies) * 1e6,
+        "p95_us": latencies[int(len(latencies) * 0.95)] * 1e6,
+        "cpu_us": cpu / iterations * 1e6,
+    }
+
+
+async def bench(database_url: str, iterations: int) -> None:
+    db = Database(database_url, min_size=1, max_size=1)
+    await db.connect()
+    try:
+        queries = discover_queries()
+        sample = await get_sample_values(db)
+        print(f"{'query':<70} {'path':<9} {'p50 us':>8} {'p95 us':>8} {'cpu us':>8}")
+        totals = {"databases": 0.0, "prepared": 0.0}
+        async with db.connection():
+            for name, kind in HOT_QUERIES:
+                query = queries[name]
+                values = {param: sample[param] for param in get_query_params(query)}
+                paths = {
+                    "databases": db.fetch_one if kind == "one" else db.fetch_all,
+                    "prepared": fetch_one_prepared if kind == "one" else fetch_all_prepared,
+                }
+                for path, fetch in paths.items():
+                    if path == "databases":
+                        call = lambda: fetch(query=query, values=values)
+                    else:
+                        call = lambda: fetch(db, query=query, values=values)
+                    result = await run(call, iterations)
+                    totals[path] += result["cpu_us"]
+                    print(f"{name:<70} {path:<9} {result['p50_us']:>8.1f} {result['p95_us']:>8.1f} {result['cpu_us']:>8.1f}")
+        saved = 1 - totals["prepared"] / totals["databases"]
+        print(f"\nclient CPU per query, mean: databases {totals['databases'] / len(HOT_QUERIES):.1f}us, "
+              f"prepared {totals['prepared'] / len(HOT_QUERIES):.1f}us ({saved:.0%} less)")
+    finally:
+        await db.disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        from app.core.config import DATABASE_URL
+        database_url = str(DATABASE_URL)
+
+    asyncio.run(bench(database_url, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Per route cost of building the repositories a request depends on.
+
+For every route it resolves the `get_repository(...)` dependencies the way one request does,
+and reports how many repository objects were built and the time it took.
+Run it on two commits to compare, no database is needed:
+
+    python benchmarks/bench_repository_graph.py --iterations 20000
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB"):
+    os.environ.setdefault(name, "bench")
+
+from fastapi.routing import APIRoute  # noqa: E402
+from app.api.server import app  # noqa: E402
+from app.db.repositories import base  # noqa: E402
+
+built = Counter()
+base_init = base.BaseRepository.__init__
+
+
+def counting_init(self, *args, **kwargs):
+    built[type(self).__name__] += 1
+    base_init(self, *args, **kwargs)
+
+
+base.BaseRepository.__init__ = counting_init
+
+
+def route_repositories(dependant) -> list:
+    repositories = []
+    for dependency in dependant.dependencies:
+        call = dependency.call
+        if getattr(call, "__name__", "") == "get_repo" and call.__closure__:
+            repositories.append(call.__closure__[0].cell_contents)
+        repositories.extend(route_repositories(dependency))
+    return repositories
+
+
+def build_for_request(repositories: list) -> None:
+    registry_type = getattr(base, "RepositoryRegistry", None)
+    if registry_type:
+        registry = registry_type(None)
+        for Repo_type in repositories:
+            registry.get(Repo_type)
+    else:
+        for Repo_type in repositories:
+            Repo_type(None)
+
+
+def main(iterations: int) -> None:
+    print(f"{'route':<60} {'objects':>8} {'us/request':>11}")
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        repositories = route_repositories(route.dependant)
+        if not repositories:
+            continue
+        built.clear()
+        build_for_request(repositories)
+        objects = sum(built.values())
+        start = time.perf_counter()
+        for _ in range(iterations):
+            build_for_request(repositories)
+        elapsed = (time.perf_counter() - start) / iterations
+        print(f"{route.name:<60} {objects:>8} {elapsed * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    main(parser.parse_args().iterations)
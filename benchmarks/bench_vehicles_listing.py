@@ -0,0 +1,53 @@
+"""
+Requests/sec for GET /api/vehicles/ against a running server.
+
+Run it once against the old build and once against the new one with the same token and concurrency:
+
+    python benchmarks/bench_vehicles_listing.py --url http://localhost:8001 --token <bearer> --concurrency 50 --duration 20
+"""
+import argparse
+import asyncio
+import time
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, path: str, deadline: float, latencies: list, errors: list) -> None:
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            res = await client.get(path)
+            if res.status_code != 200:
+                errors.append(res.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(url: str, token: str, concurrency: int, duration: float, path: str) -> None:
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {token}", "accept": "application/json"}
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=30.0) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[worker(client, path, deadline, latencies, errors) for _ in range(concurrency)])
+
+    latencies.sort()
+    done = len(latencies)
+    print(f"GET {path}  concurrency={concurrency}  duration={duration}s")
+    print(f"requests: {done}  errors: {len(errors)}")
+    print(f"requests/sec: {done / duration:.1f}")
+    if done:
+        print(f"p50: {latencies[done // 2] * 1000:.1f} ms  p99: {latencies[int(done * 0.99) - 1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--path", default="/api/vehicles/")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.token, args.concurrency, args.duration, args.path))
@@ -0,0 +1,146 @@
+"""
+Plan and latency regression check for every SQL constant in app/db/repositories.
+
+Every `*_QUERY` constant is run with EXPLAIN (ANALYZE, BUFFERS) against a seeded database,
+with parameters bound from the seeded rows. Writes roll back. The planner cost, row counts,
+buffers and the median timing of every query are compared with a JSON baseline:
+
+    alembic upgrade head
+    python benchmarks/query_plans.py --seed --update     # record the baseline
+    python benchmarks/query_plans.py                     # report the diff, exit 1 on a regression
+    python benchmarks/query_plans.py --update --only vehicles.SEARCH_VEHICLES_QUERY   # record one query
+
+The database is DATABASE_URL from app.core.config, or --database-url.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from databases import Database  # noqa: E402
+from app.db.plans import (  # noqa: E402
+    LARGE_TABLES,
+    discover_queries,
+    explain,
+    get_sample_values,
+    get_seq_scans,
+    seed_plan_dataset,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plans_baseline.json")
+
+
+async def measure(db: Database, query: str, values: dict, runs: int) -> dict:
+    plans = [await explain(db, query, values, analyze=True) for _ in range(runs)]
+    plans.sort(key=lambda plan: plan["Execution Time"])
+    plan = plans[len(plans) // 2]
+    return {
+        "cost": plan["Plan"]["Total Cost"],
+        "plan_rows": plan["Plan"]["Plan Rows"],
+        "actual_rows": plan["Plan"]["Actual Rows"],
+        "shared_hit_blocks": plan["Plan"].get("Shared Hit Blocks", 0),
+        "shared_read_blocks": plan["Plan"].get("Shared Read Blocks", 0),
+        "planning_ms": round(statistics.median(p["Planning Time"] for p in plans), 3),
+        "execution_ms": round(plan["Execution Time"], 3),
+        "seq_scans": sorted(set(get_seq_scans(plan, LARGE_TABLES))),
+    }
+
+
+async def collect(database_url: str, seed: bool, runs: int, only: list = None) -> dict:
+    db = Database(database_url)
+    await db.connect()
+    try:
+        if seed:
+            await seed_plan_dataset(db)
+        values = await get_sample_values(db)
+        results = {}
+        for name, query in sorted(discover_queries().items()):
+            if only and name not in only:
+                continue
+            try:
+                results[name] = await measure(db, query, values, runs)
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+        return results
+    finally:
+        await db.disconnect()
+
+
+def compare(baseline: dict, results: dict, *, cost_ratio: float, time_ratio: float, min_time_ms: float) -> list:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            # a query without a baseline is never checked, so it fails until it is recorded
+            print(f"{name:<75} not in the baseline")
+            regressions.append(f"{name}: not in the baseline, record it with --update --only {name}")
+            continue
+        if "error" in result:
+            regressions.append(f"{name}: {result['error']}")
+            continue
+        if "error" in before:
+            continue
+        problems = []
+        if result["cost"] > before["cost"] * cost_ratio:
+            problems.append(f"cost {before['cost']} -> {result['cost']}")
+        if result["execution_ms"] > max(before["execution_ms"] * time_ratio, before["execution_ms"] + min_time_ms):
+            problems.append(f"time {before['execution_ms']}ms -> {result['execution_ms']}ms")
+        new_scans = set(result["seq_scans"]) - set(before["seq_scans"])
+        if new_scans:
+            problems.append(f"seq scan on {', '.join(sorted(new_scans))}")
+        status = "; ".join(problems) or "ok"
+        print(f"{name:<75} {status}")
+        regressions.extend(f"{name}: {problem}" for problem in problems)
+    for name in baseline.keys() - results.keys():
+        print(f"{name:<75} removed")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--seed", action="store_true", help="seed the plan dataset first, on a freshly migrated database")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--only", nargs="+", default=None, metavar="QUERY",
+        help="only run these queries, with --update the other baseline entries are kept")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cost-ratio", type=float, default=1.2)
+    parser.add_argument("--time-ratio", type=float, default=2.0)
+    parser.add_argument("--min-time-ms", type=float, default=1.0, help="ignore timing changes smaller than this")
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        from app.core.config import DATABASE_URL
+        database_url = str(DATABASE_URL)
+
+    results = asyncio.run(collect(database_url, args.seed, args.runs, args.only))
+    if args.update:
+        if args.only:
+            with open(args.baseline) as f:
+                results = {**json.load(f), **results}
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"wrote {len(results)} queries to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.only:
+        baseline = {name: plan for name, plan in baseline.items() if name in args.only}
+    regressions = compare(baseline, results, cost_ratio=args.cost_ratio, time_ratio=args.time_ratio, min_time_ms=args.min_time_ms)
+    if regressions:
+        print(f"\n{len(regressions)} regressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
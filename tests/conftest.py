@@ -15,6 +15,9 @@ from app.models.insurance import InsuranceAdd, InsuranceInDB
 from app.db.repositories.insurance import InsuranceRepository
 from app.models.insurance_company import InsuranceCompanyCreate, InsuranceCompanyInDB
 from app.db.repositories.insurance_company import InsuranceCompanyRepository
+from app.db.repositories.base import RepositoryRegistry
+from app.api.dependencies.auth import get_current_active_user
+from app.models.users import UserPublic
 
 # Apply migrations at beginning and end of testing session
 @pytest.fixture(scope="session")
@@ -48,6 +51,16 @@ async def client(app: FastAPI) -> AsyncClient:
         ) as client:
             yield client
 
+# Sign requests in as a user without the users service, login(id=..., email=...) may be called again to switch users
+@pytest.fixture
+def login(app: FastAPI):
+    def login_as(**fields) -> UserPublic:
+        user = UserPublic(**fields)
+        app.dependency_overrides[get_current_active_user] = lambda: user
+        return user
+    yield login_as
+    app.dependency_overrides.pop(get_current_active_user, None)
+
 @pytest.fixture
 async def test_vehicle(db: Database) -> VehiclesInDB:
     vehicle_repo = VehiclesRepository(db)
@@ -64,8 +77,10 @@ async def test_vehicle(db: Database) -> VehiclesInDB:
 
 
 @pytest.fixture
-async def test_insurance_company(db: Database) -> InsuranceCompanyInDB:
-    insurance_company_repo = InsuranceCompanyRepository(db)
+async def test_insurance_company(app: FastAPI, db: Database) -> InsuranceCompanyInDB:
+    # through the app's company cache, as a request would, so the listing sees the new company
+    registry = RepositoryRegistry(db, insurance_company_cache=app.state._insurance_company_cache)
+    insurance_company_repo = registry.get(InsuranceCompanyRepository)
     new_insurance_company = InsuranceCompanyCreate(
         name="herewego",
         email="hereyoutest@herewego.gr",
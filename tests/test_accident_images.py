@@ -0,0 +1,424 @@
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from PIL import Image
+
+from httpx import AsyncClient
+from fastapi import FastAPI
+from databases import Database
+
+from starlette.status import (
+    HTTP_200_OK,
+    HTTP_206_PARTIAL_CONTENT,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+    HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+)
+from app.api.dependencies.storage import parse_range
+from app.core.config import IMAGE_MAX_PER_STATEMENT, IMAGE_MAX_SIZE
+from app.core.derivatives import DerivativeCache
+from app.core.storage import LocalImageStore, sniff_image_type
+from app.db.repositories.vehicles import VehiclesRepository
+from app.models.vehicles import VehiclesCreate
+from app.models.users import UserPublic
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+DRIVER_ID = 9201
+BOUNDARY = "imageboundary"
+JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x01" * 100
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR" + b"\x02" * 100
+
+
+def encode_multipart(*parts) -> bytes:
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def driver(login) -> UserPublic:
+    return login(id=DRIVER_ID, email="driver@images.com", username="driver")
+
+
+@pytest.fixture
+def image_store(app: FastAPI, client: AsyncClient, tmp_path) -> LocalImageStore:
+    app.state._image_store = LocalImageStore(str(tmp_path / "images"))
+    return app.state._image_store
+
+
+@pytest.fixture
+def derivatives(app: FastAPI, client: AsyncClient, tmp_path) -> DerivativeCache:
+    # renders in a thread, the worker processes of the app are not needed to check the cache
+    app.state._derivatives = DerivativeCache(str(tmp_path / "derivatives"), max_bytes=1024 * 1024,
+        create_executor=lambda: ThreadPoolExecutor(max_workers=1))
+    yield app.state._derivatives
+    app.state._derivatives.close()
+
+
+def encode_jpeg(width: int, height: int) -> bytes:
+    image = Image.new("RGB", (width, height), (200, 40, 40))
+    content = io.BytesIO()
+    image.save(content, "JPEG")
+    return content.getvalue()
+
+
+@pytest.fixture
+async def accident_id(db: Database, driver: UserPublic) -> int:
+    vehicles_repo = VehiclesRepository(db)
+    vehicle = await vehicles_repo.get_vehicle_by_sign(sign="IMG-1001")
+    if not vehicle:
+        vehicle = await vehicles_repo.create_vehicle(
+            new_vehicle=VehiclesCreate(sign="IMG-1001", type="car", model="Yaris", manufacture_year=2020), id=driver.id)
+    accident_id = await db.fetch_val(
+        query="INSERT INTO accident (date, city, address) VALUES (NOW(), 'IMAGE CITY', 'IMAGE ADDRESS') RETURNING id")
+    await db.execute(
+        query="""
+            INSERT INTO accident_statement (user_id, accident_id, vehicle_id, insurance_id, role_id)
+            SELECT cr.user_id, :accident_id, cr.vehicle_id, ci.insurance_id, cr.role_id
+            FROM current_roles cr INNER JOIN current_insurance ci ON ci.vehicle_id = cr.vehicle_id
+            WHERE cr.vehicle_id = :vehicle_id AND cr.user_id = :user_id
+        """,
+        values={"user_id": driver.id, "accident_id": accident_id, "vehicle_id": vehicle.id})
+    return accident_id
+
+
+async def upload(app: FastAPI, client: AsyncClient, *parts, headers: dict = None,
+    route: str = "accident:add-accident-image") -> dict:
+    return await client.post(app.url_path_for(route), content=encode_multipart(*parts),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}", **(headers or {})})
+
+
+class TestSniffImageType:
+    @pytest.mark.parametrize(
+        "head, content_type",
+        (
+                (JPEG, "image/jpeg"),
+                (PNG, "image/png"),
+                (b"GIF89a\x01\x00\x01\x00\x00\x00", "image/gif"),
+                (b"RIFF\x00\x00\x00\x00WEBP", "image/webp"),
+                (b"\x00\x00\x00\x18ftypheic", "image/heic"),
+                (b"%PDF-1.7\n%\xe2\xe3\xcf\xd3", None),
+                (b"", None),
+        ),
+    )
+    async def test_image_types_are_sniffed(self, head: bytes, content_type: str) -> None:
+        assert sniff_image_type(head[:12]) == content_type
+
+
+class TestUploadAccidentImage:
+    async def test_image_is_streamed_to_the_store(self, app: FastAPI, client: AsyncClient, db: Database,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        res = await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.png", PNG))
+        assert res.status_code == HTTP_200_OK
+        image = res.json()
+        digest = hashlib.sha256(PNG).hexdigest()
+        assert (image["digest"], image["size"], image["content_type"]) == (digest, len(PNG), "image/png")
+        assert await image_store.exists(digest)
+        res = await client.get(app.url_path_for("accident:get-accident-image", id=image["id"]))
+        assert res.status_code == HTTP_200_OK
+        assert res.headers["content-type"] == "image/png"
+        assert res.content == PNG
+
+    async def test_image_may_come_before_the_accident_id(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        res = await upload(app, client, ("image", "crash.jpg", JPEG), ("accident_id", None, str(accident_id).encode()))
+        assert res.status_code == HTTP_200_OK
+        assert res.json()["content_type"] == "image/jpeg"
+
+    async def test_rejected_uploads_are_not_kept(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        res = await upload(app, client, ("image", "crash.jpg", JPEG), ("accident_id", None, b"999999"))
+        assert res.status_code == HTTP_400_BAD_REQUEST
+        res = await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "notes.pdf", b"%PDF-1.7\n" * 10))
+        assert res.status_code == HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        assert os.listdir(image_store.root) == ["tmp"]
+        assert os.listdir(os.path.join(image_store.root, "tmp")) == []
+
+    async def test_oversize_uploads_are_rejected_before_reading(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        res = await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.jpg", JPEG),
+            headers={"Content-Length": str(IMAGE_MAX_SIZE * 2)})
+        assert res.status_code == HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+    async def test_missing_image_is_rejected(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        res = await upload(app, client, ("accident_id", None, str(accident_id).encode()))
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.parametrize(
+        "parts",
+        (
+                [("image", "crash.jpg", JPEG)],
+                [("accident_id", None, b"one"), ("image", "crash.jpg", JPEG)],
+        ),
+    )
+    async def test_missing_or_invalid_accident_id_is_rejected(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, driver: UserPublic, parts: list) -> None:
+        res = await upload(app, client, *parts)
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+    async def test_statement_image_quota(self, app: FastAPI, client: AsyncClient, db: Database,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        for _ in range(IMAGE_MAX_PER_STATEMENT):
+            res = await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.jpg", JPEG))
+            assert res.status_code == HTTP_200_OK
+        res = await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.jpg", JPEG))
+        assert res.status_code == HTTP_400_BAD_REQUEST
+
+
+class TestUploadAccidentImages:
+    async def upload(self, app: FastAPI, client: AsyncClient, *parts):
+        return await upload(app, client, *parts, route="accident:add-accident-images")
+
+    async def test_images_are_stored_and_returned_in_order(self, app: FastAPI, client: AsyncClient, db: Database,
+        image_store: LocalImageStore, derivatives: DerivativeCache, accident_id: int) -> None:
+        photo = encode_jpeg(800, 600)
+        res = await self.upload(app, client, ("images", "1.png", PNG), ("accident_id", None, str(accident_id).encode()),
+            ("images", "2.jpg", photo), ("images", "3.png", PNG))
+        assert res.status_code == HTTP_200_OK
+        images = res.json()
+        digests = [hashlib.sha256(content).hexdigest() for content in (PNG, photo, PNG)]
+        assert [image["digest"] for image in images] == digests
+        assert [image["content_type"] for image in images] == ["image/png", "image/jpeg", "image/png"]
+        assert [image["id"] for image in images] == sorted(image["id"] for image in images)
+        assert all([await image_store.exists(digest) for digest in digests])
+        assert os.path.exists(derivatives.get_path(digests[1], "thumb"))
+
+        assert await db.fetch_val(query="SELECT COUNT(*) FROM accident_statement_image WHERE id = ANY(:ids)",
+            values={"ids": [image["id"] for image in images]}) == 3
+        res = await client.get(app.url_path_for("accident:get-accident-image", id=images[1]["id"]))
+        assert res.content == photo
+
+    async def test_a_rejected_image_rejects_the_batch(self, app: FastAPI, client: AsyncClient, db: Database,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        res = await self.upload(app, client, ("accident_id", None, str(accident_id).encode()),
+            ("images", "1.png", PNG), ("images", "notes.pdf", b"%PDF-1.7\n" * 10))
+        assert res.status_code == HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        assert await db.fetch_val(query="""
+            SELECT COUNT(*) FROM accident_statement_image img INNER JOIN accident_statement stmt ON stmt.id = img.statement_id
+            WHERE stmt.accident_id = :accident_id
+        """, values={"accident_id": accident_id}) == 0
+        assert os.listdir(os.path.join(image_store.root, "tmp")) == []
+
+    async def test_missing_images_are_rejected(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        res = await self.upload(app, client, ("accident_id", None, str(accident_id).encode()))
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+        res = await self.upload(app, client, ("images", "1.png", PNG))
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+    async def test_batches_over_the_statement_quota_are_rejected(self, app: FastAPI, client: AsyncClient, db: Database,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        for _ in range(IMAGE_MAX_PER_STATEMENT - 1):
+            assert (await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.png", PNG))).status_code == HTTP_200_OK
+        over_quota = JPEG + b"\x03"
+        # the image past the free slot is rejected before it is written to the store
+        res = await self.upload(app, client, ("accident_id", None, str(accident_id).encode()),
+            ("images", "1.jpg", JPEG), ("images", "2.jpg", over_quota))
+        assert res.status_code == HTTP_400_BAD_REQUEST
+        # images sent before the accident_id are checked against the free slots when it arrives, before any is stored
+        res = await self.upload(app, client, ("images", "1.jpg", over_quota), ("images", "2.jpg", over_quota + b"\x03"),
+            ("accident_id", None, str(accident_id).encode()))
+        assert res.status_code == HTTP_400_BAD_REQUEST
+        for content in (over_quota, over_quota + b"\x03"):
+            assert not await image_store.exists(hashlib.sha256(content).hexdigest())
+        assert os.listdir(os.path.join(image_store.root, "tmp")) == []
+        res = await self.upload(app, client, ("accident_id", None, str(accident_id).encode()), ("images", "1.jpg", JPEG))
+        assert res.status_code == HTTP_200_OK
+
+
+class TestParseRange:
+    @pytest.mark.parametrize(
+        "header, byte_range",
+        (
+                ("bytes=0-9", (0, 10)),
+                ("bytes=90-", (90, 10)),
+                ("bytes=95-200", (95, 5)),
+                ("bytes=-30", (70, 30)),
+                ("bytes=-300", (0, 100)),
+                ("bytes=0-1,5-6", None),
+                ("bytes=9-3", None),
+                ("items=0-9", None),
+                ("bytes=a-b", None),
+        ),
+    )
+    async def test_single_byte_ranges_are_parsed(self, header: str, byte_range: tuple) -> None:
+        assert parse_range(header, 100) == byte_range
+
+    @pytest.mark.parametrize("header", ("bytes=100-", "bytes=150-160", "bytes=-0"))
+    async def test_unsatisfiable_ranges_raise(self, header: str) -> None:
+        with pytest.raises(ValueError):
+            parse_range(header, 100)
+
+
+class TestDownloadAccidentImage:
+    async def get(self, app: FastAPI, client: AsyncClient, id: int, **headers):
+        return await client.get(app.url_path_for("accident:get-accident-image", id=id), headers=headers)
+
+    async def test_images_carry_length_etag_and_cache_headers(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        image = (await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.png", PNG))).json()
+        res = await self.get(app, client, image["id"])
+        assert res.status_code == HTTP_200_OK
+        assert res.content == PNG
+        assert res.headers["content-length"] == str(len(PNG))
+        assert res.headers["etag"] == f'"{hashlib.sha256(PNG).hexdigest()}"'
+        assert res.headers["accept-ranges"] == "bytes"
+        assert "immutable" in res.headers["cache-control"]
+
+        res = await self.get(app, client, image["id"], **{"If-None-Match": f'W/"other", {res.headers["etag"]}'})
+        assert res.status_code == HTTP_304_NOT_MODIFIED
+        assert res.content == b""
+
+    async def test_ranges_are_served_from_the_store(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, accident_id: int) -> None:
+        image = (await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.jpg", JPEG))).json()
+        res = await self.get(app, client, image["id"], Range="bytes=10-19")
+        assert res.status_code == HTTP_206_PARTIAL_CONTENT
+        assert res.content == JPEG[10:20]
+        assert res.headers["content-range"] == f"bytes 10-19/{len(JPEG)}"
+        assert res.headers["content-length"] == "10"
+
+        res = await self.get(app, client, image["id"], Range="bytes=-5")
+        assert res.content == JPEG[-5:]
+        res = await self.get(app, client, image["id"], Range=f"bytes={len(JPEG)}-")
+        assert res.status_code == HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        assert res.headers["content-range"] == f"bytes */{len(JPEG)}"
+        # a range of an older version of the image is not applied
+        res = await self.get(app, client, image["id"], Range="bytes=0-9", **{"If-Range": '"older"'})
+        assert res.status_code == HTTP_200_OK
+        assert res.content == JPEG
+
+    async def test_images_still_in_the_table_are_moved_on_first_read(self, app: FastAPI, client: AsyncClient, db: Database,
+        image_store: LocalImageStore, accident_id: int, driver: UserPublic) -> None:
+        content = bytes(range(256)) * 1000
+        digest = hashlib.sha256(content).hexdigest()
+        id = await db.fetch_val(
+            query="""
+                INSERT INTO accident_statement_image (statement_id, image)
+                SELECT id, :image FROM accident_statement WHERE accident_id = :accident_id AND user_id = :user_id
+                RETURNING id
+            """,
+            values={"image": content, "accident_id": accident_id, "user_id": driver.id})
+        res = await self.get(app, client, id)
+        assert res.status_code == HTTP_200_OK
+        assert res.content == content
+        assert res.headers["content-type"] == "image/jpeg"
+        assert res.headers["etag"] == f'"{digest}"'
+        row = await db.fetch_one(query="SELECT digest, size, image FROM accident_statement_image WHERE id = :id", values={"id": id})
+        assert (row["digest"], row["size"], row["image"]) == (digest, len(content), None)
+        assert await image_store.exists(digest)
+        res = await self.get(app, client, id, Range="bytes=70000-200000")
+        assert res.status_code == HTTP_206_PARTIAL_CONTENT
+        assert res.content == content[70000:200001]
+
+
+class TestImageDerivatives:
+    async def get(self, app: FastAPI, client: AsyncClient, id: int, size: str):
+        return await client.get(app.url_path_for("accident:get-accident-image", id=id), params={"size": size})
+
+    async def test_resized_images_are_rendered_after_upload(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, derivatives: DerivativeCache, accident_id: int) -> None:
+        content = encode_jpeg(2000, 1000)
+        image = (await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.jpg", content))).json()
+        assert os.path.exists(derivatives.get_path(image["digest"], "thumb"))
+        assert os.path.exists(derivatives.get_path(image["digest"], "medium"))
+
+        res = await self.get(app, client, image["id"], "thumb")
+        assert res.status_code == HTTP_200_OK
+        assert res.headers["content-type"] == "image/jpeg"
+        assert res.headers["etag"] == f'"{image["digest"]}-thumb"'
+        assert Image.open(io.BytesIO(res.content)).size == (256, 128)
+        res = await self.get(app, client, image["id"], "medium")
+        assert Image.open(io.BytesIO(res.content)).size == (1024, 512)
+
+    async def test_images_that_can_not_be_resized_are_served_as_uploaded(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, derivatives: DerivativeCache, accident_id: int) -> None:
+        image = (await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.jpg", JPEG))).json()
+        res = await self.get(app, client, image["id"], "thumb")
+        assert res.status_code == HTTP_200_OK
+        assert res.content == JPEG
+        assert res.headers["etag"] == f'"{image["digest"]}"'
+
+    async def test_unknown_sizes_are_rejected(self, app: FastAPI, client: AsyncClient,
+        image_store: LocalImageStore, derivatives: DerivativeCache, accident_id: int) -> None:
+        image = (await upload(app, client, ("accident_id", None, str(accident_id).encode()), ("image", "crash.png", PNG))).json()
+        res = await self.get(app, client, image["id"], "huge")
+        assert res.status_code == HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestDerivativeCache:
+    async def test_least_recently_used_derivatives_are_evicted(self, tmp_path) -> None:
+        source = tmp_path / "source.jpg"
+        source.write_bytes(encode_jpeg(600, 400))
+        derivatives = DerivativeCache(str(tmp_path / "derivatives"), max_bytes=0, create_executor=ThreadPoolExecutor)
+        await derivatives.load()
+        first, length = await derivatives.get("aa" * 32, "thumb", str(source))
+        derivatives.max_bytes = 2 * length
+        second, _ = await derivatives.get("bb" * 32, "thumb", str(source))
+        # a hit makes the first the most recently used
+        assert await derivatives.get("aa" * 32, "thumb", str(source)) == (first, length)
+        third, _ = await derivatives.get("cc" * 32, "thumb", str(source))
+        assert os.path.exists(first) and os.path.exists(third)
+        assert not os.path.exists(second)
+        derivatives.close()
+
+        # the index is rebuilt from the files on startup
+        reloaded = DerivativeCache(derivatives.root, max_bytes=derivatives.max_bytes, create_executor=ThreadPoolExecutor)
+        await reloaded.load()
+        assert set(reloaded.files) == {first, third}
+        assert reloaded.total_bytes == derivatives.total_bytes
+        reloaded.close()
+
+    async def test_concurrent_requests_share_one_render(self, tmp_path) -> None:
+        source = tmp_path / "source.jpg"
+        source.write_bytes(encode_jpeg(600, 400))
+        derivatives = DerivativeCache(str(tmp_path / "derivatives"), max_bytes=1024 * 1024, create_executor=ThreadPoolExecutor)
+        requests = [asyncio.ensure_future(derivatives.get("aa" * 32, "thumb", str(source))) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert len(derivatives.pending) == 1
+        assert len(set(await asyncio.gather(*requests))) == 1
+        assert derivatives.pending == {}
+        derivatives.close()
+
+    async def test_only_unreadable_images_are_remembered(self, tmp_path) -> None:
+        source = tmp_path / "source.jpg"
+        derivatives = DerivativeCache(str(tmp_path / "derivatives"), max_bytes=1024 * 1024, create_executor=ThreadPoolExecutor)
+        # a source that is not there yet is retried
+        assert await derivatives.get("aa" * 32, "thumb", str(source)) is None
+        assert not derivatives.failed
+        source.write_bytes(encode_jpeg(600, 400))
+        assert await derivatives.get("aa" * 32, "thumb", str(source)) is not None
+
+        # a PDF named .jpg is never handed to a decoder other than the image ones
+        other = tmp_path / "other.jpg"
+        other.write_bytes(b"%PDF-1.7\n" * 10)
+        assert await derivatives.get("bb" * 32, "thumb", str(other)) is None
+        assert list(derivatives.failed) == [derivatives.get_path("bb" * 32, "thumb")]
+        derivatives.close()
+
+    async def test_a_broken_pool_is_replaced(self, tmp_path) -> None:
+        class BrokenExecutor(Executor):
+            # a pool whose worker was killed
+            def submit(self, fn, *args, **kwargs):
+                raise BrokenProcessPool("A child process terminated abruptly")
+
+        executors = [BrokenExecutor(), ThreadPoolExecutor()]
+        source = tmp_path / "source.jpg"
+        source.write_bytes(encode_jpeg(600, 400))
+        derivatives = DerivativeCache(str(tmp_path / "derivatives"), max_bytes=1024 * 1024, create_executor=lambda: executors.pop(0))
+        assert await derivatives.get("aa" * 32, "thumb", str(source)) is None
+        assert not derivatives.failed
+        assert await derivatives.get("aa" * 32, "thumb", str(source)) is not None
+        derivatives.close()
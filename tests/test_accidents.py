@@ -0,0 +1,284 @@
+import datetime
+import json
+import uuid
+import pytest
+
+from httpx import AsyncClient
+from fastapi import FastAPI
+from databases import Database
+
+from starlette.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
+import app.api.dependencies.listing
+import app.db.repositories.accident
+from app.api.dependencies.listing import NEXT_CURSOR_HEADER, NDJSON_MEDIA_TYPE
+from app.db.dataloader import DataLoader
+from app.db.repositories.accident import GET_ACCIDENTS_PAGE_BY_USER_ID_QUERY
+from app.db.repositories.vehicles import VehiclesRepository
+from app.models.pagination import FIRST_PAGE_KEY, encode_cursor
+from app.models.users import UserPublic
+from app.models.vehicles import VehiclesCreate
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+LISTER_ID = 9301
+READER_ID = 9311
+OWNER_ID = 9312
+DRIVER_ID = 9313
+WITNESS_ID = 9314
+# date, city, closed_case of the accidents of the lister, oldest first
+ACCIDENTS = [
+    (datetime.datetime(2024, 1, 1, 10), "ATHENS", False),
+    (datetime.datetime(2024, 2, 1, 10), "PATRA", True),
+    (datetime.datetime(2024, 3, 1, 10), "ATHENS", True),
+    (datetime.datetime(2024, 4, 1, 10), "LARISA", False),
+]
+
+
+@pytest.fixture
+def lister(login) -> UserPublic:
+    # a new email per test, so the accidents of earlier tests are not listed
+    return login(id=LISTER_ID, email=f"lister-{uuid.uuid4().hex[:8]}@accidents.com")
+
+
+@pytest.fixture
+async def accident_ids(db: Database, lister: UserPublic) -> list:
+    # accidents the lister was named in as the other driver, newest first like the listing
+    ids = []
+    for date, city, closed_case in ACCIDENTS:
+        accident_id = await db.fetch_val(
+            query="INSERT INTO accident (date, city, address, closed_case) VALUES (:date, :city, 'LIST ADDRESS', :closed_case) RETURNING id",
+            values={"date": date, "city": city, "closed_case": closed_case})
+        await db.execute(
+            query="""
+                INSERT INTO temporary_accident_driver_data (accident_id, driver_full_name, driver_email, vehicle_sign, insurance_number, insurance_email)
+                VALUES (:accident_id, 'LIST DRIVER', :driver_email, 'LST-1001', 'LST-1', 'list@insurer.com')
+            """,
+            values={"accident_id": accident_id, "driver_email": lister.email})
+        ids.append(accident_id)
+    return ids[::-1]
+
+
+async def list_accidents(app: FastAPI, client: AsyncClient, headers: dict = None, **params):
+    return await client.get(app.url_path_for("accident:get-accidents-by-user-id"), params={"expand": "temporary_drivers", **params},
+        headers=headers)
+
+
+class TestListAccidents:
+    async def test_pages_follow_the_next_cursor(self, app: FastAPI, client: AsyncClient, accident_ids: list) -> None:
+        res = await list_accidents(app, client, limit=3)
+        assert res.status_code == HTTP_200_OK
+        assert [accident["id"] for accident in res.json()] == accident_ids[:3]
+        assert res.headers[NEXT_CURSOR_HEADER] == encode_cursor(accident_ids[2])
+
+        res = await list_accidents(app, client, limit=3, cursor=res.headers[NEXT_CURSOR_HEADER])
+        assert [accident["id"] for accident in res.json()] == accident_ids[3:]
+        # a short page is the last one
+        assert NEXT_CURSOR_HEADER not in res.headers
+
+    async def test_a_full_last_page_is_followed_by_an_empty_one(self, app: FastAPI, client: AsyncClient, accident_ids: list) -> None:
+        res = await list_accidents(app, client, limit=2)
+        res = await list_accidents(app, client, limit=2, cursor=res.headers[NEXT_CURSOR_HEADER])
+        assert [accident["id"] for accident in res.json()] == accident_ids[2:]
+        res = await list_accidents(app, client, limit=2, cursor=res.headers[NEXT_CURSOR_HEADER])
+        assert res.status_code == HTTP_200_OK
+        assert res.json() == []
+        assert NEXT_CURSOR_HEADER not in res.headers
+
+    @pytest.mark.parametrize("cursor", ("not a cursor", encode_cursor(10, 20), "YWJj"))
+    async def test_invalid_cursors_are_rejected(self, app: FastAPI, client: AsyncClient, lister: UserPublic, cursor: str) -> None:
+        res = await list_accidents(app, client, cursor=cursor)
+        assert res.status_code == HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize(
+        "params, expected",
+        (
+                ({"date_from": "2024-02-01T00:00:00"}, [3, 2, 1]),
+                # an aware datetime is compared in UTC, 2024-03-01T10:00 is 12:00 in Athens
+                ({"date_from": "2024-03-01T11:00:00+02:00"}, [3, 2]),
+                ({"date_from": "2024-01-01T00:00:00Z", "date_to": "2024-02-15T00:00:00Z"}, [1, 0]),
+                ({"closed_case": "true"}, [2, 1]),
+                ({"closed_case": "false"}, [3, 0]),
+                ({"city": "athens"}, [2, 0]),
+                ({"city": "Athens", "closed_case": "false"}, [0]),
+        ),
+    )
+    async def test_filters(self, app: FastAPI, client: AsyncClient, accident_ids: list, params: dict, expected: list) -> None:
+        res = await list_accidents(app, client, **params)
+        assert res.status_code == HTTP_200_OK
+        # expected indexes the ACCIDENTS rows, oldest first
+        assert [accident["id"] for accident in res.json()] == [accident_ids[::-1][index] for index in expected]
+
+
+@pytest.fixture
+def chunk_size(monkeypatch) -> int:
+    # small chunks, so a handful of rows spans several of them
+    monkeypatch.setattr(app.api.dependencies.listing, "STREAM_CHUNK_SIZE", 2)
+    monkeypatch.setattr(app.db.repositories.accident, "STREAM_CHUNK_SIZE", 2)
+    return 2
+
+
+def read_ndjson(res) -> list:
+    assert res.status_code == HTTP_200_OK
+    assert res.headers["content-type"].startswith(NDJSON_MEDIA_TYPE)
+    return [json.loads(line) for line in res.text.splitlines()]
+
+
+class TestStreamAccidents:
+    @pytest.fixture
+    def page_queries(self, monkeypatch, db: Database) -> list:
+        # the keyset pages read by iterate_accidents and the loader clears between them
+        calls = []
+        fetch_all, clear_all = Database.fetch_all, DataLoader.clear_all
+
+        async def count_fetch_all(self, query, values=None):
+            if query == GET_ACCIDENTS_PAGE_BY_USER_ID_QUERY:
+                calls.append(("page", values["cursor"]))
+            return await fetch_all(self, query=query, values=values)
+
+        def count_clear_all(self):
+            calls.append(("clear_all", None))
+            clear_all(self)
+
+        monkeypatch.setattr(Database, "fetch_all", count_fetch_all)
+        monkeypatch.setattr(DataLoader, "clear_all", count_clear_all)
+        return calls
+
+    async def stream(self, app: FastAPI, client: AsyncClient, **params):
+        return await list_accidents(app, client, headers={"Accept": NDJSON_MEDIA_TYPE}, **params)
+
+    async def test_every_accident_is_streamed_once_newest_first(self, app: FastAPI, client: AsyncClient, accident_ids: list,
+        chunk_size: int, page_queries: list) -> None:
+        accidents = read_ndjson(await self.stream(app, client))
+        assert [accident["id"] for accident in accidents] == accident_ids
+        assert all(accident["temporary_accident_drivers"][0]["driver_full_name"] == "LIST DRIVER" for accident in accidents)
+        # two full chunks, each continued from its last id, and the empty page that ends them
+        assert page_queries == [
+            ("page", FIRST_PAGE_KEY), ("clear_all", None),
+            ("page", accident_ids[1]), ("clear_all", None),
+            ("page", accident_ids[3]),
+        ]
+
+    async def test_a_short_chunk_is_the_last_one(self, app: FastAPI, client: AsyncClient, accident_ids: list,
+        chunk_size: int, page_queries: list) -> None:
+        accidents = read_ndjson(await self.stream(app, client, cursor=encode_cursor(accident_ids[0])))
+        assert [accident["id"] for accident in accidents] == accident_ids[1:]
+        assert page_queries == [
+            ("page", accident_ids[0]), ("clear_all", None),
+            ("page", accident_ids[2]), ("clear_all", None),
+        ]
+
+    async def test_filters_apply_to_the_stream(self, app: FastAPI, client: AsyncClient, accident_ids: list,
+        chunk_size: int) -> None:
+        accidents = read_ndjson(await self.stream(app, client, city="athens"))
+        assert [accident["id"] for accident in accidents] == [accident_ids[1], accident_ids[3]]
+
+
+STATEMENT_EXPANSIONS = "statements.vehicle,statements.role,statements.insurance,statements.sketch,statements.images"
+
+
+@pytest.fixture
+def reader(login) -> UserPublic:
+    return login(id=READER_ID, email="reader@accidents.com", is_superuser=True)
+
+
+async def create_vehicle(db: Database, user_id: int) -> int:
+    vehicle = await VehiclesRepository(db).create_vehicle(
+        new_vehicle=VehiclesCreate(sign=f"TRE-{uuid.uuid4().hex[:6]}", type="car", model="Corolla", manufacture_year=2018), id=user_id)
+    return vehicle.id
+
+
+async def add_statement(db: Database, accident_id: int, vehicle_id: int, user_id: int, role_user_id: int = None) -> int:
+    # the current insurance of the vehicle and the current role of `role_user_id` on it
+    return await db.fetch_val(
+        query="""
+            INSERT INTO accident_statement (user_id, accident_id, vehicle_id, insurance_id, role_id)
+            SELECT :user_id, :accident_id, cr.vehicle_id, ci.insurance_id, cr.role_id
+            FROM current_roles cr INNER JOIN current_insurance ci ON ci.vehicle_id = cr.vehicle_id
+            WHERE cr.vehicle_id = :vehicle_id AND cr.user_id = :role_user_id
+            RETURNING id
+        """,
+        values={"user_id": user_id, "accident_id": accident_id, "vehicle_id": vehicle_id, "role_user_id": role_user_id or user_id})
+
+
+async def add_images(db: Database, statement_id: int, digests: list) -> None:
+    for digest in digests:
+        await db.execute(
+            query="INSERT INTO accident_statement_image (statement_id, digest, size, content_type) VALUES (:statement_id, :digest, 10, 'image/jpeg')",
+            values={"statement_id": statement_id, "digest": digest})
+
+
+class TestGetAccident:
+    async def test_statements_are_expanded_into_the_full_tree(self, app: FastAPI, client: AsyncClient, db: Database,
+        reader: UserPublic) -> None:
+        owner_vehicle_id = await create_vehicle(db, OWNER_ID)
+        driver_vehicle_id = await create_vehicle(db, DRIVER_ID)
+        company_email = f"tree-{uuid.uuid4().hex[:8]}@insurers.com"
+        company_id = await db.fetch_val(
+            query="INSERT INTO insurance_company (name, email) VALUES (:email, :email) RETURNING id", values={"email": company_email})
+        insurance_id = await db.fetch_val(
+            query="""
+                INSERT INTO insurance (number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+                VALUES ('TREE-1', '2020-01-01', '2030-01-01', True, :vehicle_id, :company_id)
+                RETURNING id
+            """,
+            values={"vehicle_id": owner_vehicle_id, "company_id": company_id})
+        accident_id = await db.fetch_val(
+            query="INSERT INTO accident (date, city, address) VALUES (NOW(), 'TREE CITY', 'TREE ADDRESS') RETURNING id")
+        owner_statement_id = await add_statement(db, accident_id, owner_vehicle_id, OWNER_ID)
+        driver_statement_id = await add_statement(db, accident_id, driver_vehicle_id, DRIVER_ID)
+        # a statement of someone without a role on the vehicle, so (vehicle_id, user_id) finds no vehicle
+        witness_statement_id = await add_statement(db, accident_id, owner_vehicle_id, WITNESS_ID, role_user_id=OWNER_ID)
+        await db.execute(
+            query="INSERT INTO accident_statement_sketch (statement_id, sketch) VALUES (:statement_id, :sketch)",
+            values={"statement_id": owner_statement_id, "sketch": "{'offsetX': 1, 'offsetY': 2},{'offsetX': 3, 'offsetY': 4}"})
+        await add_images(db, owner_statement_id, ["a" * 64, "b" * 64])
+        await add_images(db, driver_statement_id, ["c" * 64])
+        roles = {
+            record["user_id"]: record["role_id"]
+            for record in await db.fetch_all(
+                query="SELECT user_id, role_id FROM current_roles WHERE vehicle_id = ANY(:vehicle_ids)",
+                values={"vehicle_ids": [owner_vehicle_id, driver_vehicle_id]})
+        }
+
+        res = await client.get(app.url_path_for("accident:get-accident-by-id", id=str(accident_id)),
+            params={"expand": STATEMENT_EXPANSIONS})
+        assert res.status_code == HTTP_200_OK
+        accident = res.json()
+        assert accident["id"] == accident_id
+        # only the requested subtrees are in the body
+        assert "temporary_accident_drivers" not in accident
+        owner, driver, witness = accident["accident_statement"]
+        assert [owner["id"], driver["id"], witness["id"]] == [owner_statement_id, driver_statement_id, witness_statement_id]
+        assert all("user" not in statement for statement in (owner, driver, witness))
+
+        assert owner["vehicle"]["id"] == owner_vehicle_id
+        assert owner["role"]["id"] == roles[OWNER_ID]
+        assert owner["role"]["user_id"] == OWNER_ID
+        assert owner["insurance"]["id"] == insurance_id
+        assert owner["insurance"]["number"] == "TREE-1"
+        assert owner["insurance"]["insurance_company"]["email"] == company_email
+        assert owner["sketch"] == {"sketch": [{"offsetX": 1, "offsetY": 2}, {"offsetX": 3, "offsetY": 4}]}
+        assert [image["digest"] for image in owner["images"]] == ["a" * 64, "b" * 64]
+
+        assert driver["vehicle"]["id"] == driver_vehicle_id
+        assert driver["role"]["id"] == roles[DRIVER_ID]
+        # vehicles are created with an empty insurance of the default company
+        assert driver["insurance"]["number"] == "ADD INSURANCE"
+        assert driver["insurance"]["insurance_company"]["id"] == 0
+        assert driver["sketch"] is None
+        assert [image["digest"] for image in driver["images"]] == ["c" * 64]
+
+        assert witness["vehicle"] is None
+        assert witness["role"]["id"] == roles[OWNER_ID]
+        assert witness["insurance"]["id"] == insurance_id
+        assert witness["images"] == []
+
+    async def test_accidents_without_statements_have_an_empty_list(self, app: FastAPI, client: AsyncClient, db: Database,
+        reader: UserPublic) -> None:
+        accident_id = await db.fetch_val(
+            query="INSERT INTO accident (date, city, address) VALUES (NOW(), 'TREE CITY', 'EMPTY ADDRESS') RETURNING id")
+        res = await client.get(app.url_path_for("accident:get-accident-by-id", id=str(accident_id)),
+            params={"expand": STATEMENT_EXPANSIONS})
+        assert res.status_code == HTTP_200_OK
+        assert res.json()["accident_statement"] == []
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from app.api.dependencies.auth import get_user_from_claims
+from app.core.cache import InsuranceCompanyCache, TTLCache
+from app.models.insurance_company import InsuranceCompanyInDB
+
+
+class TestTTLCache:
+    def test_returns_cached_value(self) -> None:
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("token", "user")
+        assert cache.get("token") == "user"
+
+    def test_expired_entries_are_dropped(self) -> None:
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("token", "user", ttl=0.01)
+        time.sleep(0.02)
+        assert cache.get("token") is None
+        assert len(cache) == 0
+
+    def test_entries_already_expired_are_not_stored(self) -> None:
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("token", "user", ttl=-5)
+        assert cache.get("token") is None
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+
+class TestInsuranceCompanyCache:
+    def companies(self) -> list:
+        return [InsuranceCompanyInDB(id=id, name=f"COMPANY{id}", email=f"company{id}@company.com") for id in (3, 0, 7, 5)]
+
+    def test_companies_are_indexed_by_id_name_and_email(self) -> None:
+        cache = InsuranceCompanyCache(ttl=60)
+        cache.load(self.companies())
+        assert cache.is_loaded
+        assert cache.get_by_id(7).name == "COMPANY7"
+        assert cache.get_by_name("COMPANY3").id == 3
+        assert cache.get_by_email("company5@company.com").id == 5
+        assert cache.get_by_id(4) is None
+
+    def test_pages_follow_ascending_id(self) -> None:
+        cache = InsuranceCompanyCache(ttl=60)
+        cache.load(self.companies())
+        assert [company.id for company in cache.page(limit=2)] == [0, 3]
+        assert [company.id for company in cache.page(cursor=3, limit=2)] == [5, 7]
+        assert [company.id for company in cache.page(cursor=4)] == [5, 7]
+        assert cache.page(cursor=7, limit=2) == []
+
+    def test_invalidated_or_expired_cache_is_not_loaded(self) -> None:
+        cache = InsuranceCompanyCache(ttl=60)
+        assert not cache.is_loaded
+        cache.load(self.companies())
+        cache.invalidate()
+        assert not cache.is_loaded
+        cache = InsuranceCompanyCache(ttl=0.01)
+        cache.load(self.companies())
+        time.sleep(0.02)
+        assert not cache.is_loaded
+
+
+class TestGetUserFromClaims:
+    CLAIMS = {"user_id": 7, "sub": "driver", "email": "driver@claims.com", "is_active": True, "is_superuser": False, "is_master": False}
+
+    def test_user_is_built_from_full_claims(self) -> None:
+        user = get_user_from_claims(self.CLAIMS)
+        assert (user.id, user.email, user.is_master) == (7, "driver@claims.com", False)
+
+    @pytest.mark.parametrize("claims", (
+            {"email": None},
+            {"email": "driver"},
+            {"is_master": None},
+            {"user_id": None},
+    ))
+    def test_incomplete_claims_go_to_the_users_service(self, claims: dict) -> None:
+        assert get_user_from_claims({**self.CLAIMS, **claims}) is None
+
+    def test_sub_is_not_taken_for_the_email(self) -> None:
+        assert get_user_from_claims({key: value for key, value in self.CLAIMS.items() if key != "email"}) is None
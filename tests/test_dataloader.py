@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+
+from app.db.dataloader import DataLoader
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+
+class FakeFetch:
+    def __init__(self) -> None:
+        self.calls = []
+
+    async def __call__(self, ids):
+        self.calls.append(sorted(ids))
+        return {id: {"id": id} for id in ids if id > 0}
+
+
+class TestDataLoader:
+    async def test_lookups_in_same_tick_are_batched(self) -> None:
+        loader, fetch = DataLoader(None), FakeFetch()
+        first, second = await asyncio.gather(loader.load("roles", 1, fetch), loader.load("roles", 2, fetch))
+        assert first == {"id": 1}
+        assert second == {"id": 2}
+        assert fetch.calls == [[1, 2]]
+
+    async def test_entities_are_loaded_once(self) -> None:
+        loader, fetch = DataLoader(None), FakeFetch()
+        await loader.load("roles", 1, fetch)
+        await loader.load_many("roles", [1, 1, 3], fetch)
+        assert fetch.calls == [[1], [3]]
+
+    async def test_missing_entities_resolve_to_none(self) -> None:
+        loader, fetch = DataLoader(None), FakeFetch()
+        assert await loader.load("roles", -1, fetch) is None
+        assert await loader.load_many("roles", [-1, 2], fetch) == {2: {"id": 2}}
+
+    async def test_clear_forces_reload(self) -> None:
+        loader, fetch = DataLoader(None), FakeFetch()
+        await loader.load("roles", 1, fetch)
+        loader.clear("roles")
+        await loader.load("roles", 1, fetch)
+        assert fetch.calls == [[1], [1]]
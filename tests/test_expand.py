@@ -0,0 +1,29 @@
+import pytest
+
+from app.models.expand import Expand, ACCIDENT_EXPANSIONS
+
+
+class TestExpand:
+    def test_missing_parameter_expands_everything(self) -> None:
+        expand = Expand.parse(None, ACCIDENT_EXPANSIONS)
+        assert expand.is_full
+        assert "statements" in expand
+        assert "vehicle" in expand.child("statements")
+
+    def test_nested_path_implies_its_parent(self) -> None:
+        expand = Expand.parse("statements.vehicle,statements.sketch", ACCIDENT_EXPANSIONS)
+        assert "statements" in expand
+        assert "temporary_drivers" not in expand
+        statements = expand.child("statements")
+        assert "vehicle" in statements
+        assert "sketch" in statements
+        assert "user" not in statements
+
+    def test_empty_parameter_expands_nothing(self) -> None:
+        expand = Expand.parse("", ACCIDENT_EXPANSIONS)
+        assert not expand.is_full
+        assert "statements" not in expand
+
+    def test_unknown_path_is_rejected(self) -> None:
+        with pytest.raises(ValueError):
+            Expand.parse("statements.owner", ACCIDENT_EXPANSIONS)
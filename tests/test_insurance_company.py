@@ -2,9 +2,13 @@ import pytest
 
 from httpx import AsyncClient
 from fastapi import FastAPI
+from databases import Database
 
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_404_NOT_FOUND, HTTP_422_UNPROCESSABLE_ENTITY
 from app.models.insurance_company import InsuranceCompanyCreate, InsuranceCompanyInDB
+from app.core.cache import InsuranceCompanyCache
+from app.db.repositories.base import RepositoryRegistry
+from app.db.repositories.insurance_company import InsuranceCompanyRepository
 
 # decorate all tests with @pytest.mark.asyncio
 pytestmark = pytest.mark.asyncio
@@ -92,3 +96,45 @@ class TestGetInsuranceCompany:
         insurance_companies = [InsuranceCompanyInDB(**l) for l in res.json()]
         assert test_insurance_company in insurance_companies
 
+
+class TestInsuranceCompanyCache:
+    async def test_lookups_and_listing_are_served_from_the_cache(self, app: FastAPI, client: AsyncClient, db: Database) -> None:
+        cache = InsuranceCompanyCache(ttl=60)
+        # not in the table, so only the cache can return it
+        cached = InsuranceCompanyInDB(id=1000000, name="CACHED", email="cached@cached.com")
+        cache.load([cached])
+        insurance_company_repo = RepositoryRegistry(db, insurance_company_cache=cache).get(InsuranceCompanyRepository)
+
+        assert await insurance_company_repo.get_insurance_company_by_id(id=cached.id) == cached
+        assert await insurance_company_repo.get_insurance_company_by_name(name="CACHED") == cached
+        assert await insurance_company_repo.get_insurance_company_by_email(email="cached@cached.com") == cached
+        assert await insurance_company_repo.get_all_insurance_companies(limit=10) == [cached]
+        assert await insurance_company_repo.get_all_insurance_companies(limit=10, cursor=cached.id) == []
+
+    async def test_cache_is_loaded_at_startup(self, app: FastAPI, client: AsyncClient, db: Database) -> None:
+        cache = app.state._insurance_company_cache
+        assert cache.is_loaded
+        assert cache.get_by_id(0).name == "New Insurance"
+
+    async def test_create_invalidates_the_cache(self, app: FastAPI, client: AsyncClient, db: Database) -> None:
+        cache = app.state._insurance_company_cache
+        insurance_company_repo = RepositoryRegistry(db, insurance_company_cache=cache).get(InsuranceCompanyRepository)
+        created = await insurance_company_repo.create_insurance_company(
+            new_insurance_company=InsuranceCompanyCreate(name="cachedcreate", email="create@cachedcreate.com"))
+        assert not cache.is_loaded
+        insurance_companies = await insurance_company_repo.get_all_insurance_companies(limit=None)
+        assert cache.is_loaded
+        assert created in insurance_companies
+
+    async def test_companies_written_elsewhere_are_found_and_reload_the_cache(self, app: FastAPI, client: AsyncClient,
+        db: Database) -> None:
+        cache = app.state._insurance_company_cache
+        # written without the cache, as another worker would
+        created = await InsuranceCompanyRepository(db).create_insurance_company(
+            new_insurance_company=InsuranceCompanyCreate(name="elsewhere", email="elsewhere@elsewhere.com"))
+        assert cache.is_loaded and cache.get_by_id(created.id) is None
+        insurance_company_repo = RepositoryRegistry(db, insurance_company_cache=cache).get(InsuranceCompanyRepository)
+        assert await insurance_company_repo.get_insurance_company_by_email(email="elsewhere@elsewhere.com") == created
+        assert not cache.is_loaded
+        assert await insurance_company_repo.get_insurance_company_by_id(id=created.id) == created
+        assert cache.get_by_id(created.id) == created
@@ -0,0 +1,70 @@
+import datetime
+import pytest
+
+from httpx import AsyncClient
+from fastapi import FastAPI
+from databases import Database
+
+from starlette.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED
+from app.db.repositories.insurance_company import InsuranceCompanyRepository
+from app.db.repositories.vehicles import VehiclesRepository
+from app.models.insurance_company import InsuranceCompanyCreate
+from app.models.vehicles import VehiclesCreate
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+
+class TestImportInsurances:
+    async def test_policies_are_written_or_rejected_per_row(
+        self, app: FastAPI, client: AsyncClient, db: Database, login
+    ) -> None:
+        company = await InsuranceCompanyRepository(db).create_insurance_company(
+            new_insurance_company=InsuranceCompanyCreate(name="bulk insurer", email="bulk@insurer.com"))
+        login(id=9101, email="bulk@insurer.com", is_superuser=True)
+        vehicles_repo = VehiclesRepository(db)
+        new = await vehicles_repo.create_vehicle(
+            new_vehicle=VehiclesCreate(sign="INS-3001", type="car", model="Clio", manufacture_year=2019), id=9102)
+        insured = await vehicles_repo.create_vehicle(
+            new_vehicle=VehiclesCreate(sign="INS-3002", type="car", model="Clio", manufacture_year=2019), id=9102)
+        for sign in ("INS-3003", "INS-3004"):
+            await vehicles_repo.create_vehicle(new_vehicle=VehiclesCreate(sign=sign, type="car", model="Clio", manufacture_year=2019), id=9102)
+
+        today = datetime.date.today()
+        year = datetime.timedelta(days=365)
+        body = "\n".join([
+            "plate,number,start_date,expire_date,damage_coverance",
+            f"INS-3002,BLK-1,{today},{today + year},true",
+            f"ins 3001,BLK-2,{today},{today + year},false",
+            f"INS-3003,BLK-3,{today},{today - year},false",
+            f"INS-9999,BLK-4,{today},{today + year},false",
+            f"INS-3002,BLK-5,{today},{today + year},false",
+            f"INS-3002,BLK-6,not a date,{today},false",
+            f"INS-3004,BLK-7,{today - 2 * year},{today - year},false",
+        ])
+        res = await client.post(app.url_path_for("insurance-company:import-insurances"), content=body, headers={"Content-Type": "text/csv"})
+        assert res.status_code == HTTP_200_OK
+        results = res.json()
+        assert [result["row"] for result in results] == [1, 2, 3, 4, 5, 6, 7]
+        assert [result["accepted"] for result in results] == [False, True, False, False, True, False, False]
+        assert results[0]["errors"] == ["A later row has the same plate"]
+        assert results[2]["errors"] == ["Insurance start date is after expire date"]
+        assert results[3]["errors"] == ["No vehicle found with that plate"]
+        assert results[5]["errors"][0].startswith("start_date")
+        assert results[6]["errors"] == ["This insurance is expired"]
+
+        # placeholders are filled in, so each vehicle still has one insurance
+        assert results[1]["insurance_id"] == new.insurance.id
+        assert results[4]["insurance_id"] == insured.insurance.id
+        policy = await db.fetch_one(query="SELECT number, insurance_company_id FROM insurance WHERE id = :id", values={"id": new.insurance.id})
+        assert (policy["number"], policy["insurance_company_id"]) == ("BLK-2", company.id)
+
+        # the current policies have not expired yet, so a renewal is rejected
+        renewal = f"plate,number,start_date,expire_date,damage_coverance\nINS-3001,BLK-8,{today},{today + year},false"
+        res = await client.post(app.url_path_for("insurance-company:import-insurances"), content=renewal, headers={"Content-Type": "text/csv"})
+        assert res.json()[0]["errors"] == ["Wait current insurance expire"]
+
+    async def test_only_insurance_companies_can_import(self, app: FastAPI, client: AsyncClient, login) -> None:
+        login(id=9103, email="driver@vehicles.com")
+        res = await client.post(app.url_path_for("insurance-company:import-insurances"), content="", headers={"Content-Type": "text/csv"})
+        assert res.status_code == HTTP_401_UNAUTHORIZED
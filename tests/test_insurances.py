@@ -1,3 +1,4 @@
+import datetime
 import pytest
 from httpx import AsyncClient
 from fastapi import FastAPI, status
@@ -11,7 +12,8 @@ from starlette.status import (
 )
 from app.models.insurance import InsuranceAdd, InsuranceInDB
 from app.db.repositories.insurance import InsuranceRepository
-from app.models.vehicles import VehiclesInDB, VehiclesPublic
+from app.models.vehicles import VehiclesCreate, VehiclesInDB, VehiclesPublic
+from app.db.repositories.vehicles import VehiclesRepository
 from databases import Database
 
 # decorate all tests with @pytest.mark.asyncio
@@ -62,3 +64,74 @@ class TestAddInsurance:
     
         added_insurance = InsuranceAdd(**res.json())
         assert added_insurance == new_insurance
+
+
+# the insurance the vehicle listings showed before current_insurance: the latest expire date, the newest on a tie
+LATEST_INSURANCE_QUERY = """
+    SELECT id
+    FROM insurance
+    WHERE vehicle_id = :vehicle_id AND expire_date IS NOT NULL
+    ORDER BY expire_date DESC, id DESC
+    LIMIT 1;
+"""
+
+CURRENT_INSURANCE_QUERY = """
+    SELECT insurance_id FROM current_insurance WHERE vehicle_id = :vehicle_id;
+"""
+
+
+class TestCurrentInsurance:
+    async def create_vehicle(self, db: Database, sign: str) -> int:
+        vehicle = await VehiclesRepository(db).create_vehicle(
+            new_vehicle=VehiclesCreate(sign=sign, type="car", model="Fiesta", manufacture_year=2018), id=9401)
+        return vehicle.id
+
+    async def add_insurance(self, db: Database, vehicle_id: int, expire_date: datetime.date, id: int = None) -> int:
+        return await db.fetch_val(
+            query="""
+                INSERT INTO insurance (id, number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+                VALUES (COALESCE(:id, nextval('insurance_id_seq')), 'CUR-1', '2020-01-01', :expire_date, False, :vehicle_id, 0)
+                RETURNING id
+            """,
+            values={"id": id, "expire_date": expire_date, "vehicle_id": vehicle_id})
+
+    async def assert_current(self, db: Database, vehicle_id: int, insurance_id: int) -> None:
+        values = {"vehicle_id": vehicle_id}
+        assert await db.fetch_val(query=CURRENT_INSURANCE_QUERY, values=values) == insurance_id
+        assert await db.fetch_val(query=LATEST_INSURANCE_QUERY, values=values) == insurance_id
+
+    async def test_inserts_move_the_current_insurance(self, client: AsyncClient, db: Database) -> None:
+        vehicle_id = await self.create_vehicle(db, "CUR-1001")
+        first = await db.fetch_val(query=LATEST_INSURANCE_QUERY, values={"vehicle_id": vehicle_id})
+        await self.assert_current(db, vehicle_id, first)
+        renewed = await self.add_insurance(db, vehicle_id, datetime.date(2030, 1, 1))
+        await self.assert_current(db, vehicle_id, renewed)
+
+    async def test_updates_move_the_current_insurance(self, client: AsyncClient, db: Database) -> None:
+        vehicle_id = await self.create_vehicle(db, "CUR-1002")
+        older = await self.add_insurance(db, vehicle_id, datetime.date(2029, 1, 1))
+        newer = await self.add_insurance(db, vehicle_id, datetime.date(2030, 1, 1))
+        await self.assert_current(db, vehicle_id, newer)
+        await db.execute(query="UPDATE insurance SET expire_date = '2031-01-01' WHERE id = :id", values={"id": older})
+        await self.assert_current(db, vehicle_id, older)
+
+        # moving an insurance to another vehicle refreshes both
+        other_id = await self.create_vehicle(db, "CUR-1003")
+        await db.execute(query="UPDATE insurance SET vehicle_id = :vehicle_id WHERE id = :id", values={"vehicle_id": other_id, "id": older})
+        await self.assert_current(db, vehicle_id, newer)
+        await self.assert_current(db, other_id, older)
+        await db.execute(query="DELETE FROM insurance WHERE id = :id", values={"id": older})
+        await self.assert_current(db, other_id, await db.fetch_val(query=LATEST_INSURANCE_QUERY, values={"vehicle_id": other_id}))
+
+    async def test_out_of_order_ids(self, client: AsyncClient, db: Database) -> None:
+        vehicle_id = await self.create_vehicle(db, "CUR-1004")
+        current = await self.add_insurance(db, vehicle_id, datetime.date(2030, 1, 1))
+        # a newer row that expires earlier does not replace it
+        await self.add_insurance(db, vehicle_id, datetime.date(2029, 1, 1))
+        await self.assert_current(db, vehicle_id, current)
+        # nor does an older id with the same expire date, inserted later
+        await self.add_insurance(db, vehicle_id, datetime.date(2030, 1, 1), id=-vehicle_id)
+        await self.assert_current(db, vehicle_id, current)
+        # an older id that expires later does
+        later = await self.add_insurance(db, vehicle_id, datetime.date(2031, 1, 1), id=-vehicle_id - 1000000)
+        await self.assert_current(db, vehicle_id, later)
@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+
+from httpx import AsyncClient
+from databases import Database
+
+from app.db.prepared import compile_query, fetch_all_prepared, fetch_one_prepared
+from app.db.repositories.insurance_company import (
+    GET_INSURANCE_COMPANIES_BY_IDS_QUERY,
+    InsuranceCompanyRepository,
+)
+from app.models.insurance_company import InsuranceCompanyCreate, InsuranceCompanyInDB
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+
+class TestPreparedQueries:
+
+    async def test_databases_still_has_the_query_lock(self, client: AsyncClient, db: Database) -> None:
+        # fetch_all_prepared, fetch_one_prepared and copy_records share this private lock with `databases`
+        connection = db.connection()
+        assert isinstance(getattr(connection, "_query_lock", None), asyncio.Lock), (
+            "databases.core.Connection._query_lock is gone, app.db.prepared has to be ported to the new databases version")
+        async with connection:
+            assert connection.raw_connection is not None
+
+    async def test_compile_query_numbers_named_params(self) -> None:
+        sql, names = compile_query("SELECT id::text FROM vehicles WHERE id = ANY(:ids) OR (id = :id AND user_id = :id)")
+        assert sql == "SELECT id::text FROM vehicles WHERE id = ANY($1) OR (id = $2 AND user_id = $2)"
+        assert names == ("ids", "id")
+
+    async def test_fast_path_returns_the_same_rows(self, client: AsyncClient, db: Database) -> None:
+        insurance_company_repo = InsuranceCompanyRepository(db)
+        created = await insurance_company_repo.create_insurance_company(
+            new_insurance_company=InsuranceCompanyCreate(name="prepared company", email="prepared@company.com"))
+        values = {"ids": [created.id]}
+        expected = await db.fetch_all(query=GET_INSURANCE_COMPANIES_BY_IDS_QUERY, values=values)
+        records = await fetch_all_prepared(db, query=GET_INSURANCE_COMPANIES_BY_IDS_QUERY, values=values)
+        assert [dict(record) for record in records] == [dict(record) for record in expected]
+        record = await fetch_one_prepared(db, query=GET_INSURANCE_COMPANIES_BY_IDS_QUERY, values=values)
+        assert InsuranceCompanyInDB(**record) == created
@@ -0,0 +1,67 @@
+import pytest
+
+from httpx import AsyncClient
+from databases import Database
+
+from app.db.plans import (
+    LARGE_TABLES,
+    discover_queries,
+    explain,
+    get_sample_values,
+    get_seq_scans,
+    seed_plan_dataset,
+)
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+# these read the whole table on purpose
+FULL_SCAN_QUERIES = {
+    "accident.GET_ALL_ACCIDENTS_QUERY",
+    "accident_statement.GET_ALL_ACCIDENT_STATEMENTS_QUERY",
+    "insurance.GET_ALL_INSURANCES_QUERY",
+}
+
+
+class TestQueryPlans:
+
+    async def test_queries_do_not_scan_large_tables(self, client: AsyncClient, db: Database) -> None:
+        # the dataset is rolled back, so the other tests never see it
+        transaction = db.transaction()
+        await transaction.start()
+        try:
+            await seed_plan_dataset(db)
+            values = await get_sample_values(db)
+            seq_scans = {}
+            for name, query in discover_queries().items():
+                if name in FULL_SCAN_QUERIES:
+                    continue
+                # with sequential scans disabled the planner only falls back to one when no index fits
+                plan = await explain(db, query, values, enable_seqscan=False)
+                tables = get_seq_scans(plan, LARGE_TABLES)
+                if tables:
+                    seq_scans[name] = tables
+        finally:
+            await transaction.rollback()
+        assert seq_scans == {}
+
+    async def test_seeding_is_rolled_back_and_repeatable(self, client: AsyncClient, db: Database) -> None:
+        count_query = "SELECT COUNT(*) FROM vehicles WHERE sign LIKE 'PLN-%'"
+        statements_query = "SELECT COUNT(*) FROM accident_statement"
+        statements = await db.fetch_val(query=statements_query)
+        transaction = db.transaction()
+        await transaction.start()
+        try:
+            await seed_plan_dataset(db, vehicles=20, companies=2, users=5, accidents=10)
+            seeded = await db.fetch_val(query=statements_query)
+            await seed_plan_dataset(db, vehicles=20, companies=2, users=5, accidents=10)
+            assert await db.fetch_val(query=count_query) == 20
+            assert await db.fetch_val(query=statements_query) == seeded
+            # statements only go to the seeded vehicles
+            assert await db.fetch_val(query="""
+                SELECT COUNT(*) FROM accident_statement s INNER JOIN vehicles v ON v.id = s.vehicle_id
+                WHERE v.sign LIKE 'PLN-%'
+            """) == seeded - statements
+        finally:
+            await transaction.rollback()
+        assert await db.fetch_val(query=count_query) == 0
@@ -0,0 +1,75 @@
+import pytest
+
+from httpx import AsyncClient
+from databases import Database
+
+from app.db.repositories.roles import RolesRepository
+from app.db.repositories.vehicles import VehiclesRepository
+from app.models.roles import RoleCreate, RoleUpdate
+from app.models.vehicles import VehiclesCreate
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+OWNER_ID = 9501
+DRIVER_ID = 9502
+
+# the role GET_LAST_USER_ROLE_BY_VEHICLE_USER_ID_QUERY read before current_roles
+LAST_ROLE_QUERY = """
+    SELECT id
+    FROM roles
+    WHERE vehicle_id = :vehicle_id AND user_id = :user_id
+    ORDER BY id DESC
+    LIMIT 1;
+"""
+
+
+class TestCurrentRoles:
+    async def create_vehicle(self, db: Database, sign: str) -> int:
+        vehicle = await VehiclesRepository(db).create_vehicle(
+            new_vehicle=VehiclesCreate(sign=sign, type="car", model="Corsa", manufacture_year=2017), id=OWNER_ID)
+        return vehicle.id
+
+    async def assert_current(self, db: Database, vehicle_id: int, user_id: int, role_id: int) -> None:
+        role = await RolesRepository(db).get_user_role_by_vehicle_user_id(vehicle_id=vehicle_id, user_id=user_id)
+        assert (role and role.id) == role_id
+        assert await db.fetch_val(query=LAST_ROLE_QUERY, values={"vehicle_id": vehicle_id, "user_id": user_id}) == role_id
+
+    async def test_new_roles_become_current(self, client: AsyncClient, db: Database) -> None:
+        vehicle_id = await self.create_vehicle(db, "ROL-1001")
+        roles_repo = RolesRepository(db)
+        first = await db.fetch_val(query=LAST_ROLE_QUERY, values={"vehicle_id": vehicle_id, "user_id": OWNER_ID})
+        await self.assert_current(db, vehicle_id, OWNER_ID, first)
+        driver = await roles_repo.create_new_role_of_user_for_vehicle(
+            new_role=RoleCreate(role="user", user_id=DRIVER_ID, vehicle_id=vehicle_id), vehicle_id=vehicle_id, user_id=DRIVER_ID)
+        await self.assert_current(db, vehicle_id, DRIVER_ID, driver["id"])
+        owner = await roles_repo.create_new_role_of_user_for_vehicle(
+            new_role=RoleCreate(role="not a user anymore", user_id=OWNER_ID, vehicle_id=vehicle_id), vehicle_id=vehicle_id, user_id=OWNER_ID)
+        await self.assert_current(db, vehicle_id, OWNER_ID, owner["id"])
+        # the other user's role is left alone
+        await self.assert_current(db, vehicle_id, DRIVER_ID, driver["id"])
+
+    async def test_updates_keep_current_roles_in_step(self, client: AsyncClient, db: Database) -> None:
+        vehicle_id = await self.create_vehicle(db, "ROL-1002")
+        roles_repo = RolesRepository(db)
+        role = await roles_repo.update_role(vehicle_id=vehicle_id, user_id=OWNER_ID, role_update=RoleUpdate(role="owner"))
+        await self.assert_current(db, vehicle_id, OWNER_ID, role.id)
+        assert (await roles_repo.get_user_role_by_vehicle_user_id(vehicle_id=vehicle_id, user_id=OWNER_ID)).role == "owner"
+
+        # handing the role to another user moves it between the pairs
+        await db.execute(query="UPDATE roles SET user_id = :user_id WHERE id = :id", values={"user_id": DRIVER_ID, "id": role.id})
+        await self.assert_current(db, vehicle_id, DRIVER_ID, role.id)
+        assert await roles_repo.get_user_role_by_vehicle_user_id(vehicle_id=vehicle_id, user_id=OWNER_ID) is None
+        await db.execute(query="DELETE FROM roles WHERE id = :id", values={"id": role.id})
+        assert await roles_repo.get_user_role_by_vehicle_user_id(vehicle_id=vehicle_id, user_id=DRIVER_ID) is None
+
+    async def test_older_ids_inserted_later_are_not_current(self, client: AsyncClient, db: Database) -> None:
+        vehicle_id = await self.create_vehicle(db, "ROL-1003")
+        current = await db.fetch_val(query=LAST_ROLE_QUERY, values={"vehicle_id": vehicle_id, "user_id": OWNER_ID})
+        await db.execute(
+            query="INSERT INTO roles (id, role, user_id, vehicle_id) VALUES (:id, 'user', :user_id, :vehicle_id)",
+            values={"id": -vehicle_id, "user_id": OWNER_ID, "vehicle_id": vehicle_id})
+        await self.assert_current(db, vehicle_id, OWNER_ID, current)
+        # and take over once the newer one is gone
+        await db.execute(query="DELETE FROM roles WHERE id = :id", values={"id": current})
+        await self.assert_current(db, vehicle_id, OWNER_ID, -vehicle_id)
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import pytest
+
+from httpx import AsyncClient
+from databases import Database
+
+from app.core.storage import ImageStore, LocalImageStore, iter_bytes
+from app.db.repositories.accident_image import AccidentImageRepository
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+
+async def read(store: LocalImageStore, digest: str) -> bytes:
+    return b"".join([chunk async for chunk in store.iter_chunks(digest)])
+
+
+class TestImageStore:
+    async def test_backends_must_implement_the_whole_interface(self) -> None:
+        class PartialImageStore(ImageStore):
+            async def exists(self, digest: str) -> bool:
+                return False
+
+        with pytest.raises(TypeError, match="open_upload"):
+            PartialImageStore()
+
+
+class TestLocalImageStore:
+    async def test_content_is_stored_under_its_digest(self, tmp_path) -> None:
+        store = LocalImageStore(str(tmp_path), chunk_size=4)
+        content = b"not really a jpeg"
+        digest, size = await store.put(iter_bytes(content, chunk_size=5))
+        assert digest == hashlib.sha256(content).hexdigest()
+        assert size == len(content)
+        assert store.get_path(digest) == os.path.join(str(tmp_path), digest[:2], digest[2:4], digest)
+        assert await store.exists(digest)
+        assert await read(store, digest) == content
+        assert os.listdir(os.path.join(str(tmp_path), "tmp")) == []
+
+    async def test_duplicate_uploads_keep_one_copy(self, tmp_path) -> None:
+        store = LocalImageStore(str(tmp_path))
+        first = await store.put(iter_bytes(b"same image"))
+        second = await store.put(iter_bytes(b"same image"))
+        assert first == second
+        assert os.listdir(os.path.dirname(store.get_path(first[0]))) == [first[0]]
+        assert os.listdir(os.path.join(str(tmp_path), "tmp")) == []
+
+    async def test_failed_upload_leaves_nothing_behind(self, tmp_path) -> None:
+        store = LocalImageStore(str(tmp_path))
+
+        async def broken_upload():
+            yield b"half an image"
+            raise ConnectionError
+
+        with pytest.raises(ConnectionError):
+            await store.put(broken_upload())
+        assert os.listdir(str(tmp_path)) == ["tmp"]
+        assert os.listdir(os.path.join(str(tmp_path), "tmp")) == []
+
+    async def test_missing_content_raises(self, tmp_path) -> None:
+        store = LocalImageStore(str(tmp_path))
+        assert not await store.exists("0" * 64)
+        with pytest.raises(FileNotFoundError):
+            await read(store, "0" * 64)
+
+
+class TestMoveImagesToStore:
+    async def test_bytea_images_are_moved_in_batches(self, tmp_path, client: AsyncClient, db: Database) -> None:
+        store = LocalImageStore(str(tmp_path))
+        contents = [b"first image", b"second image", b"first image"]
+        ids = [
+            await db.fetch_val(query="INSERT INTO accident_statement_image (image) VALUES (:image) RETURNING id", values={"image": content})
+            for content in contents
+        ]
+        accident_image_repo = AccidentImageRepository(db)
+
+        moved = await accident_image_repo.move_images_to_store(store=store, cursor_id=ids[0] - 1, limit=2, content_type="image/jpeg")
+        assert moved == ids[:2]
+        moved = await accident_image_repo.move_images_to_store(store=store, cursor_id=moved[-1], limit=2, content_type="image/jpeg")
+        assert moved == ids[2:]
+        assert await accident_image_repo.move_images_to_store(store=store, cursor_id=ids[0] - 1, limit=2, content_type="image/jpeg") == []
+
+        for id, content in zip(ids, contents):
+            image = await accident_image_repo.get_image(id=id)
+            assert image.image is None
+            assert image.digest == hashlib.sha256(content).hexdigest()
+            assert image.size == len(content)
+            assert image.content_type == "image/jpeg"
+            assert await read(store, image.digest) == content
@@ -0,0 +1,60 @@
+import pytest
+
+from starlette.status import HTTP_200_OK, HTTP_404_NOT_FOUND
+
+from app.db.repositories.users import UsersRepository
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+
+class StubResponse:
+    def __init__(self, status_code: int, content: dict = None) -> None:
+        self.status_code = status_code
+        self.content = content
+
+    def json(self) -> dict:
+        return self.content
+
+
+class StubUsersClient:
+    """
+    Stands in for the shared httpx client, the pinned httpx has no MockTransport.
+    Answers /api/profiles/<user_id>/ for the known user ids and records every url asked for.
+
+    """
+
+    def __init__(self, user_ids) -> None:
+        self.user_ids = set(user_ids)
+        self.urls = []
+
+    async def get(self, url: str, headers: dict = None) -> StubResponse:
+        self.urls.append(url)
+        user_id = int(url.strip("/").split("/")[-1])
+        if user_id not in self.user_ids:
+            return StubResponse(HTTP_404_NOT_FOUND)
+        return StubResponse(HTTP_200_OK, {"id": user_id, "user_id": user_id, "email": f"user{user_id}@users.com"})
+
+
+class TestGetOtherUsers:
+    async def test_profiles_are_fetched_once_per_distinct_id(self) -> None:
+        client = StubUsersClient(user_ids=[1, 2])
+        users_repo = UsersRepository(client, token="token")
+        profiles = await users_repo.get_other_users(user_ids=[2, 1, 2, 3, 1])
+        assert list(profiles) == [2, 1, 3]
+        assert profiles[1].email == "user1@users.com"
+        assert profiles[2].user_id == 2
+        # a user without a profile comes back as None
+        assert profiles[3] is None
+        assert sorted(client.urls) == ["/api/profiles/1/", "/api/profiles/2/", "/api/profiles/3/"]
+
+        # the second call of the request is served from the futures of the first
+        assert await users_repo.get_other_users(user_ids=[3, 2, 1, 1]) == {3: None, 2: profiles[2], 1: profiles[1]}
+        assert await users_repo.get_other_user(user_id=2) == profiles[2]
+        assert len(client.urls) == 3
+
+    async def test_each_request_has_its_own_profiles(self) -> None:
+        client = StubUsersClient(user_ids=[1])
+        await UsersRepository(client, token="token").get_other_users(user_ids=[1, 1])
+        await UsersRepository(client, token="token").get_other_users(user_ids=[1, 1])
+        assert client.urls == ["/api/profiles/1/", "/api/profiles/1/"]
@@ -0,0 +1,64 @@
+import json
+import pytest
+
+from httpx import AsyncClient
+from fastapi import FastAPI
+from databases import Database
+
+from starlette.status import HTTP_200_OK, HTTP_415_UNSUPPORTED_MEDIA_TYPE
+from app.models.users import UserPublic
+
+# decorate all tests with @pytest.mark.asyncio
+pytestmark = pytest.mark.asyncio
+
+FLEET_OWNER_ID = 9001
+
+
+@pytest.fixture
+def fleet_owner(login) -> UserPublic:
+    return login(id=FLEET_OWNER_ID, email="fleet@owner.com", username="fleet")
+
+
+class TestImportVehicles:
+    async def test_csv_import_reports_every_row(self, app: FastAPI, client: AsyncClient, db: Database, fleet_owner: UserPublic) -> None:
+        body = "\n".join([
+            "sign,type,model,manufacture_year",
+            "FLT-1001,car,Octavia,2019",
+            "FLT-1002,truck,Actros,2018",
+            "FLT-1001,car,Octavia,2020",
+            "F!,car,Octavia,2019",
+            "FLT-1003,car",
+        ])
+        res = await client.post(app.url_path_for("vehicles:import-vehicles"), content=body, headers={"Content-Type": "text/csv"})
+        assert res.status_code == HTTP_200_OK
+        report = res.json()
+        assert [(row["row"], row["status"]) for row in report["rows"]] == [
+            (1, "duplicate"), (2, "created"), (3, "created"), (4, "invalid"), (5, "invalid"),
+        ]
+        assert (report["created"], report["updated"], report["duplicate"], report["invalid"]) == (2, 0, 1, 2)
+        assert report["rows"][0]["id"] == report["rows"][2]["id"]
+        assert report["rows"][3]["errors"]
+
+        # the last row of a sign wins, and every vehicle has a placeholder insurance and an owner role
+        vehicle = await db.fetch_one(query="SELECT id, manufacture_year FROM vehicles WHERE sign = 'FLT-1001'")
+        assert vehicle["manufacture_year"] == 2020
+        role = await db.fetch_one(
+            query="SELECT r.role FROM current_roles cr INNER JOIN roles r ON r.id = cr.role_id WHERE cr.vehicle_id = :id AND cr.user_id = :user_id",
+            values={"id": vehicle["id"], "user_id": FLEET_OWNER_ID})
+        assert role["role"] == "owner"
+        assert await db.fetch_val(query="SELECT COUNT(*) FROM insurance WHERE vehicle_id = :id", values={"id": vehicle["id"]}) == 1
+        assert await db.fetch_val(query="SELECT COUNT(*) FROM vehicle_import") == 0
+
+    async def test_ndjson_import_updates_existing_vehicles(self, app: FastAPI, client: AsyncClient, db: Database, fleet_owner: UserPublic) -> None:
+        rows = [{"sign": "FLT-2001", "type": "bus", "model": "Citaro", "manufacture_year": 2015}]
+        body = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+        headers = {"Content-Type": "application/x-ndjson"}
+        first = (await client.post(app.url_path_for("vehicles:import-vehicles"), content=body, headers=headers)).json()
+        second = (await client.post(app.url_path_for("vehicles:import-vehicles"), content=body, headers=headers)).json()
+        assert [row["status"] for row in first["rows"]] == ["created", "invalid"]
+        assert [row["status"] for row in second["rows"]] == ["updated", "invalid"]
+        assert await db.fetch_val(query="SELECT COUNT(*) FROM roles WHERE vehicle_id = :id", values={"id": first["rows"][0]["id"]}) == 1
+
+    async def test_other_media_types_are_rejected(self, app: FastAPI, client: AsyncClient, fleet_owner: UserPublic) -> None:
+        res = await client.post(app.url_path_for("vehicles:import-vehicles"), json=[])
+        assert res.status_code == HTTP_415_UNSUPPORTED_MEDIA_TYPE
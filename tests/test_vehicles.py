@@ -1,7 +1,10 @@
+import json
+import uuid
 import pytest
 
 from httpx import AsyncClient
 from fastapi import FastAPI
+from databases import Database
 
 from starlette.status import (
     HTTP_200_OK,
@@ -11,7 +14,11 @@ from starlette.status import (
     HTTP_404_NOT_FOUND,
     HTTP_422_UNPROCESSABLE_ENTITY,
 )
+import app.api.dependencies.listing
+from app.api.dependencies.listing import NDJSON_MEDIA_TYPE
+from app.models.pagination import encode_cursor
 from app.models.vehicles import VehiclesCreate, VehiclesInDB
+from app.db.repositories.vehicles import VehiclesRepository
 
 # decorate all tests with @pytest.mark.asyncio
 pytestmark = pytest.mark.asyncio
@@ -97,3 +104,153 @@ class TestGetVehicle:
         vehicles = [VehiclesInDB(**l) for l in res.json()]
         assert test_vehicle in vehicles
 
+
+class TestCreateVehicleStatement:
+    async def test_create_vehicle_returns_insurance_and_role(self, client: AsyncClient, db: Database) -> None:
+        vehicles_repo = VehiclesRepository(db)
+        new_vehicle = VehiclesCreate(sign="CTE-5512", type="car", model="Golf", manufacture_year=2016)
+        created = await vehicles_repo.create_vehicle(new_vehicle=new_vehicle, id=5512)
+        assert created.sign == "CTE-5512"
+        assert created.roles.user_id == 5512 and created.roles.vehicle_id == created.id
+        assert created.insurance.number == "ADD INSURANCE"
+        assert created.insurance.insurance_company.id == 0
+
+        # a second user registering the same plate shares the vehicle and its insurance
+        shared = await vehicles_repo.create_vehicle(new_vehicle=new_vehicle, id=5513)
+        assert shared.id == created.id
+        assert shared.insurance.id == created.insurance.id
+        assert shared.roles.user_id == 5513
+        insurances = await db.fetch_val(query="SELECT COUNT(*) FROM insurance WHERE vehicle_id = :id", values={"id": created.id})
+        assert insurances == 1
+        assert await vehicles_repo.get_vehicle_by_id(id=created.id, user_id=5513) == shared
+
+class TestGetVehicleByPlate:
+    @pytest.mark.parametrize(
+        "sign, found",
+        (
+                ("ΡΚΤ-4821", True),
+                ("pkt 4821", True),
+                ("PKT4821", True),
+                ("PKT-4822", False),
+                ("ΡΚΞ-4821", False),
+        ),
+    )
+    async def test_plate_matches_normalized_sign(self, client: AsyncClient, db: Database, sign: str, found: bool) -> None:
+        vehicles_repo = VehiclesRepository(db)
+        created = await vehicles_repo.create_vehicle(
+            new_vehicle=VehiclesCreate(sign="PKT-4821", type="car", model="Polo", manufacture_year=2018), id=4821)
+        vehicle = await vehicles_repo.get_vehicle_by_user_id_plate(sign=sign, user_id=4821, populate=False)
+        assert (vehicle is not None) == found
+        if found:
+            assert vehicle.id == created.id
+        assert await vehicles_repo.get_vehicle_by_user_id_plate(sign=sign, user_id=4822, populate=False) is None
+
+
+class TestSearchVehicles:
+    async def test_search_ranks_plate_and_insurance_number_matches(self, client: AsyncClient, db: Database) -> None:
+        vehicles_repo = VehiclesRepository(db)
+        created = await vehicles_repo.create_vehicle(
+            new_vehicle=VehiclesCreate(sign="TXP-7310", type="car", model="Yaris", manufacture_year=2017), id=7310)
+        await vehicles_repo.create_vehicle(
+            new_vehicle=VehiclesCreate(sign="TXP-7319", type="car", model="Yaris", manufacture_year=2017), id=7319)
+
+        results = await vehicles_repo.search_vehicles(query="txp7310", limit=10)
+        assert results[0].id == created.id
+        assert results[0].rank > results[-1].rank or len(results) == 1
+
+        # greek look-alike letters and a misspelled plate still find it
+        assert results == await vehicles_repo.search_vehicles(query="ΤΧΡ 7310", limit=10)
+        assert created.id in [vehicle.id for vehicle in await vehicles_repo.search_vehicles(query="TXP-731O", limit=10)]
+
+        # users only see their own vehicles
+        own = await vehicles_repo.search_vehicles_by_user_id(query="TXP-73", user_id=7310, limit=10)
+        assert [vehicle.id for vehicle in own] == [created.id]
+
+    async def test_insurance_companies_only_see_vehicles_they_insure(self, client: AsyncClient, db: Database) -> None:
+        vehicles_repo = VehiclesRepository(db)
+        company_ids = {}
+        for email in ("txq-first@insurers.test", "txq-second@insurers.test"):
+            company_ids[email] = await db.fetch_val(
+                query="INSERT INTO insurance_company (name, email) VALUES (:email, :email) RETURNING id", values={"email": email})
+        vehicle_ids = {}
+        for sign, email in (("TXQ-7410", "txq-first@insurers.test"), ("TXQ-7411", "txq-second@insurers.test")):
+            vehicle = await vehicles_repo.create_vehicle(
+                new_vehicle=VehiclesCreate(sign=sign, type="car", model="Yaris", manufacture_year=2017), id=7410)
+            await db.execute(
+                query="""
+                    INSERT INTO insurance (number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+                    VALUES (:number, '2020-01-01', '2030-01-01', False, :vehicle_id, :insurance_company_id)
+                """,
+                values={"number": f"INS-{sign}", "vehicle_id": vehicle.id, "insurance_company_id": company_ids[email]})
+            vehicle_ids[email] = vehicle.id
+
+        results = await vehicles_repo.search_vehicles_by_insurance_company(
+            query="TXQ-741", insurance_company_email="txq-first@insurers.test", limit=10)
+        assert [vehicle.id for vehicle in results] == [vehicle_ids["txq-first@insurers.test"]]
+        assert {vehicle.id for vehicle in await vehicles_repo.search_vehicles(query="TXQ-741", limit=10)} == set(vehicle_ids.values())
+
+
+STREAM_OWNER_ID = 9601
+
+
+@pytest.fixture
+def chunk_size(monkeypatch) -> int:
+    monkeypatch.setattr(app.api.dependencies.listing, "STREAM_CHUNK_SIZE", 2)
+    return 2
+
+
+@pytest.fixture
+async def streamed_company(db: Database) -> tuple:
+    # a new company insuring three new vehicles, newest first as they are listed
+    email = f"stream-{uuid.uuid4().hex[:8]}@insurers.com"
+    company_id = await db.fetch_val(
+        query="INSERT INTO insurance_company (name, email) VALUES (:email, :email) RETURNING id", values={"email": email})
+    vehicles = []
+    for n in range(3):
+        vehicle = await VehiclesRepository(db).create_vehicle(
+            new_vehicle=VehiclesCreate(sign=f"STR-{uuid.uuid4().hex[:6]}", type="car", model="Golf", manufacture_year=2016),
+            id=STREAM_OWNER_ID)
+        insurance_id = await db.fetch_val(
+            query="""
+                INSERT INTO insurance (number, start_date, expire_date, damage_coverance, vehicle_id, insurance_company_id)
+                VALUES ('STREAM-1', '2020-01-01', '2030-01-01', False, :vehicle_id, :company_id)
+                RETURNING id
+            """,
+            values={"vehicle_id": vehicle.id, "company_id": company_id})
+        vehicles.append((vehicle.id, insurance_id))
+    return email, vehicles[::-1]
+
+
+async def stream_vehicles(app: FastAPI, client: AsyncClient, route: str, **params) -> list:
+    res = await client.get(app.url_path_for(route), params=params, headers={"Accept": NDJSON_MEDIA_TYPE})
+    assert res.status_code == HTTP_200_OK
+    assert res.headers["content-type"].startswith(NDJSON_MEDIA_TYPE)
+    return [json.loads(line) for line in res.text.splitlines()]
+
+
+class TestStreamVehicles:
+    async def test_master_streams_every_vehicle_role_once(self, app: FastAPI, client: AsyncClient, db: Database, login,
+        chunk_size: int, streamed_company: tuple) -> None:
+        login(id=9602, email="master@vehicles.com", is_master=True)
+        _, vehicles = streamed_company
+        vehicle_ids = [vehicle_id for vehicle_id, _ in vehicles]
+        rows = await stream_vehicles(app, client, "vehicles:get-all-vehicles")
+        ids = [row["id"] for row in rows]
+        # one row per role of a vehicle with a current insurance
+        assert len(ids) == await db.fetch_val(
+            query="SELECT COUNT(*) FROM roles r INNER JOIN current_insurance ci ON ci.vehicle_id = r.vehicle_id")
+        assert ids == sorted(ids, reverse=True)
+        assert [id for id in ids if id in vehicle_ids] == vehicle_ids
+
+        role_id = await db.fetch_val(query="SELECT id FROM roles WHERE vehicle_id = :vehicle_id", values={"vehicle_id": vehicle_ids[0]})
+        rows = await stream_vehicles(app, client, "vehicles:get-all-vehicles", cursor=encode_cursor(vehicle_ids[0], role_id))
+        assert [row["id"] for row in rows] == ids[ids.index(vehicle_ids[0]) + 1:]
+
+    async def test_insurance_companies_stream_the_vehicles_they_insure(self, app: FastAPI, client: AsyncClient,
+        login, chunk_size: int, streamed_company: tuple) -> None:
+        email, vehicles = streamed_company
+        login(id=9603, email=email, is_superuser=True)
+        rows = await stream_vehicles(app, client, "vehicles:get-all-vehicles-by-user-id")
+        assert [(row["id"], row["insurance_id"]) for row in rows] == vehicles
+        rows = await stream_vehicles(app, client, "vehicles:get-all-vehicles-by-user-id", cursor=encode_cursor(*vehicles[0]))
+        assert [(row["id"], row["insurance_id"]) for row in rows] == vehicles[1:]